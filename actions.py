@@ -0,0 +1,120 @@
+# actions.py
+"""
+Action registry.
+
+Every task action is declared once here, with its yield distribution, cost
+and duration. Both turn resolvers dispatch through roll_action(), so adding
+an action is a single register_action() call. Gathering and planting
+actions are pure data (item key, min, max); the rest have a handler. The
+caller passes the RNG: the turn resolvers use one per task (see
+game_logic.task_rng), so a task rolls the same however the turn is split.
+"""
+
+from collections import defaultdict
+import random
+import time
+from models import SHILLINGS_PER_POUND
+
+# Weighted distribution for "Work for the King" pay: bias to 8-10
+KING_PAY_POUNDS = [8, 8, 8, 9, 9, 10, 10, 10, 11, 12, 13, 14, 15]
+
+class Action:
+    """
+    One task action.
+      - yields: (item_key, min_qty, max_qty) for gathering/planting actions,
+      - handler: fn(params, rng) -> result dict, for everything else,
+      - cost_shillings: charged by start_task when the task is queued,
+      - duration: turns between start and resolution.
+    """
+
+    def __init__(self, name, yields=None, handler=None, cost_shillings=0, duration=1):
+        self.name = name
+        self.yields = yields
+        self.handler = handler
+        self.cost_shillings = cost_shillings
+        self.duration = duration
+
+    def roll(self, params: dict, rng=random):
+        if self.yields:
+            key, low, high = self.yields
+            return {"gained": {key: rng.randint(low, high)}}
+        if self.handler:
+            return self.handler(params, rng)
+        return {"ok": True}
+
+ACTIONS = {}
+# default no-op for unknown actions
+NOOP_ACTION = Action("noop")
+
+# action name -> [resolved count, seconds spent rolling]
+_stats = defaultdict(lambda: [0, 0.0])
+
+def register_action(name: str, aliases=(), **spec):
+    action = Action(name, **spec)
+    ACTIONS[name] = action
+    for alias in aliases:
+        ACTIONS[alias] = action
+    return action
+
+def get_action(name: str):
+    return ACTIONS.get(name, NOOP_ACTION)
+
+def roll_action(name: str, params: dict, rng=random):
+    """Roll the outcome of one task. Touches no rows: callers apply the result."""
+    started = time.perf_counter()
+    result = get_action(name).roll(params or {}, rng)
+    _record(name, 1, started)
+    return result
+
+def _record(name: str, count: int, started: float):
+    entry = _stats[name]
+    entry[0] += count
+    entry[1] += time.perf_counter() - started
+
+def action_stats():
+    """Per-action resolution counters and cumulative roll time since start (or reset)."""
+    return {name: {"resolved": count, "seconds": seconds} for name, (count, seconds) in _stats.items()}
+
+def merge_action_stats(stats: dict):
+    """Add counters in action_stats() form, e.g. the ones a pool worker recorded."""
+    for name, entry in stats.items():
+        _stats[name][0] += entry["resolved"]
+        _stats[name][1] += entry["seconds"]
+
+def reset_action_stats():
+    _stats.clear()
+
+# ------ Handlers ------
+def _work_for_king(params, rng):
+    pounds = rng.choice(KING_PAY_POUNDS)
+    return {"earned_shillings": pounds * SHILLINGS_PER_POUND}
+
+def _try_swim(params, rng):
+    if rng.random() < 0.10:
+        return {"swim": "success"}
+    # immediate HP loss and relocation handled by caller/routes after reading result
+    return {"swim": "failed", "hp_lost": 1}
+
+def _study_geography(params, rng):
+    return {"discovered": rng.random() < 0.5}
+
+def _study(params, rng):
+    # grant intel sometimes
+    if rng.random() < 0.5:
+        return {"intelligence_gained": 1}
+    return {"intelligence_gained": 0}
+
+# ------ Registry ------
+register_action("gather_mushrooms", yields=("mushroom", 2, 7), aliases=("gather_forest",))
+register_action("gather_chestnuts", yields=("chestnut", 2, 7))
+register_action("gather_wild_herbs", yields=("wild_herb", 2, 4))
+register_action("gather_fruits", yields=("fruit", 0, 3))
+register_action("plant_wheat", yields=("bag_of_wheat", 2, 7))
+register_action("plant_vegetable", yields=("vegetable", 1, 3))
+register_action("work_for_king", handler=_work_for_king)
+# Mark user param 'aboard' (implementation detail: you can store flags in Task.result or a user field)
+register_action("embark", handler=lambda params, rng: {"embarked": True})
+register_action("disembark", handler=lambda params, rng: {"disembarked": True})
+register_action("try_swim", handler=_try_swim)
+register_action("study_geography", handler=_study_geography)
+register_action("study", handler=_study)
@@ -1,23 +1,39 @@
+import hmac
 import os
+import click
 from datetime import datetime, timezone
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, abort
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, flash, abort
 from werkzeug.security import generate_password_hash, check_password_hash
-
-db = SQLAlchemy()
-migrate = None
+from extensions import db, migrate
+import instrumentation
+import pooling
+from identity import current_user
+import catalog
+import inventory
+import snapshots
+import voyages
+from bootstrap import SCHEMA_VERSION, bootstrap_world, schema_is_current
+from game_logic import eat_item, get_turn_number
+from market import MARKET_PAGE_SIZE, buy_listing, list_listings
+import order_book
+import prices
+import feeds
+import events
+import scheduler
+import jobs
 
 def create_app():
     app = Flask(__name__, template_folder='templates', static_folder='static')
     app.config.from_object('config.Config')
 
-    global migrate
     db.init_app(app)
-    migrate = Migrate(app, db)
+    migrate.init_app(app, db)
+    instrumentation.init_app(app)
+    pooling.init_app(app, db)
+    events.init_app(app)
 
     # Import models after db initialization
-    from models import User, Item, Inventory, Task, Boat, City, Listing, Property, Message
+    from models import User, Item, Task, Boat, City, Listing, Property
 
     # ---------------------------
     # Authentication
@@ -38,11 +54,11 @@ def create_app():
             # give starting resources
             u.money_shillings = 10  # 10 shillings = 0 pounds 10s
             db.session.add(u)
-            db.session.commit()
-            # give starting items: 2 chestnuts
-            chestnut = Item.get_or_create('Chestnut', edible_hunger=1)
-            inv = Inventory(user_id=u.id, item_id=chestnut.id, qty=2)
-            db.session.add(inv)
+            db.session.flush()
+            # give starting items: 2 chestnuts (same transaction as the user)
+            chestnut = catalog.item_by_key('chestnut')
+            if chestnut:
+                inventory.change(u.id, chestnut.id, 2)
             db.session.commit()
             session['user_id'] = u.id
             return redirect(url_for('game'))
@@ -65,12 +81,6 @@ def create_app():
         session.pop('user_id', None)
         return redirect(url_for('login'))
 
-    def current_user():
-        uid = session.get('user_id')
-        if not uid:
-            return None
-        return User.query.get(uid)
-
     # ---------------------------
     # App routes
     # ---------------------------
@@ -82,25 +92,22 @@ def create_app():
 
     @app.route('/game')
     def game():
-        u = current_user()
-        if not u:
+        snapshot = snapshots.get(session['user_id']) if session.get('user_id') else None
+        if not snapshot:
             return redirect(url_for('login'))
-        # Make sure boat and cities exist
-        if not Boat.query.first():
-            boat = Boat(name='The Boat', route=['Beautiful Forest','Not-New-Eden','Ocean View','Temple Island','Risible Rock'], current_index=2)
-            db.session.add(boat)
-        city_names = ['Beautiful Forest','Not-New-Eden','Ocean View','Temple Island','Risible Rock']
-        for n in city_names:
-            if not City.query.filter_by(name=n).first():
-                db.session.add(City(name=n))
-        db.session.commit()
-
-        city = City.query.filter_by(name='Ocean View').first()
-        # inventory details
-        invs = Inventory.query.filter_by(user_id=u.id).all()
-        inventory = [{'name': Item.query.get(i.item_id).name if Item.query.get(i.item_id) else 'Unknown', 'qty': i.qty} for i in invs]
+        u = snapshots.PlayerView(snapshot.data)
+        # Boat and cities are seeded by bootstrap.py; this page only reads.
+        city = catalog.city_by_key(u.city)
+        # item names come from the in-process catalog
+        inventory = []
+        for item_id, qty in u.items.items():
+            item = catalog.item_by_id(item_id)
+            inventory.append({'name': item.name if item else 'Unknown', 'qty': qty})
         boat = Boat.query.first()
-        boat_pos = boat.route[boat.current_index] if boat and boat.route else 'Unknown'
+        boat_pos = 'Unknown'
+        if boat and boat.route:
+            stop = catalog.city_by_key(boat.route[boat.current_index])
+            boat_pos = stop.name if stop else boat.route[boat.current_index]
         epoch = datetime(1970,1,1, tzinfo=timezone.utc)
         turn = (datetime.now(timezone.utc)-epoch).days
 
@@ -116,11 +123,10 @@ def create_app():
         u = current_user()
         if not u:
             return redirect(url_for('login'))
-        invs = Inventory.query.filter_by(user_id=u.id).all()
         items = []
-        for i in invs:
-            item = Item.query.get(i.item_id)
-            items.append({'id': i.id, 'name': item.name if item else 'unknown', 'qty': i.qty, 'edible': item.edible_hunger if item else 0})
+        for i in u.inventory:
+            item = i.item
+            items.append({'id': i.id, 'name': item.name if item else 'unknown', 'qty': i.quantity, 'edible': item.edible_hunger if item else 0})
         return render_template('inventory.html', player=u, items=items)
 
     @app.route('/market')
@@ -128,31 +134,38 @@ def create_app():
         u = current_user()
         if not u:
             return redirect(url_for('login'))
-        listings = Listing.query.all()
-        enriched = []
-        for l in listings:
-            seller = User.query.get(l.seller_id)
-            item = Item.query.get(l.item_id)
-            enriched.append({'id': l.id, 'seller': seller.nickname if seller else 'unknown','item': item.name if item else 'unknown','qty': l.qty,'price_pounds': l.price_shillings//20,'price_shillings': l.price_shillings%20})
-        return render_template('market.html', player=u, listings=enriched)
+        try:
+            listings, next_cursor = list_listings(
+                city_id=request.args.get('city_id', type=int),
+                item_id=request.args.get('item_id', type=int),
+                cursor=request.args.get('cursor'),
+            )
+        except ValueError:
+            abort(400)
+        return render_template('market.html', player=u, listings=listings, next_cursor=next_cursor)
 
     @app.route('/tavern')
     def tavern_page():
         u = current_user()
         if not u:
             return redirect(url_for('login'))
-        # show last 50 tavern messages (for demo kept local)
-        msgs = Message.query.filter_by(is_tavern=True).order_by(Message.created_at.desc()).limit(50).all()
-        return render_template('tavern.html', player=u, messages=reversed(msgs))
+        # last 50 tavern messages, served from the feed's ring buffer
+        location = request.args.get('location', feeds.DEFAULT_TAVERN)
+        channel = feeds.tavern_channel(location)
+        if not feeds.valid_channel(channel):
+            abort(404)
+        msgs = feeds.latest(channel)
+        return render_template('tavern.html', player=u, messages=msgs, location=location,
+                               last_id=msgs[-1]['id'] if msgs else 0)
 
     @app.route('/info')
     def info_page():
         u = current_user()
         if not u:
             return redirect(url_for('login'))
-        # show global news from Message table with is_news flag
-        news = Message.query.filter_by(is_news=True).order_by(Message.created_at.desc()).limit(50).all()
-        return render_template('info.html', news=reversed(news))
+        # global news feed, newest last
+        news = feeds.latest(feeds.NEWS_CHANNEL)
+        return render_template('info.html', news=news)
 
     # ---------------------------
     # API endpoints (simplified)
@@ -164,16 +177,45 @@ def create_app():
             return jsonify({'error':'unauthenticated'}),401
         data = request.json or {}
         item_name = data.get('item')
-        item = Item.query.filter_by(name=item_name).first()
+        item = catalog.item_by_name(item_name)
         if not item:
             return jsonify({'error':'no such item'}),400
-        inv = Inventory.query.filter_by(user_id=u.id, item_id=item.id).first()
-        if not inv or inv.qty <= 0:
+        try:
+            result = eat_item(u, item.key)
+        except ValueError:
             return jsonify({'error':'not enough items'}),400
-        inv.qty -= 1
-        u.hunger = min(u.max_hunger, u.hunger + (item.edible_hunger or 0))
-        db.session.commit()
-        return jsonify({'ok':True, 'hunger':u.hunger})
+        return jsonify({'ok':True, 'hunger':result['hunger']})
+
+    @app.route('/api/player')
+    def api_player():
+        """The player's snapshot; 304 when If-None-Match still matches its ETag."""
+        snapshot = snapshots.get(session['user_id']) if session.get('user_id') else None
+        if not snapshot:
+            return jsonify({'error':'unauthenticated'}),401
+        if request.if_none_match.contains(snapshot.etag):
+            response = Response(status=304)
+        else:
+            response = Response(snapshot.body, mimetype='application/json')
+        response.set_etag(snapshot.etag)
+        # the browser may keep it, but must revalidate every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @app.route('/api/market/listings')
+    def api_market_listings():
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        try:
+            listings, next_cursor = list_listings(
+                city_id=request.args.get('city_id', type=int),
+                item_id=request.args.get('item_id', type=int),
+                cursor=request.args.get('cursor'),
+                limit=request.args.get('limit', MARKET_PAGE_SIZE, type=int),
+            )
+        except ValueError as e:
+            return jsonify({'error':str(e)}),400
+        return jsonify({'listings':listings, 'next_cursor':next_cursor})
 
     @app.route('/api/market/buy', methods=['POST'])
     def api_buy():
@@ -183,67 +225,217 @@ def create_app():
         data = request.json or {}
         listing_id = int(data.get('listing_id',0))
         qty = int(data.get('qty',1))
-        listing = Listing.query.get(listing_id)
-        if not listing or listing.qty < qty:
-            return jsonify({'error':'invalid listing or qty'}),400
-        total_price_shillings = listing.price_shillings * qty
-        if u.money_shillings < total_price_shillings:
-            return jsonify({'error':'not enough money'}),400
-        # transfer money
-        seller = User.query.get(listing.seller_id)
-        u.money_shillings -= total_price_shillings
-        seller.money_shillings += total_price_shillings
-        # move items to buyer
-        inv_b = Inventory.query.filter_by(user_id=u.id, item_id=listing.item_id).first()
-        if not inv_b:
-            inv_b = Inventory(user_id=u.id, item_id=listing.item_id, qty=0)
-            db.session.add(inv_b)
-        inv_b.qty += qty
-        listing.qty -= qty
-        if listing.qty <= 0:
-            db.session.delete(listing)
-        db.session.commit()
+        try:
+            buy_listing(u.id, listing_id, qty)
+        except ValueError as e:
+            return jsonify({'error':str(e)}),400
         return jsonify({'ok':True})
 
+    @app.route('/api/market/orders', methods=['POST'])
+    def api_place_order():
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        data = request.json or {}
+        try:
+            result = order_book.place_order(
+                u.id, int(data.get('city_id',0)), int(data.get('item_id',0)),
+                data.get('side'), int(data.get('price',0)), int(data.get('qty',1)),
+            )
+        except ValueError as e:
+            return jsonify({'error':str(e)}),400
+        return jsonify(dict(ok=True, **result))
+
+    @app.route('/api/market/orders/<int:order_id>', methods=['DELETE'])
+    def api_cancel_order(order_id):
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        try:
+            result = order_book.cancel_order(u.id, order_id)
+        except ValueError as e:
+            return jsonify({'error':str(e)}),400
+        return jsonify(dict(ok=True, **result))
+
+    @app.route('/api/market/book/<int:city_id>/<int:item_id>')
+    def api_order_book(city_id, item_id):
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        levels = max(1, min(request.args.get('depth', order_book.DEPTH_LEVELS, type=int), 100))
+        return jsonify(order_book.book_summary(city_id, item_id, levels))
+
+    @app.route('/api/prices/<int:item_id>')
+    def api_prices(item_id):
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        city_id = request.args.get('city_id', 0, type=int)
+        turns = request.args.get('turns', prices.HISTORY_TURNS, type=int)
+        return jsonify({
+            'item_id': item_id,
+            'city_id': city_id,
+            'latest': prices.latest_price(item_id, city_id),
+            'bars': list(prices.price_history(item_id, city_id, turns)),
+        })
+
+    @app.route('/api/boats/eta')
+    def api_boats_eta():
+        """Coming stops of every boat, or with from/to the best boat between two cities."""
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        turn = get_turn_number()
+        origin, destination = request.args.get('from'), request.args.get('to')
+        if origin and destination:
+            return jsonify({'turn': turn, 'plan': voyages.plan(origin, destination, turn)})
+        turns = request.args.get('turns', voyages.DEFAULT_ETA_TURNS, type=int)
+        return jsonify({'turn': turn, 'boats': voyages.eta(turn, turns, request.args.get('city'))})
+
+    @app.route('/api/events')
+    def api_events():
+        """Server-sent events: the player's tavern, news, turn changes and private messages."""
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        if not app.config['SSE_STREAMS']:
+            # a 204 tells EventSource not to reconnect; game.js polls instead
+            return '', 204
+        tavern = feeds.tavern_channel(request.args.get('location', feeds.DEFAULT_TAVERN))
+        if not feeds.valid_channel(tavern):
+            return jsonify({'error':'invalid location'}),400
+        sub = events.subscribe([tavern, feeds.NEWS_CHANNEL, 'turn', feeds.user_channel(u.id)])
+        # an idle stream must not hold a pooled connection
+        db.session.remove()
+        return Response(events.sse_stream(sub), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    def require_metrics_access():
+        """The metrics endpoints are for the scraper only: 404 without METRICS_TOKEN, 403 for a wrong one."""
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            abort(403)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus text format: requests, SQL, turn phases, this worker's pool and jobs, the queue."""
+        require_metrics_access()
+        body = instrumentation.render_metrics(
+            pool=pooling.pool_stats(db.engine), jobs=jobs.job_metrics(),
+            queue=jobs.queue_depth(), turn=instrumentation.last_turn(),
+        )
+        return Response(body, content_type=instrumentation.PROMETHEUS_CONTENT_TYPE)
+
+    @app.route('/metrics/slow-queries')
+    def metrics_slow_queries():
+        """The latest statements slower than SLOW_QUERY_MS in this worker, newest first."""
+        require_metrics_access()
+        return jsonify(instrumentation.slow_queries())
+
+    @app.route('/metrics/pool')
+    def metrics_pool():
+        """This worker's DB pool: checkout waits and live connection counts."""
+        require_metrics_access()
+        return jsonify(pooling.pool_stats(db.engine))
+
+    @app.route('/metrics/jobs')
+    def metrics_jobs():
+        """Queue depth (all workers) and the jobs this process has run."""
+        require_metrics_access()
+        return jsonify({'queue': jobs.queue_depth(), 'worker': jobs.job_metrics()})
+
     @app.route('/api/message/send', methods=['POST'])
     def api_message_send():
         u = current_user()
         if not u:
             return jsonify({'error':'unauthenticated'}),401
-        to_name = request.json.get('to')
-        body = request.json.get('body','')
-        is_tavern = bool(request.json.get('is_tavern', False))
-        is_news = bool(request.json.get('is_news', False))
-        to = User.query.filter_by(nickname=to_name).first() if to_name else None
+        data = request.json or {}
+        to_name = data.get('to')
+        to = User.query.filter_by(username=to_name).first() if to_name else None
         if to_name and not to:
             return jsonify({'error':'no such user'}),400
-        m = Message(sender_id=u.id, receiver_id=to.id if to else None, body=body, is_tavern=is_tavern, is_news=is_news)
-        db.session.add(m)
-        db.session.commit()
-        return jsonify({'ok':True})
+        if to:
+            channel = feeds.user_channel(to.id)
+        elif data.get('is_news'):
+            channel = feeds.NEWS_CHANNEL
+        else:
+            channel = feeds.tavern_channel(data.get('location') or feeds.DEFAULT_TAVERN)
+        try:
+            m = feeds.post_message(channel, data.get('body',''), sender=u, receiver_id=to.id if to else None)
+        except ValueError as e:
+            return jsonify({'error':str(e)}),400
+        return jsonify({'ok':True, 'id':m['id']})
+
+    @app.route('/api/feed/<channel>')
+    def api_feed(channel):
+        u = current_user()
+        if not u:
+            return jsonify({'error':'unauthenticated'}),401
+        if not feeds.valid_channel(channel):
+            return jsonify({'error':'invalid channel'}),400
+        if channel.startswith('user:') and channel != feeds.user_channel(u.id):
+            abort(403)
+        limit = request.args.get('limit', feeds.FEED_PAGE_SIZE, type=int)
+        since_id = request.args.get('since_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        next_before_id = None
+        if since_id is not None:
+            messages = feeds.since(channel, since_id, limit)
+        elif before_id is not None:
+            messages, next_before_id = feeds.page(channel, before_id, limit)
+        else:
+            messages = feeds.latest(channel, limit)
+        return jsonify({
+            'messages': feeds.to_json(messages),
+            'last_id': messages[-1]['id'] if messages else since_id,
+            'next_before_id': next_before_id,
+        })
 
-    # Admin: manual next turn
+    # Admin: queue the turn for scheduler.py; it runs out of band
     @app.route('/admin/next-turn', methods=['POST','GET'])
     def admin_next_turn():
         u = current_user()
         if not u or not u.is_admin:
             abort(403)
-        # import here to avoid circular import when module imported elsewhere
-        from turn_resolver import process_turn
-        process_turn(app)
-        flash('Next turn processed.')
+        try:
+            turn = scheduler.request_turn(requested_by=u.id)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for('game'))
+        flash(f'Turn {turn} queued; the scheduler will run it shortly.')
         return redirect(url_for('game'))
 
-    # Initialize DB tables and some seed data
+    @app.route('/admin/turn-status')
+    def admin_turn_status():
+        u = current_user()
+        if not u or not u.is_admin:
+            abort(403)
+        return jsonify(scheduler.turn_status(request.args.get('turn', type=int)))
+
+    @app.cli.command('bootstrap')
+    def bootstrap_command():
+        """Create tables and seed items, cities and boats (idempotent)."""
+        added = bootstrap_world()
+        print(f"Bootstrap complete (schema {SCHEMA_VERSION}): added {added}")
+
+    @app.cli.command('make-admin')
+    @click.argument('nickname')
+    def make_admin_command(nickname):
+        """Let an existing player use the /admin pages."""
+        u = User.query.filter_by(nickname=nickname).first()
+        if not u:
+            raise click.ClickException(f"No player called {nickname!r}")
+        u.is_admin = True
+        db.session.commit()
+        print(f"{nickname} is now an admin.")
+
+    # Initialize DB tables and seed data, unless the schema marker says it is done
     with app.app_context():
-        from models import Item
-        db.create_all()
-        # ensure some basic items exist
-        Item.get_or_create('Chestnut', edible_hunger=1)
-        Item.get_or_create('Bread', edible_hunger=2)
-        Item.get_or_create('Fish', edible_hunger=2)
-        Item.get_or_create('Mushroom', edible_hunger=2)
-        Item.get_or_create('Health Potion', edible_hunger=0)
+        if not (app.config['FAST_STARTUP'] and schema_is_current()):
+            bootstrap_world()
+        catalog.warm()
     return app
 
 if __name__ == '__main__':
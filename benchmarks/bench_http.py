@@ -0,0 +1,244 @@
+"""
+HTTP load test and performance regression check for the player routes.
+
+Seeds a synthetic world (--users players with money and food, --listings
+market listings, --messages tavern and news messages) into a throwaway
+SQLite database, or DATABASE_URL, then runs --clients concurrent player
+sessions against the app in-process (one logged-in test client each) for
+--seconds. Each session walks SCRIPT: weighted steps over /game,
+/api/player (revalidating its ETag), /inventory, /market, the listings API,
+eating, buying and the tavern. Per step it reports requests/s, p50, p95
+and p99 latency and mean queries per request (the X-Query-Count header).
+
+--save writes the results as a baseline. --baseline compares with one and
+exits 1 when a step's p95 grew by more than --tolerance (plus
+LATENCY_SLACK_MS), its queries per request grew by more than
+QUERY_SLACK, total throughput fell by more than --tolerance, or any
+request failed.
+
+    $ python -m benchmarks.bench_http [--users 500] [--listings 2000] [--messages 500]
+          [--clients 16] [--seconds 10] [--seed 1] [--save PATH] [--baseline PATH] [--tolerance 0.3]
+"""
+
+import argparse
+from collections import defaultdict, namedtuple
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+PASSWORD = 'bench'
+FOOD = 'Chestnut'
+STARTING_FOOD = 10000
+STARTING_MONEY = 1000000
+LATENCY_SLACK_MS = 2.0
+QUERY_SLACK = 0.5
+
+# name, weight, method, path (a function of the session), JSON body (same), accepted statuses
+Step = namedtuple('Step', 'name weight method path body ok')
+
+SCRIPT = [
+    Step('GET /game', 4, 'GET', lambda s: '/game', None, {200}),
+    Step('GET /api/player', 8, 'GET', lambda s: '/api/player', None, {200, 304}),
+    Step('GET /inventory', 2, 'GET', lambda s: '/inventory', None, {200}),
+    Step('GET /market', 2, 'GET', lambda s: '/market', None, {200}),
+    Step('GET /api/market/listings', 2, 'GET', lambda s: '/api/market/listings?limit=20', None, {200}),
+    Step('POST /api/action/eat', 1, 'POST', lambda s: '/api/action/eat', lambda s: {'item': FOOD}, {200}),
+    # a lot may be sold out or the buyer's own: a 400 is a valid answer
+    Step('POST /api/market/buy', 1, 'POST', lambda s: '/api/market/buy',
+         lambda s: {'listing_id': s.rng.randint(1, s.listings), 'qty': 1}, {200, 400}),
+    Step('GET /tavern', 2, 'GET', lambda s: '/tavern', None, {200}),
+    Step('GET /api/feed (since_id)', 2, 'GET', lambda s: f'/api/feed/tavern:ocean_view?since_id={s.last_message_id}',
+         None, {200}),
+    Step('POST /api/message/send', 1, 'POST', lambda s: '/api/message/send',
+         lambda s: {'body': f'{s.name} raises a tankard', 'location': 'ocean_view'}, {200}),
+]
+
+
+class Session:
+    """One scripted player: a logged-in test client and what it remembers between requests."""
+
+    def __init__(self, app, n: int, seed: int, listings: int):
+        self.name = f'http_{n}'
+        self.rng = random.Random(f'{seed}:{n}')
+        self.listings = listings
+        self.etag = None
+        self.last_message_id = 0
+        self.client = app.test_client()
+        response = self.client.post('/login', data={'nickname': self.name, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise SystemExit(f"login as {self.name} failed: {response.status_code}")
+
+    def request(self, step: Step):
+        """Run one step: (status, seconds, queries)."""
+        headers = {'If-None-Match': f'"{self.etag}"'} if step.name == 'GET /api/player' and self.etag else {}
+        kwargs = {'headers': headers}
+        if step.body:
+            kwargs['json'] = step.body(self)
+        started = time.perf_counter()
+        response = self.client.open(step.path(self), method=step.method, **kwargs)
+        seconds = time.perf_counter() - started
+        if step.name == 'GET /api/player' and response.status_code in (200, 304):
+            self.etag = response.headers.get('ETag', '').strip('"') or self.etag
+        elif step.name.startswith('GET /api/feed') and response.status_code == 200:
+            self.last_message_id = response.get_json().get('last_id') or self.last_message_id
+        return response.status_code, seconds, int(response.headers.get('X-Query-Count', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--listings', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="write the results here, as a baseline for later runs")
+    parser.add_argument('--baseline', help="results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed p95 growth and throughput loss")
+    args = parser.parse_args()
+    if args.clients > args.users:
+        parser.error("--clients cannot exceed --users")
+
+    # config.Config reads these at import time
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(prefix='medieval-http-'), 'http.db'))
+    os.environ['EXPOSE_QUERY_COUNT'] = '1'
+    from app import create_app
+    app = create_app()
+    seed(app, args.users, args.listings, args.messages, args.seed)
+
+    # logins hash passwords and first requests warm caches: keep both out of the measurement
+    sessions = [Session(app, n, args.seed, args.listings) for n in range(args.clients)]
+    for step in SCRIPT:
+        sessions[0].request(step)
+    results = run(sessions, args.seconds)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(results, baseline, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        print("FAILED" if failures else f"OK: within {100 * args.tolerance:.0f}% of {args.baseline}")
+        sys.exit(1 if failures else 0)
+    sys.exit(1 if results['all']['errors'] else 0)
+
+
+def seed(app, users: int, listings: int, messages: int, seed: int):
+    from werkzeug.security import generate_password_hash
+    from extensions import db
+    from models import Listing, Message, User
+    import catalog
+    import inventory
+    with app.app_context():
+        if User.query.filter_by(username='http_0').first():
+            return
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'http_{i}', 'password_hash': password_hash, 'money_shillings': STARTING_MONEY}
+            for i in range(users)
+        ])
+        user_ids = list(db.session.execute(db.select(User.id).order_by(User.id)).scalars())
+        food = catalog.item_by_name(FOOD)
+        inventory.apply_deltas({(u, food.id): STARTING_FOOD for u in user_ids})
+        rng = random.Random(seed)
+        item_ids = [item.id for item in catalog.items()]
+        city_ids = [city.id for city in catalog.cities()]
+        db.session.execute(Listing.__table__.insert(), [
+            {'seller_id': rng.choice(user_ids), 'item_id': rng.choice(item_ids), 'city_id': rng.choice(city_ids),
+             'quantity': 1000, 'price_shillings': rng.randint(1, 60)}
+            for _ in range(listings)
+        ])
+        # one news item for every four tavern lines
+        db.session.execute(Message.__table__.insert(), [
+            {'channel': 'news' if i % 5 == 0 else 'tavern:ocean_view', 'sender_id': None if i % 5 == 0 else rng.choice(user_ids),
+             'body': f'Message {i}', 'is_news': i % 5 == 0, 'is_tavern': i % 5 != 0}
+            for i in range(messages)
+        ])
+        db.session.commit()
+
+
+def run(sessions: list, seconds: float):
+    samples = defaultdict(list)     # step name -> [(seconds, queries)]
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    weights = [step.weight for step in SCRIPT]
+    deadline = time.monotonic() + seconds
+
+    def player(session):
+        mine, failed = defaultdict(list), defaultdict(int)
+        while time.monotonic() < deadline:
+            step = session.rng.choices(SCRIPT, weights)[0]
+            try:
+                status, took, queries = session.request(step)
+                ok = status in step.ok
+            except Exception:
+                ok = False
+            if ok:
+                mine[step.name].append((took, queries))
+            else:
+                failed[step.name] += 1
+        with lock:
+            for name, values in mine.items():
+                samples[name].extend(values)
+            for name, count in failed.items():
+                errors[name] += count
+
+    threads = [threading.Thread(target=player, args=(s,)) for s in sessions]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    results = {step.name: _summary(samples[step.name], errors[step.name], elapsed) for step in SCRIPT}
+    results['all'] = _summary([x for values in samples.values() for x in values], sum(errors.values()), elapsed)
+    return results
+
+
+def _summary(values: list, errors: int, elapsed: float):
+    latencies = sorted(took for took, _ in values)
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else 0.0
+    return {'requests': len(values), 'rps': round(len(values) / elapsed, 1),
+            'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99),
+            'queries': round(statistics.fmean(q for _, q in values), 2) if values else 0.0, 'errors': errors}
+
+
+def report(results: dict):
+    print(f"{'step':28} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:28} {r['rps']:8.1f} {r['p50']:8.1f} {r['p95']:8.1f} {r['p99']:8.1f} {r['queries']:8.2f} {r['errors']:7}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Regressions of `results` against `baseline`, as readable lines."""
+    failures = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if r['errors']:
+            failures.append(f"{name}: {r['errors']} failed requests")
+        if not base or not r['requests']:
+            continue
+        limit = base['p95'] * (1 + tolerance) + LATENCY_SLACK_MS
+        if r['p95'] > limit:
+            failures.append(f"{name}: p95 {r['p95']:.1f} ms > {limit:.1f} ms (baseline {base['p95']:.1f} ms)")
+        if r['queries'] > base['queries'] + QUERY_SLACK:
+            failures.append(f"{name}: {r['queries']:.2f} queries/request (baseline {base['queries']:.2f})")
+    base_all = baseline.get('all')
+    if base_all and results['all']['rps'] < base_all['rps'] * (1 - tolerance):
+        failures.append(f"all: {results['all']['rps']:.1f} req/s (baseline {base_all['rps']:.1f})")
+    return failures
+
+
+if __name__ == '__main__':
+    main()
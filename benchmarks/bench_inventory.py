@@ -0,0 +1,129 @@
+"""
+Concurrency stress test for inventory.apply_deltas().
+
+--threads writers hammer a few hot (user, item) rows. Each operation is
+either a transfer (take q from one user, give it to another, one batch) or
+a grant of new units; a transfer the giver cannot cover must be rejected
+whole. The run fails (exit 1) if units were created or destroyed, a
+quantity went negative or a (user, item) pair got a second row; otherwise
+it prints throughput and latency percentiles.
+
+    $ python -m benchmarks.bench_inventory [--threads 32] [--ops 300] [--users 8] [--items 3]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+from extensions import db
+from models import Inventory, Item
+from market import _is_retryable
+import inventory
+from benchmarks.common import Stopwatch, insert_users, make_app, reset_schema
+
+STARTING_UNITS = 20
+ATTEMPTS = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--ops', type=int, default=300, help="operations per thread")
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--items', type=int, default=3)
+    args = parser.parse_args()
+
+    app = make_app(engine_options={'pool_size': args.threads, 'max_overflow': 0, 'pool_timeout': 120})
+    with app.app_context():
+        reset_schema()
+        insert_users(args.users)
+        db.session.execute(Item.__table__.insert(), [
+            {'key': f'good_{i}', 'name': f'Good {i}'} for i in range(args.items)
+        ])
+        item_ids = list(db.session.execute(select(Item.id)).scalars())
+        # half the pairs start empty, so the first grants race to insert them
+        inventory.apply_deltas({(u, i): STARTING_UNITS for u in range(1, args.users + 1, 2) for i in item_ids})
+        db.session.commit()
+        units_before = db.session.scalar(select(func.sum(Inventory.quantity)))
+
+    granted = [0] * args.threads
+    rejected = [0] * args.threads
+    latencies = [[] for _ in range(args.threads)]
+    errors = []
+    start = threading.Barrier(args.threads)
+
+    def writer(n):
+        rng = random.Random(n)
+        with app.app_context():
+            start.wait()
+            for _ in range(args.ops):
+                item_id = rng.choice(item_ids)
+                giver, taker = rng.sample(range(1, args.users + 1), 2)
+                qty = rng.randint(1, 5)
+                grant = rng.random() < 0.2
+                deltas = {(taker, item_id): qty} if grant else {(giver, item_id): -qty, (taker, item_id): qty}
+                with Stopwatch() as sw:
+                    outcome = _apply(deltas)
+                if outcome is None:
+                    rejected[n] += 1
+                elif isinstance(outcome, Exception):
+                    errors.append(repr(outcome))
+                    return
+                elif grant:
+                    granted[n] += qty
+                latencies[n].append(sw.seconds)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.threads)]
+    with Stopwatch() as total:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    with app.app_context():
+        units_after = db.session.scalar(select(func.sum(Inventory.quantity)))
+        negative = db.session.scalar(select(func.count()).where(Inventory.quantity < 0))
+        duplicated = db.session.scalar(select(func.count()).select_from(
+            select(Inventory.user_id).group_by(Inventory.user_id, Inventory.item_id)
+            .having(func.count() > 1).subquery()
+        ))
+
+    flat = sorted(x for per_thread in latencies for x in per_thread)
+    expected = units_before + sum(granted)
+    print(f"threads={args.threads} ops={len(flat)} rejected={sum(rejected)} "
+          f"units before={units_before} granted={sum(granted)} after={units_after}")
+    if flat:
+        p99 = flat[int(len(flat) * 0.99) - 1]
+        print(f"{len(flat) / total.seconds:.0f} ops/s, p50 {statistics.median(flat) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+    ok = units_after == expected and not negative and not duplicated and not errors
+    if errors:
+        print(f"{len(errors)} errors, first: {errors[0]}")
+    if negative or duplicated:
+        print(f"{negative} negative quantities, {duplicated} duplicated (user, item) pairs")
+    print("OK: units conserved, no negative or duplicate rows" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+def _apply(deltas: dict):
+    """Commit one batch: True when applied, None when rejected, the exception on failure."""
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            inventory.apply_deltas(deltas)
+            db.session.commit()
+            return True
+        except ValueError:
+            db.session.rollback()
+            return None
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt == ATTEMPTS or not _is_retryable(e):
+                return e
+            time.sleep(random.uniform(0, 0.005 * 2 ** min(attempt, 6)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Matching throughput and consistency of order_book.
+
+Seeds --traders players with money and items into a throwaway SQLite
+database, or DATABASE_URL, then has --processes worker processes (each
+with its own app and connections, like gunicorn workers) place --orders
+random limit orders between them on one book, cancelling one order in ten.
+About half the orders cross the spread and take liquidity. Reports
+orders/s, then checks that no order was overfilled, that each order's
+fills add up to what it lost, and that money and items were conserved
+(held by players or in escrow on open orders). Exits 1 if a check fails.
+
+    $ python -m benchmarks.bench_order_book [--traders 50] [--orders 2000] [--processes 2]
+"""
+
+import argparse
+from multiprocessing import Process
+import os
+import random
+import sys
+import tempfile
+from benchmarks.common import Stopwatch, insert_users, make_app
+
+STARTING_MONEY = 10 ** 7
+STARTING_ITEMS = 10 ** 5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--traders', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    uri = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(prefix='medieval-orders-'), 'orders.db')
+
+    app = make_app(uri)
+    with app.app_context():
+        from bootstrap import bootstrap_world
+        from extensions import db
+        from models import User
+        import catalog
+        import inventory
+        bootstrap_world()
+        insert_users(args.traders, money_shillings=STARTING_MONEY)
+        user_ids = list(db.session.execute(db.select(User.id).order_by(User.id)).scalars())
+        item_id, city_id = catalog.items()[0].id, catalog.cities()[0].id
+        inventory.apply_deltas({(u, item_id): STARTING_ITEMS for u in user_ids})
+        db.session.commit()
+
+    share = args.orders // args.processes
+    workers = [Process(target=trade, args=(uri, user_ids, city_id, item_id, share, f'{args.seed}:{n}'))
+               for n in range(args.processes)]
+    with Stopwatch() as run:
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    placed = share * args.processes
+    print(f"{placed} orders in {args.processes} processes, {run.seconds:.2f}s: {placed / run.seconds:,.0f} orders/s")
+
+    with app.app_context():
+        failures = check(user_ids, item_id, args.traders)
+        import order_book
+        summary = order_book.book_summary(city_id, item_id, 3)
+    print(f"best bid {summary['best_bid']}, best ask {summary['best_ask']}, depth {summary['bids']} / {summary['asks']}")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if any(w.exitcode for w in workers):
+        print("FAILED: a trading process crashed")
+    sys.exit(1 if failures or any(w.exitcode for w in workers) else 0)
+
+
+def trade(uri: str, user_ids: list, city_id: int, item_id: int, orders: int, seed: str):
+    """One worker process: place `orders` random orders, cancel one in ten of its own."""
+    import order_book
+    rng = random.Random(seed)
+    app = make_app(uri)
+    with app.app_context():
+        mine = []
+        for n in range(orders):
+            user_id = rng.choice(user_ids)
+            # centred on the spread: about half cross and take liquidity, half rest
+            result = order_book.place_order(user_id, city_id, item_id, rng.choice(('buy', 'sell')),
+                                            rng.randint(950, 1050), rng.randint(1, 20))
+            if result['remaining']:
+                mine.append((user_id, result['order_id']))
+            if n % 10 == 9 and mine:
+                try:
+                    order_book.cancel_order(*mine.pop(rng.randrange(len(mine))))
+                except ValueError:
+                    pass  # filled meanwhile by another process
+
+
+def check(user_ids: list, item_id: int, traders: int):
+    from sqlalchemy import func, select
+    from extensions import db
+    from models import Fill, Inventory, Order, User
+    failures = []
+    overfilled = db.session.execute(select(func.count()).where(Order.remaining < 0)).scalar()
+    if overfilled:
+        failures.append(f"{overfilled} orders filled beyond their quantity")
+    filled = {}
+    for column in (Fill.buy_order_id, Fill.sell_order_id):
+        for order_id, qty in db.session.execute(select(column, func.sum(Fill.quantity)).group_by(column)):
+            filled[order_id] = filled.get(order_id, 0) + qty
+    mismatched = [o.id for o in db.session.execute(select(Order.id, Order.quantity, Order.remaining, Order.status)).all()
+                  if filled.get(o.id, 0) != o.quantity - o.remaining and o.status != 'cancelled']
+    if mismatched:
+        failures.append(f"{len(mismatched)} orders whose fills do not match their quantity, e.g. {mismatched[:5]}")
+
+    money = db.session.execute(select(func.sum(User.money_shillings)).where(User.id.in_(user_ids))).scalar()
+    escrowed = db.session.execute(
+        select(func.coalesce(func.sum(Order.remaining * Order.price_shillings), 0))
+        .where(Order.status == 'open', Order.side == 'buy')
+    ).scalar()
+    if money + escrowed != traders * STARTING_MONEY:
+        failures.append(f"money: {money} held + {escrowed} escrowed != {traders * STARTING_MONEY}")
+    items = db.session.execute(
+        select(func.sum(Inventory.quantity)).where(Inventory.user_id.in_(user_ids), Inventory.item_id == item_id)
+    ).scalar()
+    offered = db.session.execute(
+        select(func.coalesce(func.sum(Order.remaining), 0)).where(Order.status == 'open', Order.side == 'sell')
+    ).scalar()
+    if items + offered != traders * STARTING_ITEMS:
+        failures.append(f"items: {items} held + {offered} offered != {traders * STARTING_ITEMS}")
+    return failures
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Concurrency benchmark for market.buy_listing().
+
+Hundreds of threads buy one unit at a time from a single hot listing until
+it is sold out. The run fails (exit 1) if the listing was oversold or if
+money or items were created or destroyed; otherwise it prints purchase
+throughput and latency percentiles.
+
+    $ python -m benchmarks.bench_purchase [--threads 200] [--stock 2000]
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+from sqlalchemy import func, select
+from extensions import db
+from models import Inventory, Item, Listing, User
+from market import buy_listing
+from benchmarks.common import Stopwatch, insert_users, make_app, reset_schema
+
+UNIT_PRICE = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = make_app(engine_options={'pool_size': 20, 'max_overflow': 0, 'pool_timeout': 120})
+    with app.app_context():
+        reset_schema()
+        insert_users(args.threads + 1, money_shillings=10 ** 6)
+        item = Item(key='fish', name='Fish', edible_hunger=2)
+        db.session.add(item)
+        db.session.flush()
+        listing = Listing(seller_id=1, item_id=item.id, quantity=args.stock, price_shillings=UNIT_PRICE)
+        db.session.add(listing)
+        db.session.commit()
+        listing_id, item_id = listing.id, item.id
+        money_before = db.session.scalar(select(func.sum(User.money_shillings)))
+
+    bought = [0] * args.threads
+    latencies = [[] for _ in range(args.threads)]
+    errors = []
+    start = threading.Barrier(args.threads)
+
+    def buyer(n):
+        with app.app_context():
+            start.wait()
+            while True:
+                with Stopwatch() as sw:
+                    try:
+                        buy_listing(n + 2, listing_id, 1)
+                    except ValueError:
+                        return
+                    except Exception as e:  # anything else is a failure of the engine
+                        errors.append(repr(e))
+                        return
+                latencies[n].append(sw.seconds)
+                bought[n] += 1
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(args.threads)]
+    with Stopwatch() as total:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    with app.app_context():
+        remaining = db.session.scalar(select(Listing.quantity).where(Listing.id == listing_id)) or 0
+        delivered = db.session.scalar(select(func.sum(Inventory.quantity)).where(Inventory.item_id == item_id)) or 0
+        money_after = db.session.scalar(select(func.sum(User.money_shillings)))
+
+    sold = sum(bought)
+    flat = sorted(x for per_thread in latencies for x in per_thread)
+    print(f"threads={args.threads} stock={args.stock} sold={sold} remaining={remaining} delivered={delivered}")
+    if flat:
+        p99 = flat[int(len(flat) * 0.99) - 1]
+        print(f"{sold / total.seconds:.0f} purchases/s, p50 {statistics.median(flat) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+    ok = (sold == args.stock and remaining == 0 and delivered == sold
+          and money_after == money_before and not errors)
+    if errors:
+        print(f"{len(errors)} errors, first: {errors[0]}")
+    print("OK: no oversell, money and items conserved" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
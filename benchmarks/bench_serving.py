@@ -0,0 +1,229 @@
+"""
+Requests/s and tail latency of the gunicorn worker modes (gunicorn.conf.py).
+
+Seeds a database with --users players and some market listings, then for
+each WORKER_MODE starts `gunicorn -c gunicorn.conf.py wsgi:application`,
+logs --clients keep-alive clients in and has them cycle through /game,
+/api/player and /market for --seconds. --streams of the players also
+open an /api/events stream for the whole run, like every open tab does;
+the default is more than a gthread server has threads. Under sync and
+gthread the server refuses streams (204, pages poll instead), so the
+report says how many streams each mode held open.
+
+    $ python -m benchmarks.bench_serving [--modes sync,gthread,gevent] [--workers 2]
+          [--clients 32] [--seconds 10] [--streams 40]
+"""
+
+import argparse
+from collections import defaultdict
+import http.client
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+PATHS = ('/game', '/api/player', '/market')
+PASSWORD = 'bench'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--modes', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help="WEB_THREADS for gthread")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--streams', type=int, default=40)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--listings', type=int, default=2000)
+    args = parser.parse_args()
+    if not shutil.which('gunicorn'):
+        raise SystemExit("gunicorn is not installed (pip install -r requirements.txt)")
+
+    database_url = os.environ.get('DATABASE_URL') or (
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='medieval-serve-'), 'serve.db'))
+    seed(database_url, args.users, args.listings)
+
+    print(f"{'mode':8} {'path':12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(','):
+        if mode == 'gevent' and not _importable('gevent'):
+            print(f"{mode:8} skipped: gevent is not installed")
+            continue
+        port = _free_port()
+        env = dict(os.environ, DATABASE_URL=database_url, WORKER_MODE=mode, PORT=str(port),
+                   WEB_CONCURRENCY=str(args.workers), WEB_THREADS=str(args.threads),
+                   EXPOSE_QUERY_COUNT='0', SSE_MAX_SECONDS='3600')
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for(port)
+            results, held = run_load(port, args)
+        except (OSError, http.client.HTTPException) as e:
+            # every worker is busy holding a stream: not even a login gets through
+            print(f"{mode:8} stalled: {type(e).__name__} ({e})")
+            continue
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        for path in PATHS + ('all',):
+            r = results[path]
+            print(f"{mode:8} {path:12} {r['rps']:8.1f} {r['p50']:8.1f} {r['p99']:8.1f} {r['errors']:7}")
+        print(f"{mode:8} streams held open: {held} of {args.streams}")
+
+
+def seed(database_url: str, users: int, listings: int):
+    os.environ['DATABASE_URL'] = database_url
+    from werkzeug.security import generate_password_hash
+    from app import create_app
+    from extensions import db
+    from models import Item, Listing, User
+    app = create_app()
+    with app.app_context():
+        if User.query.filter_by(username='serve_0').first():
+            return
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'serve_{i}', 'password_hash': password_hash, 'money_shillings': 1000}
+            for i in range(users)
+        ])
+        item_ids = [i.id for i in Item.query.all()]
+        rng = random.Random(1)
+        db.session.execute(Listing.__table__.insert(), [
+            {'seller_id': rng.randint(1, users), 'item_id': rng.choice(item_ids),
+             'quantity': rng.randint(1, 20), 'price_shillings': rng.randint(1, 60)}
+            for _ in range(listings)
+        ])
+        db.session.commit()
+
+
+def run_load(port: int, args):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    streams = [_open_stream(port, _login(port, f'serve_{i}')) for i in range(args.streams)]
+    held = sum(1 for s in streams if s is not None)
+    # logins hash passwords: keep them (and worker warm-up) out of the measurement
+    cookies = [_login(port, f'serve_{args.streams + n}') for n in range(args.clients)]
+    for path in PATHS * args.workers * 2:
+        _get(port, path, cookies[0])
+    deadline = time.monotonic() + args.seconds
+
+    def client(n):
+        cookie = cookies[n]
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, failed = defaultdict(list), defaultdict(int)
+        i = n
+        while time.monotonic() < deadline:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'Cookie': cookie})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            if ok:
+                mine[path].append(time.perf_counter() - started)
+            else:
+                failed[path] += 1
+        with lock:
+            for path, values in mine.items():
+                latencies[path].extend(values)
+            for path, count in failed.items():
+                errors[path] += count
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    for s in streams:
+        if s is not None:
+            s.close()
+
+    results = {}
+    everything = []
+    for path in PATHS:
+        everything.extend(latencies[path])
+        results[path] = _summary(latencies[path], errors[path], elapsed)
+    results['all'] = _summary(everything, sum(errors.values()), elapsed)
+    return results, held
+
+
+def _summary(values: list, errors: int, elapsed: float):
+    values = sorted(values)
+    def pct(p):
+        return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+    return {'rps': len(values) / elapsed, 'p50': pct(0.50), 'p99': pct(0.99), 'errors': errors}
+
+
+def _login(port: int, username: str):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('POST', '/login', body=urlencode({'nickname': username, 'password': PASSWORD}),
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    cookie = response.getheader('Set-Cookie')
+    if response.status != 302 or not cookie:
+        raise SystemExit(f"login as {username} failed: {response.status}")
+    return cookie.split(';', 1)[0]
+
+
+def _get(port: int, path: str, cookie: str):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', path, headers={'Cookie': cookie})
+    conn.getresponse().read()
+    conn.close()
+
+
+def _open_stream(port: int, cookie: str):
+    """The socket of an open event stream, or None if the server refused it."""
+    sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+    sock.sendall(f'GET /api/events HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+    status = sock.recv(64).split(b' ', 2)[1]
+    if status != b'200':
+        sock.close()
+        return None
+    return sock
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"gunicorn did not start on port {port}")
+
+
+def _importable(module: str):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == '__main__':
+    main()
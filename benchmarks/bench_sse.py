@@ -0,0 +1,109 @@
+"""
+Cost of idle server-sent event subscribers (events.py).
+
+Serves events.sse_stream() from a threaded WSGI server (one thread per
+stream, as under gunicorn's gthread workers), opens --clients streaming
+connections, and reports the memory held per idle subscriber. It then
+publishes --events news events and measures how long fan-out takes to
+reach every client.
+
+    $ python -m benchmarks.bench_sse [--clients 2000] [--events 5]
+"""
+
+import argparse
+import selectors
+import socket
+import threading
+import time
+from werkzeug.serving import WSGIRequestHandler, make_server
+import events
+from benchmarks.common import Stopwatch
+
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def stream_app(environ, start_response):
+    """What /api/events does, minus the login: Flask encodes the str chunks for us there."""
+    sub = events.subscribe(['news'])
+    start_response('200 OK', [('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache')])
+    stream = events.sse_stream(sub, heartbeat=30, max_seconds=3600)
+    try:
+        for chunk in stream:
+            yield chunk.encode()
+    finally:
+        stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=5)
+    args = parser.parse_args()
+
+    threading.stack_size(256 * 1024)
+    server = make_server('127.0.0.1', 0, stream_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.socket.getsockname()[1]
+
+    before = rss_kib()
+    selector = selectors.DefaultSelector()
+    request = b'GET /api/events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'
+    with Stopwatch() as connect:
+        for i in range(args.clients):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(request)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            if i % 100 == 99:
+                # stay under the listen backlog
+                while events.subscriber_count() < i - 50:
+                    time.sleep(0.01)
+        while events.subscriber_count() < args.clients:
+            time.sleep(0.01)
+    _drain(selector, args.clients, b'retry:')
+    held = rss_kib() - before
+    print(f"{args.clients} subscribers connected in {connect.seconds:.2f}s; "
+          f"RSS +{held / 1024:.1f} MiB ({held / args.clients:.1f} KiB per idle stream, "
+          f"server thread and client socket included)")
+
+    for n in range(args.events):
+        with Stopwatch() as fanout:
+            events.publish('news', 'news', {'title': f'bench {n}'})
+            _drain(selector, args.clients, b'event: news')
+        print(f"event {n}: delivered to {args.clients} clients in {fanout.seconds * 1000:.1f} ms")
+
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    server.shutdown()
+
+
+def _drain(selector, clients: int, marker: bytes, timeout: float = 60):
+    """Read until every client has received `marker`."""
+    pending = {key.fileobj for key in selector.get_map().values()}
+    buffers = {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            sock = key.fileobj
+            chunk = sock.recv(65536)
+            buffers[sock] = buffers.get(sock, b'') + chunk
+            if marker in buffers[sock]:
+                pending.discard(sock)
+                buffers[sock] = b''
+    if pending:
+        raise SystemExit(f"{len(pending)} of {clients} clients never received {marker!r}")
+
+
+if __name__ == '__main__':
+    main()
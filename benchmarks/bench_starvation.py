@@ -0,0 +1,64 @@
+"""
+Memory and time of the end-of-turn starvation pass as the user count grows.
+
+Compares the set-based game_logic.apply_starvation() with the old approach
+(load every User, mutate in Python, flush). Both are timed up to and
+including the commit, so the player snapshots the commit invalidates are
+part of the cost; every player has one beforehand. Peak Python allocations
+are measured with tracemalloc; the set-based pass should stay flat.
+
+    $ python -m benchmarks.bench_starvation [--sizes 1000,10000,100000]
+"""
+
+import argparse
+import tracemalloc
+from extensions import db
+from models import User
+from game_logic import apply_starvation
+import snapshots
+from benchmarks.common import Stopwatch, insert_users, make_app, reset_schema
+
+
+def orm_starvation(threshold=2):
+    for u in User.query.all():
+        if (u.hunger or 0) < threshold:
+            u.health = max(0, (u.health or 0) - 1)
+        u.hunger = 0
+    db.session.flush()
+
+
+def populate(n):
+    reset_schema()
+    insert_users(n, hunger=lambda i: i % 3, health=lambda i: 1 + i % 5)
+    snapshots._rebuild(list(db.session.execute(db.select(User.id).order_by(User.id)).scalars()))
+    db.session.commit()
+
+
+def measure(n, fn):
+    populate(n)
+    db.session.expunge_all()
+    tracemalloc.start()
+    with Stopwatch() as sw:
+        fn()
+        db.session.commit()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sw.seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        print(f"{'users':>8} {'set-based':>20} {'orm loop':>20}")
+        for n in [int(x) for x in args.sizes.split(',')]:
+            set_s, set_peak = measure(n, apply_starvation)
+            orm_s, orm_peak = measure(n, orm_starvation)
+            print(f"{n:>8} {set_s:8.3f}s {set_peak / 1024:8.0f} KiB {orm_s:8.3f}s {orm_peak / 1024:8.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
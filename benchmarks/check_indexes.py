@@ -0,0 +1,275 @@
+"""
+Index check for the hot query patterns.
+
+Seeds a small world into a throwaway database, runs each hot path in HOT_PATHS once while recording the statements it
+sends, then asks the database for the plan of every recorded SELECT,
+UPDATE and DELETE. Inserts and executemany batches are skipped.
+
+The database is a temporary SQLite file, or with a Postgres DATABASE_URL
+a temporary schema in that database, dropped at the end: nothing is
+written to the game's own tables, and its job worker never sees the jobs
+queued here.
+
+A plan that reads a whole table fails the check, unless the table is in
+SMALL_TABLES or the path is expected to touch every row (its `scans`).
+On SQLite that is a bare "SCAN <table>" line of EXPLAIN QUERY PLAN. On
+Postgres sequential scans are disabled for the EXPLAIN, so a "Seq Scan"
+node means no index could serve the query at all.
+
+Prints every plan and exits 1 if any check failed.
+
+    $ python -m benchmarks.check_indexes [--users 200] [--quiet]
+"""
+
+import argparse
+from collections import namedtuple
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import tempfile
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# catalog and bookkeeping tables: a handful of rows, scanning them is fine
+SMALL_TABLES = {'items', 'cities', 'boats', 'app_meta', 'turn_checkpoints'}
+PASSWORD_HASH = '-'
+
+# name, function of the check, tables the path reads in full on purpose
+HotPath = namedtuple('HotPath', 'name run scans')
+
+
+def _hot_paths(world):
+    import feeds
+    import game_logic
+    import identity
+    import inventory
+    import jobs
+    import market
+    import order_book
+    import scheduler
+    import snapshots
+    from game_logic import TurnTimer
+
+    user_id, item_id, city_id = world['user_id'], world['item_id'], world['city_id']
+    turn = game_logic.get_turn_number()
+    _, cursor = market.list_listings(limit=5)
+    return [
+        HotPath('identity._load_user', lambda: identity._load_user(user_id), set()),
+        HotPath('game_logic.user_has_task_this_turn',
+                lambda: game_logic.user_has_task_this_turn(identity._load_user(user_id)), set()),
+        HotPath('game_logic._resolve_tasks_bulk',
+                lambda: game_logic._resolve_tasks_bulk(turn, TurnTimer('check'), limit=50), set()),
+        HotPath('market.list_listings', lambda: market.list_listings(), set()),
+        HotPath('market.list_listings (city)', lambda: market.list_listings(city_id=city_id), set()),
+        HotPath('market.list_listings (item)', lambda: market.list_listings(item_id=item_id), set()),
+        HotPath('market.list_listings (cursor)', lambda: market.list_listings(cursor=cursor), set()),
+        HotPath('feeds latest', lambda: feeds._query(feeds.tavern_channel()), set()),
+        HotPath('feeds since_id', lambda: feeds._query(feeds.tavern_channel(), after_id=world['message_id']), set()),
+        HotPath('feeds before_id', lambda: feeds._query(feeds.tavern_channel(), before_id=world['message_id']), set()),
+        HotPath('inventory.quantity', lambda: inventory.quantity(user_id, item_id), set()),
+        HotPath('inventory.apply_deltas', lambda: inventory.apply_deltas({(user_id, item_id): -1}), set()),
+        HotPath('jobs.claim', lambda: jobs.claim('check-indexes'), set()),
+        HotPath('snapshots.get', lambda: snapshots.get(user_id), set()),
+        HotPath('snapshots._rebuild', lambda: snapshots._rebuild([user_id]), set()),
+        HotPath('order_book.place_order',
+                lambda: order_book.place_order(user_id, city_id, item_id, 'buy', 60, 2), set()),
+        HotPath('order_book.book_summary', lambda: order_book.book_summary(city_id, item_id), set()),
+        HotPath('jobs stats_rollup', lambda: jobs._stats_rollup({'turn': turn}), {'users'}),
+        HotPath('game_logic.apply_starvation', lambda: game_logic.apply_starvation(), {'users'}),
+        HotPath('scheduler.turn_status', scheduler.turn_status, set()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--quiet', action='store_true', help="only print the failing plans")
+    args = parser.parse_args()
+
+    url = os.environ.get('DATABASE_URL', '')
+    schema = f'check_indexes_{secrets.token_hex(4)}' if url.startswith('postgres') else None
+    # config.Config reads this at import time
+    if schema:
+        os.environ['DATABASE_URL'] = _create_schema(url, schema)
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(prefix='medieval-indexes-'), 'indexes.db')
+    try:
+        failures = check(args)
+    finally:
+        if schema:
+            _drop_schema(url, schema)
+    print(f"FAILED: {failures} statements scan a hot table" if failures else "OK: every hot query uses an index")
+    sys.exit(1 if failures else 0)
+
+
+def check(args):
+    """Seed, run and explain every hot path; returns the number of failing statements."""
+    from app import create_app
+    from extensions import db
+    app = create_app()
+    failures = 0
+    with app.app_context():
+        world = seed(args.users, args.seed)
+        explain = _explain_postgres if db.engine.dialect.name == 'postgresql' else _explain_sqlite
+        for path in _hot_paths(world):
+            for statement, parameters in record(path.run):
+                plan, scanned = explain(statement, parameters)
+                bad = sorted(scanned - SMALL_TABLES - path.scans)
+                failures += bool(bad)
+                if bad or not args.quiet:
+                    print(f"{'FAIL' if bad else 'ok  '} {path.name}: {' '.join(statement.split())[:150]}")
+                    for line in plan:
+                        print(f"       {line}")
+                    if bad:
+                        print(f"       full scan of {', '.join(bad)}")
+            db.session.rollback()
+        db.session.remove()
+        db.engine.dispose()
+    return failures
+
+
+def _create_schema(url: str, schema: str):
+    """Create `schema` in the database at `url`; returns a URL whose connections use it."""
+    from pooling import database_uri
+    url = make_url(database_uri(url))
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema}')
+    engine.dispose()
+    options = (url.query.get('options', '') + f' -csearch_path={schema}').strip()
+    return url.update_query_dict({'options': options}).render_as_string(hide_password=False)
+
+
+def _drop_schema(url: str, schema: str):
+    from pooling import database_uri
+    engine = create_engine(database_uri(url))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA {schema} CASCADE')
+    engine.dispose()
+
+
+def seed(users: int, seed: int):
+    """A small world with rows in every hot table; returns the ids the paths use."""
+    from datetime import datetime
+    from bootstrap import bootstrap_world
+    from extensions import db
+    from models import Job, Listing, Message, Order, Property, Task, Trade, User
+    import catalog
+    import feeds
+    import game_logic
+    import inventory
+    bootstrap_world()
+    rng = random.Random(seed)
+    turn = game_logic.get_turn_number()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'index_{i}', 'password_hash': PASSWORD_HASH, 'money_shillings': 1000} for i in range(users)
+    ])
+    user_ids = list(db.session.execute(db.select(User.id).order_by(User.id)).scalars())
+    item_ids = [item.id for item in catalog.items()]
+    city_ids = [city.id for city in catalog.cities()]
+    inventory.apply_deltas({(u, i): 10 for u in user_ids for i in item_ids[:3]})
+    db.session.execute(Task.__table__.insert(), [
+        {'user_id': u, 'action': 'collect_chestnuts', 'params': {}, 'start_turn': turn - 1,
+         'resolve_turn': turn - (k % 2),
+         'resolved': k % 3 == 0}
+        for k, u in enumerate(user_ids)
+    ])
+    db.session.execute(Property.__table__.insert(), [
+        {'owner_id': u, 'name': 'Hut', 'city_id': rng.choice(city_ids)} for u in user_ids[::4]
+    ])
+    db.session.execute(Listing.__table__.insert(), [
+        {'seller_id': rng.choice(user_ids), 'item_id': rng.choice(item_ids), 'city_id': rng.choice(city_ids),
+         'quantity': 5, 'price_shillings': rng.randint(1, 60)}
+        for _ in range(users * 2)
+    ])
+    channel = feeds.tavern_channel()
+    db.session.execute(Message.__table__.insert(), [
+        {'channel': channel if k % 2 else feeds.user_channel(rng.choice(user_ids)), 'sender_id': rng.choice(user_ids),
+         'receiver_id': None, 'body': f'Message {k}', 'is_news': False, 'is_tavern': bool(k % 2)}
+        for k in range(users * 2)
+    ])
+    db.session.execute(Order.__table__.insert(), [
+        {'user_id': rng.choice(user_ids), 'city_id': rng.choice(city_ids), 'item_id': rng.choice(item_ids),
+         'side': rng.choice(('buy', 'sell')), 'price_shillings': rng.randint(1, 60), 'quantity': 3,
+         'remaining': 3 * (k % 2), 'status': 'open' if k % 2 else 'filled'}
+        for k in range(users)
+    ])
+    db.session.execute(Trade.__table__.insert(), [
+        {'city_id': rng.choice(city_ids), 'item_id': rng.choice(item_ids), 'quantity': 1,
+         'price_shillings': rng.randint(1, 60), 'turn': turn - k % 30}
+        for k in range(users * 2)
+    ])
+    db.session.execute(Job.__table__.insert(), [
+        {'kind': 'stats_rollup', 'payload': {'turn': turn}, 'status': 'done' if k % 4 else 'queued',
+         'run_at': datetime.utcnow()}
+        for k in range(users)
+    ])
+    db.session.commit()
+    message_id = db.session.execute(
+        db.select(Message.id).where(Message.channel == channel).order_by(Message.id).offset(users // 2)
+    ).scalar()
+    return {'user_id': user_ids[len(user_ids) // 2], 'item_id': item_ids[0], 'city_id': city_ids[0],
+            'message_id': message_id}
+
+
+def record(run):
+    """Call run(); returns the (statement, parameters) of every single-row-set statement it sent."""
+    from extensions import db
+    seen = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and not statement.lstrip().upper().startswith(('INSERT', 'EXPLAIN', 'SET', 'PRAGMA')):
+            seen.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before)
+    return seen
+
+
+def _explain_sqlite(statement: str, parameters):
+    """EXPLAIN QUERY PLAN lines, and the tables read without an index."""
+    from extensions import db
+    rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    plan = [row[-1] for row in rows]
+    # "SCAN users" reads the table; "SCAN users USING INDEX ..." walks an index
+    scanned = {m.group(1) for m in (re.match(r'SCAN (\w+)(?: AS \w+)?$', line) for line in plan) if m}
+    return plan, scanned
+
+
+def _explain_postgres(statement: str, parameters):
+    """EXPLAIN (FORMAT JSON) with sequential scans disabled, and the tables still read by one."""
+    from extensions import db
+    conn = db.session.connection()
+    conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    try:
+        (document,) = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).one()
+    finally:
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = on')
+    if isinstance(document, str):
+        document = json.loads(document)
+    plan, scanned = [], set()
+
+    def walk(node, depth):
+        relation = node.get('Relation Name')
+        index = node.get('Index Name')
+        plan.append('  ' * depth + node['Node Type'] + (f' on {relation}' if relation else '')
+                    + (f' using {index}' if index else ''))
+        if node['Node Type'] == 'Seq Scan':
+            scanned.add(relation)
+        for child in node.get('Plans', ()):
+            walk(child, depth + 1)
+
+    walk(document[0]['Plan'], 0)
+    return plan, scanned
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The benchmarks run against a bare Flask app bound to extensions.db, so they
+only need the models and game logic, not the web routes. Point them at
+Postgres with DATABASE_URL; the default is a throwaway SQLite database.
+"""
+
+import os
+import tempfile
+import time
+from flask import Flask
+from extensions import db
+from pooling import database_uri
+
+
+def make_app(uri: str = None, engine_options: dict = None):
+    """Engine options must be known here: db.init_app() creates the engine."""
+    if not uri:
+        uri = os.environ.get('DATABASE_URL')
+    if not uri:
+        uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='medieval-bench-'), 'bench.db')
+    uri = database_uri(uri)
+    app = Flask('medieval-bench')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if engine_options:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    db.init_app(app)
+    return app
+
+
+def reset_schema():
+    db.drop_all()
+    db.create_all()
+
+
+def insert_users(n: int, **columns):
+    """Insert n synthetic users with one executemany; column values may be callables of the index."""
+    from models import User
+    rows = []
+    for i in range(n):
+        row = {'username': f'bench_{i}', 'password_hash': '-'}
+        for name, value in columns.items():
+            row[name] = value(i) if callable(value) else value
+        rows.append(row)
+    db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+
+
+class Stopwatch:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
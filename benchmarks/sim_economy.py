@@ -0,0 +1,473 @@
+"""
+Monte Carlo economy simulator, for balance tuning and turn engine timing.
+
+Synthetic players follow one policy every turn:
+  - eat from their stock up to max hunger, best fitting food first,
+  - buy Level 2 as soon as they qualify,
+  - start one task: a food action (weighted by the hunger points it
+    yields) when their stock will not last RESERVE_TURNS turns, otherwise
+    an action drawn from --mix.
+The turn is then resolved with the game's own rules, by one of two engines:
+  - "memory" applies the action registry's yields and handlers,
+    voyages.step() and the starvation rule to plain lists. It handles
+    thousands of players over hundreds of turns in seconds. Yield rolls are
+    drawn in batches with NumPy when it is installed, with the random
+    module otherwise.
+  - "db" writes the players' moves to a throwaway database (SQLite, or
+    DATABASE_URL) and runs turn_engine.run_turn(). Its seconds per turn
+    time the real engine: pass --baseline to fail (exit 1) when a run is
+    more than --tolerance slower than a saved --json summary.
+
+--king-pay, --yield, --level2-price and --starvation-threshold patch the
+game's constants for the run only. Every --report-every turns a row shows
+the living players, deaths, money supply and food supply (hunger points
+in stock). The summary adds the death rate and the wall time per turn.
+
+    $ python -m benchmarks.sim_economy [--engine memory|db] [--players 2000] [--turns 200] [--seed 1]
+          [--mix work_for_king=4,study=2,...] [--king-pay 8,9,10,...] [--yield gather_fruits=0:3 ...]
+          [--level2-price SHILLINGS] [--starvation-threshold 2] [--workers 0] [--report-every 20]
+          [--json PATH] [--baseline PATH] [--tolerance 0.25]
+"""
+
+import argparse
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, redirect_stdout
+import io
+import json
+import random
+import statistics
+import sys
+from models import SHILLINGS_PER_POUND, User
+from seed_items import items_data
+import actions
+import game_logic
+import voyages
+from benchmarks.common import Stopwatch
+
+try:
+    import numpy as np
+except ImportError:  # the draws fall back to the random module
+    np = None
+
+DEFAULT_MIX = "work_for_king=4,study=2,plant_wheat=1,gather_wild_herbs=1,study_geography=1"
+# a player keeps enough food in stock for this many turns before doing anything else
+RESERVE_TURNS = 2
+# what a new account gets at registration (see app.py)
+STARTING_STOCK = {"chestnut": 2}
+
+EDIBLE = {item["key"]: item.get("edible_hunger", 0) for item in items_data if item.get("edible_hunger")}
+
+Plan = namedtuple("Plan", "eaten fed leveled tasks")
+
+
+class Draws:
+    """Batched random draws from one seed: NumPy's generator if available, else random.Random."""
+
+    def __init__(self, seed: int):
+        self.numpy = np is not None
+        self.gen = np.random.default_rng(seed) if self.numpy else random.Random(seed)
+        # handlers are plain functions of (params, rng)
+        self.rng = random.Random(seed)
+
+    def integers(self, low: int, high: int, n: int):
+        """n ints in [low, high]."""
+        if self.numpy:
+            return self.gen.integers(low, high + 1, size=n).tolist()
+        return self.gen.choices(range(low, high + 1), k=n)
+
+    def weighted(self, values: list, weights: list, n: int):
+        if self.numpy:
+            p = np.asarray(weights, dtype=float)
+            return [values[k] for k in self.gen.choice(len(values), size=n, p=p / p.sum()).tolist()]
+        return self.gen.choices(values, weights, k=n)
+
+    def random(self, n: int):
+        if self.numpy:
+            return self.gen.random(n).tolist()
+        return [self.gen.random() for _ in range(n)]
+
+
+class World:
+    """Player state as parallel lists, one slot per player."""
+
+    def __init__(self, ids: list, **columns):
+        self.ids = ids
+        n = len(ids)
+        for name in ("money", "hunger", "max_hunger", "health", "intelligence", "level", "busy_until"):
+            setattr(self, name, columns.get(name, [0] * n))
+        self.stock = columns.get("stock") or [{} for _ in range(n)]
+
+    @classmethod
+    def new(cls, n: int):
+        """n freshly registered players, with the users table's column defaults."""
+        c = User.__table__.c
+        default = lambda column: [column.default.arg] * n
+        return cls(list(range(1, n + 1)), money=default(c.money_shillings), hunger=default(c.hunger),
+                   max_hunger=default(c.max_hunger), health=default(c.health),
+                   intelligence=default(c.intelligence), level=default(c.level), busy_until=[-1] * n,
+                   stock=[dict(STARTING_STOCK) for _ in range(n)])
+
+    def measure(self):
+        alive = sum(1 for h in self.health if h > 0)
+        return {"alive": alive, "dead": len(self.ids) - alive,
+                "money_shillings": sum(self.money),
+                "food_points": sum(q * EDIBLE[k] for stock in self.stock for k, q in stock.items() if k in EDIBLE),
+                "level2": sum(1 for lv in self.level if lv >= 2)}
+
+
+# ------ Policy ------
+def food_actions():
+    """{action name: expected hunger points per task} for actions yielding food."""
+    result = {}
+    for name, action in actions.ACTIONS.items():
+        if action.name == name and action.yields and action.yields[0] in EDIBLE:
+            key, low, high = action.yields
+            result[name] = (low + high) / 2 * EDIBLE[key]
+    return result
+
+def _pick_food(stock: dict, want: int):
+    """The largest food that does not overshoot `want`, else the smallest one."""
+    foods = [(EDIBLE[k], k) for k, q in stock.items() if q > 0 and k in EDIBLE]
+    if not foods:
+        return None
+    fitting = [f for f in foods if f[0] <= want]
+    return max(fitting)[1] if fitting else min(foods)[1]
+
+def plan_turn(world: World, turn: int, draws: Draws, mix: dict, food: dict):
+    """Apply every living player's eating and level-up to `world`; return them with the tasks to start."""
+    threshold = game_logic.STARVATION_THRESHOLD
+    price = game_logic.LEVEL2_PRICE_SHILLINGS
+    eaten, fed, leveled = defaultdict(int), {}, []
+    hungry, free = [], []
+    for p in range(len(world.ids)):
+        if world.health[p] <= 0:
+            continue
+        stock, hunger, max_hunger = world.stock[p], world.hunger[p], world.max_hunger[p]
+        while hunger < max_hunger:
+            key = _pick_food(stock, max_hunger - hunger)
+            if key is None:
+                break
+            stock[key] -= 1
+            if not stock[key]:
+                del stock[key]
+            eaten[(p, key)] += 1
+            hunger = min(max_hunger, hunger + EDIBLE[key])
+        if hunger != world.hunger[p]:
+            world.hunger[p] = fed[p] = hunger
+        if world.level[p] == 1 and world.intelligence[p] >= 2 and world.money[p] >= price:
+            world.money[p] -= price
+            world.level[p] = 2
+            leveled.append(p)
+        if world.busy_until[p] >= turn:
+            continue
+        points = sum(q * EDIBLE[k] for k, q in stock.items() if k in EDIBLE)
+        (hungry if points < RESERVE_TURNS * threshold else free).append(p)
+    tasks = list(zip(hungry, draws.weighted(list(food), list(food.values()), len(hungry))))
+    tasks += list(zip(free, draws.weighted(list(mix), list(mix.values()), len(free))))
+    for p, action in tasks:
+        world.busy_until[p] = turn + actions.get_action(action).duration - 1
+    return Plan(eaten, fed, leveled, tasks)
+
+
+# ------ Memory engine ------
+class MemoryEngine:
+    """The turn's rules applied to the World lists directly."""
+
+    def __init__(self, world: World, draws: Draws):
+        self.world = world
+        self.draws = draws
+        self.pending = defaultdict(list)   # resolve turn -> [(player, action)]
+        self.boats = [{"table": voyages.build_leg_table(b["route"]), "index": b.get("current_index", 0),
+                       "stuck": False, "stuck_turns": 0} for b in _boats_data()]
+        self.boat_moves = self.boat_steps = 0
+
+    def run_turn(self, turn: int, plan: Plan):
+        for p, action in plan.tasks:
+            self.pending[turn + actions.get_action(action).duration - 1].append((p, action))
+        self._resolve_tasks(self.pending.pop(turn, []))
+        self._step_boats()
+        self._starve()
+
+    def _resolve_tasks(self, tasks: list):
+        world = self.world
+        by_action = defaultdict(list)
+        for p, action in tasks:
+            by_action[action].append(p)
+        for name, players in by_action.items():
+            action = actions.get_action(name)
+            if action.yields:
+                key, low, high = action.yields
+                outcomes = [{"gained": {key: qty}} for qty in self.draws.integers(low, high, len(players))]
+            else:
+                outcomes = [action.roll({}, self.draws.rng) for _ in players]
+            for p, result in zip(players, outcomes):
+                for key, qty in result.get("gained", {}).items():
+                    if qty:
+                        world.stock[p][key] = world.stock[p].get(key, 0) + qty
+                world.money[p] += result.get("earned_shillings", 0)
+                world.health[p] = max(0, world.health[p] - result.get("hp_lost", 0))
+                world.intelligence[p] += result.get("intelligence_gained", 0)
+
+    def _step_boats(self):
+        boats = self.boats
+        chance = [b["table"].stuck_chance[b["index"]] for b in boats]
+        moves, _, stuck_turns = voyages.step([b["stuck"] for b in boats], [b["stuck_turns"] for b in boats],
+                                             chance, self.draws.random(len(boats)))
+        for b, moved, turns in zip(boats, moves, stuck_turns):
+            if moved:
+                b["index"] = (b["index"] + 1) % len(b["table"].keys)
+            b["stuck"], b["stuck_turns"] = not moved, turns
+        self.boat_moves += sum(moves)
+        self.boat_steps += len(boats)
+
+    def _starve(self):
+        # game_logic.apply_starvation, on lists
+        world = self.world
+        threshold = game_logic.STARVATION_THRESHOLD
+        for p in range(len(world.ids)):
+            if world.hunger[p] < threshold:
+                world.health[p] = max(0, world.health[p] - 1)
+            world.hunger[p] = 0
+
+def _boats_data():
+    from bootstrap import boats_data
+    return boats_data
+
+
+# ------ Database engine ------
+class DatabaseEngine:
+    """Players' moves written to a database, the turn run by turn_engine.run_turn()."""
+
+    def __init__(self, players: int, workers: int = 0):
+        from benchmarks.common import insert_users, make_app, reset_schema
+        from bootstrap import bootstrap_world
+        from extensions import db
+        import catalog
+        import inventory
+        self.db, self.catalog, self.inventory = db, catalog, inventory
+        self.workers = workers
+        self.app = make_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        reset_schema()
+        bootstrap_world()
+        insert_users(players)
+        items = {item.key: item.id for item in catalog.items()}
+        inventory.apply_deltas({(u, items[k]): q for u in range(1, players + 1) for k, q in STARTING_STOCK.items()})
+        db.session.commit()
+        self.boat_moves = self.boat_steps = 0
+
+    def load(self):
+        """The players' state, read back from the database."""
+        from sqlalchemy import func, select
+        from models import Inventory, Task
+        c = User.__table__.c
+        users = self.db.session.execute(
+            select(c.id, c.money_shillings, c.hunger, c.max_hunger, c.health, c.intelligence, c.level).order_by(c.id)
+        ).all()
+        slot = {u.id: p for p, u in enumerate(users)}
+        stock = [{} for _ in users]
+        keys = {item.id: item.key for item in self.catalog.items()}
+        for user_id, item_id, qty in self.db.session.execute(
+            select(Inventory.user_id, Inventory.item_id, Inventory.quantity).where(Inventory.quantity > 0)
+        ):
+            stock[slot[user_id]][keys[item_id]] = qty
+        busy_until = [-1] * len(users)
+        for user_id, last in self.db.session.execute(
+            select(Task.user_id, func.max(Task.resolve_turn)).where(Task.resolved == False).group_by(Task.user_id)
+        ):
+            busy_until[slot[user_id]] = last
+        column = lambda k, default: [row[k] if row[k] is not None else default for row in users]
+        return World([u.id for u in users], money=column(1, 0), hunger=column(2, 0), max_hunger=column(3, 2),
+                     health=column(4, 0), intelligence=column(5, 0), level=column(6, 1),
+                     busy_until=busy_until, stock=stock)
+
+    def run_turn(self, turn: int, plan: Plan, world: World):
+        from sqlalchemy import bindparam, update
+        from models import Task
+        import snapshots
+        import turn_engine
+        db = self.db
+        items = {item.key: item.id for item in self.catalog.items()}
+        ids = world.ids
+        self.inventory.apply_deltas({(ids[p], items[k]): -q for (p, k), q in plan.eaten.items()})
+        users = User.__table__
+        if plan.fed:
+            db.session.execute(update(users).where(users.c.id == bindparam("b_id")).values(hunger=bindparam("b_hunger")),
+                               [{"b_id": ids[p], "b_hunger": h} for p, h in plan.fed.items()])
+        if plan.leveled:
+            db.session.execute(
+                update(users).where(users.c.id == bindparam("b_id"), users.c.level == 1)
+                .values(money_shillings=users.c.money_shillings - game_logic.LEVEL2_PRICE_SHILLINGS, level=2),
+                [{"b_id": ids[p]} for p in plan.leveled],
+            )
+        snapshots.touch({ids[p] for p in plan.fed} | {ids[p] for p in plan.leveled})
+        if plan.tasks:
+            db.session.execute(Task.__table__.insert(), [
+                {"user_id": ids[p], "action": action, "params": {}, "start_turn": turn,
+                 "resolve_turn": turn + actions.get_action(action).duration - 1, "resolved": False}
+                for p, action in plan.tasks
+            ])
+        db.session.commit()
+        before = dict(db.session.execute(_boat_positions()).all())
+        with redirect_stdout(io.StringIO()):
+            turn_engine.run_turn(turn, workers=self.workers)
+        after = dict(db.session.execute(_boat_positions()).all())
+        self.boat_moves += sum(1 for boat_id, index in after.items() if index != before.get(boat_id))
+        self.boat_steps += len(after)
+
+    def close(self):
+        self.context.pop()
+
+def _boat_positions():
+    from sqlalchemy import select
+    from models import Boat
+    return select(Boat.id, Boat.current_index).where(Boat.route.is_not(None))
+
+
+# ------ Knobs ------
+@contextmanager
+def patched(king_pay=None, yields=(), level2_price=None, starvation_threshold=None):
+    """Override balance constants for the duration of a run."""
+    saved = (actions.KING_PAY_POUNDS, game_logic.LEVEL2_PRICE_SHILLINGS, game_logic.STARVATION_THRESHOLD,
+             {name: actions.get_action(name).yields for name, _ in yields})
+    try:
+        if king_pay:
+            actions.KING_PAY_POUNDS = list(king_pay)
+        if level2_price is not None:
+            game_logic.LEVEL2_PRICE_SHILLINGS = level2_price
+        if starvation_threshold is not None:
+            game_logic.STARVATION_THRESHOLD = starvation_threshold
+        for name, (low, high) in yields:
+            action = actions.get_action(name)
+            action.yields = (action.yields[0], low, high)
+        yield
+    finally:
+        actions.KING_PAY_POUNDS, game_logic.LEVEL2_PRICE_SHILLINGS, game_logic.STARVATION_THRESHOLD, old = saved
+        for name, value in old.items():
+            actions.get_action(name).yields = value
+
+def _parse_mix(text: str):
+    mix = {}
+    for part in filter(None, text.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in actions.ACTIONS:
+            raise ValueError(f"unknown action {name!r}")
+        mix[name] = float(weight or 1)
+    return {name: w for name, w in mix.items() if w > 0}
+
+def _parse_yield(text: str):
+    name, _, span = text.partition("=")
+    low, _, high = span.partition(":")
+    if not actions.get_action(name).yields:
+        raise ValueError(f"{name!r} is not a yield action")
+    return name, (int(low), int(high or low))
+
+
+# ------ Running ------
+def simulate(engine: str = "memory", players: int = 2000, turns: int = 200, seed: int = 1,
+             mix: dict = None, workers: int = 0, report_every: int = 20):
+    """Run one simulation with the current constants. Prints a report row every `report_every` turns; returns the summary."""
+    draws = Draws(seed)
+    random.seed(seed)
+    mix = mix or _parse_mix(DEFAULT_MIX)
+    food = food_actions()
+    if engine == "db":
+        sim = DatabaseEngine(players, workers)
+        world = sim.load()
+    else:
+        world = World.new(players)
+        sim = MemoryEngine(world, draws)
+    start = world.measure()
+    seconds = []
+    print(f"{'turn':>5} {'alive':>7} {'dead':>6} {'money £':>10} {'£/alive':>8} {'food':>9} "
+          f"{'food/alive':>10} {'level 2':>8} {'ms/turn':>8}")
+    try:
+        for turn in range(1, turns + 1):
+            with Stopwatch() as sw:
+                plan = plan_turn(world, turn, draws, mix, food)
+                if engine == "db":
+                    sim.run_turn(turn, plan, world)
+                    world = sim.load()
+                else:
+                    sim.run_turn(turn, plan)
+            seconds.append(sw.seconds)
+            if turn % report_every == 0 or turn == turns:
+                m = world.measure()
+                alive = max(m["alive"], 1)
+                print(f"{turn:>5} {m['alive']:>7} {m['dead']:>6} {m['money_shillings'] / SHILLINGS_PER_POUND:>10.0f} "
+                      f"{m['money_shillings'] / SHILLINGS_PER_POUND / alive:>8.1f} {m['food_points']:>9} "
+                      f"{m['food_points'] / alive:>10.1f} {m['level2']:>8} "
+                      f"{1000 * statistics.fmean(seconds[-report_every:]):>8.1f}")
+    finally:
+        if engine == "db":
+            sim.close()
+    end = world.measure()
+    ordered = sorted(seconds)
+    return {
+        "engine": engine, "numpy": draws.numpy, "players": players, "turns": turns, "seed": seed,
+        "knobs": {"king_pay_pounds": actions.KING_PAY_POUNDS, "level2_price_shillings": game_logic.LEVEL2_PRICE_SHILLINGS,
+                  "starvation_threshold": game_logic.STARVATION_THRESHOLD, "mix": mix,
+                  "yields": {name: list(actions.get_action(name).yields[1:]) for name in food}},
+        "alive": end["alive"], "dead": end["dead"],
+        "death_rate": round(end["dead"] / players, 4) if players else 0.0,
+        "deaths_per_1000_player_turns": round(1000 * (end["dead"] - start["dead"]) / max(players * turns, 1), 3),
+        "money_shillings_start": start["money_shillings"], "money_shillings_end": end["money_shillings"],
+        "money_growth_per_turn": round((end["money_shillings"] - start["money_shillings"]) / max(turns, 1), 1),
+        "food_points_end": end["food_points"], "level2_players": end["level2"],
+        "boat_on_time_rate": round(sim.boat_moves / sim.boat_steps, 3) if sim.boat_steps else None,
+        "seconds_per_turn": round(statistics.fmean(seconds), 5) if seconds else 0.0,
+        "p95_seconds_per_turn": round(ordered[int(len(ordered) * 0.95) - 1], 5) if ordered else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--engine', choices=['memory', 'db'], default='memory')
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="action=weight,... for players with enough food")
+    parser.add_argument('--king-pay', help="comma-separated pay table in pounds (one entry per outcome)")
+    parser.add_argument('--yield', dest='yields', action='append', default=[], metavar='ACTION=MIN:MAX')
+    parser.add_argument('--level2-price', type=int, help="in shillings")
+    parser.add_argument('--starvation-threshold', type=int)
+    parser.add_argument('--workers', type=int, default=0, help="turn engine process pool (db engine)")
+    parser.add_argument('--report-every', type=int, default=20)
+    parser.add_argument('--json', help="write the summary here")
+    parser.add_argument('--baseline', help="summary of an earlier run to compare seconds per turn with")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against --baseline")
+    args = parser.parse_args()
+
+    try:
+        mix = _parse_mix(args.mix)
+        yields = [_parse_yield(y) for y in args.yields]
+        king_pay = [int(x) for x in args.king_pay.split(",")] if args.king_pay else None
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"engine={args.engine} players={args.players} turns={args.turns} seed={args.seed} "
+          f"draws={'numpy' if np is not None else 'random'}")
+    with patched(king_pay, yields, args.level2_price, args.starvation_threshold):
+        summary = simulate(args.engine, args.players, args.turns, args.seed, mix, args.workers, args.report_every)
+    print(f"death rate {100 * summary['death_rate']:.1f}% ({summary['deaths_per_1000_player_turns']} per 1000 player-turns), "
+          f"money £{summary['money_shillings_start'] / SHILLINGS_PER_POUND:.0f} -> "
+          f"£{summary['money_shillings_end'] / SHILLINGS_PER_POUND:.0f} "
+          f"({summary['money_growth_per_turn'] / SHILLINGS_PER_POUND:+.1f} £/turn), "
+          f"{summary['level2_players']} at level 2")
+    print(f"{1000 * summary['seconds_per_turn']:.1f} ms/turn, p95 {1000 * summary['p95_seconds_per_turn']:.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        limit = baseline["seconds_per_turn"] * (1 + args.tolerance)
+        slower = summary["seconds_per_turn"] > limit
+        print(f"baseline {1000 * baseline['seconds_per_turn']:.1f} ms/turn ({baseline['engine']}, "
+              f"{baseline['players']} players): {'FAILED, slower than' if slower else 'OK, within'} "
+              f"{100 * args.tolerance:.0f}%")
+        sys.exit(1 if slower else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# bootstrap.py
+"""
+World bootstrap.
+
+Creates the schema and seeds the static world (items, cities, boats) in
+bulk. It is idempotent: only missing rows are inserted, so it is safe to
+run on every deploy.
+
+    $ python bootstrap.py            # or: flask --app wsgi bootstrap
+
+Once done it records SCHEMA_VERSION in app_meta. With FAST_STARTUP on,
+create_app() only compares that marker and skips create_all() and seeding
+when it matches, so workers start without schema or seed checks.
+"""
+
+from sqlalchemy import func, inspect, select, text, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import AppMeta, Boat, City, Inventory, Item
+from seed_items import items_data
+import catalog
+
+# Bump whenever tables or columns are added or the seed data below changes.
+SCHEMA_VERSION = "8"
+SCHEMA_VERSION_KEY = "schema_version"
+
+cities_data = [
+    {"key": "beautiful_forest", "name": "Beautiful Forest", "region": "mainland",
+     "description": "Old trees, mushrooms and chestnuts as far as the eye can see."},
+    {"key": "not_new_eden", "name": "Not-New-Eden", "region": "mainland",
+     "description": "Orchards and gardens; the fruit is sweet and sticky."},
+    {"key": "ocean_view", "name": "Ocean View", "region": "mainland",
+     "description": "A busy harbour town where the boat calls."},
+    {"key": "temple_island", "name": "Temple Island", "region": "islands",
+     "description": "A quiet island crowned by an ancient temple."},
+    {"key": "risible_rock", "name": "Risible Rock", "region": "islands",
+     "description": "A windswept rock nobody takes seriously."},
+]
+
+boats_data = [
+    {"key": "boat", "route": [c["key"] for c in cities_data], "current_index": 2},
+]
+
+def bootstrap_world():
+    """Create missing tables and seed rows, then stamp the schema version."""
+    db.create_all()
+    _unique_inventory_rows()
+    _admin_column()
+    added = {
+        "items": _insert_missing(Item, items_data),
+        "cities": _insert_missing(City, cities_data),
+        "boats": _insert_missing(Boat, boats_data),
+    }
+    _set_meta(SCHEMA_VERSION_KEY, SCHEMA_VERSION)
+    db.session.commit()
+    if added["items"] or added["cities"]:
+        catalog.invalidate()
+    return added
+
+def schema_is_current():
+    """True when app_meta says this database was bootstrapped at SCHEMA_VERSION."""
+    try:
+        stored = db.session.execute(
+            select(AppMeta.value).where(AppMeta.key == SCHEMA_VERSION_KEY)
+        ).scalar()
+    except SQLAlchemyError:
+        # no app_meta table yet
+        db.session.rollback()
+        return False
+    return stored == SCHEMA_VERSION
+
+def _unique_inventory_rows():
+    """
+    Databases created before uq_inventories_user_item may hold several rows
+    per (user, item): fold each group into its lowest id, then add the
+    unique index that inventory.apply_deltas() upserts on.
+    """
+    c = Inventory.__table__.c
+    duplicates = db.session.execute(
+        select(c.user_id, c.item_id, func.min(c.id), func.sum(func.coalesce(c.quantity, 0)))
+        .group_by(c.user_id, c.item_id).having(func.count() > 1)
+    ).all()
+    for user_id, item_id, keep_id, total in duplicates:
+        db.session.execute(Inventory.__table__.update().where(c.id == keep_id).values(quantity=total))
+        db.session.execute(Inventory.__table__.delete().where(
+            tuple_(c.user_id, c.item_id) == (user_id, item_id), c.id != keep_id
+        ))
+    inspector = inspect(db.session.connection())
+    pair = {"user_id", "item_id"}
+    if any(set(u["column_names"]) == pair for u in inspector.get_unique_constraints("inventories")):
+        return
+    if any(ix["unique"] and set(ix["column_names"]) == pair for ix in inspector.get_indexes("inventories")):
+        return
+    db.session.execute(text("CREATE UNIQUE INDEX uq_inventories_user_item ON inventories (user_id, item_id)"))
+
+def _admin_column():
+    """users.is_admin, for databases created before the column existed."""
+    columns = {c["name"] for c in inspect(db.session.connection()).get_columns("users")}
+    if "is_admin" not in columns:
+        db.session.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT FALSE"))
+
+def _insert_missing(model, rows):
+    existing = set(db.session.execute(select(model.key)).scalars())
+    missing = [row for row in rows if row["key"] not in existing]
+    if missing:
+        db.session.execute(model.__table__.insert(), missing)
+    return len(missing)
+
+def _set_meta(key, value):
+    meta = db.session.get(AppMeta, key)
+    if meta is None:
+        db.session.add(AppMeta(key=key, value=value))
+    else:
+        meta.value = value
+
+if __name__ == '__main__':
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        added = bootstrap_world()
+        print(f"Bootstrap complete (schema {SCHEMA_VERSION}): added {added}")
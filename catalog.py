@@ -0,0 +1,119 @@
+# catalog.py
+"""
+In-process catalog of Item and City rows.
+
+Items and cities almost never change, so every worker keeps an immutable
+snapshot of both tables, indexed by id, key and name, and the hot paths
+(eating, inventory changes, page rendering) read from it instead of the
+database.
+
+Changes go through invalidate(), which stores a new version stamp in
+app_meta. Every worker compares its snapshot's stamp with the stored one
+at most once every CATALOG_CHECK_SECONDS and reloads when they differ, so
+all gunicorn workers pick up a seed or admin edit within that window.
+"""
+
+from collections import namedtuple
+from types import MappingProxyType
+import threading
+import time
+import uuid
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from extensions import db
+from models import AppMeta, City, Item
+
+VERSION_KEY = "catalog_version"
+DEFAULT_CHECK_SECONDS = 5
+
+ItemRecord = namedtuple("ItemRecord", "id key name edible_hunger description stackable")
+CityRecord = namedtuple("CityRecord", "id key name region description has_market has_tavern is_colonisable founder_id")
+
+class Snapshot:
+    """One immutable copy of the catalog."""
+
+    def __init__(self, version, items, cities):
+        self.version = version
+        self.items_by_id = MappingProxyType({i.id: i for i in items})
+        self.items_by_key = MappingProxyType({i.key: i for i in items})
+        self.items_by_name = MappingProxyType({i.name: i for i in items})
+        self.cities_by_id = MappingProxyType({c.id: c for c in cities})
+        self.cities_by_key = MappingProxyType({c.key: c for c in cities})
+        self.cities_by_name = MappingProxyType({c.name: c for c in cities})
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def get_snapshot():
+    """The current snapshot, reloaded if another worker bumped the version."""
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    # read the global once: invalidate() may set it to None at any time
+    snapshot = _snapshot
+    if snapshot is not None and now - _checked_at < _check_seconds():
+        return snapshot
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None or now - _checked_at >= _check_seconds():
+            version = _stored_version()
+            if snapshot is None or snapshot.version != version:
+                snapshot = _snapshot = _load(version)
+            _checked_at = now
+    return snapshot
+
+def warm():
+    """Load the snapshot now (at startup) rather than on the first request."""
+    get_snapshot()
+
+def invalidate(commit: bool = True):
+    """Publish a new catalog version: this worker reloads now, the others on their next check."""
+    global _snapshot
+    meta = db.session.get(AppMeta, VERSION_KEY)
+    if meta is None:
+        meta = AppMeta(key=VERSION_KEY)
+        db.session.add(meta)
+    meta.value = uuid.uuid4().hex
+    if commit:
+        db.session.commit()
+    with _lock:
+        _snapshot = None
+
+# ------ Lookups ------
+def item_by_key(key: str):
+    return get_snapshot().items_by_key.get(key)
+
+def item_by_id(item_id: int):
+    return get_snapshot().items_by_id.get(item_id)
+
+def item_by_name(name: str):
+    return get_snapshot().items_by_name.get(name)
+
+def items():
+    return list(get_snapshot().items_by_id.values())
+
+def city_by_key(key: str):
+    return get_snapshot().cities_by_key.get(key)
+
+def city_by_id(city_id: int):
+    return get_snapshot().cities_by_id.get(city_id)
+
+def city_by_name(name: str):
+    return get_snapshot().cities_by_name.get(name)
+
+def cities():
+    return list(get_snapshot().cities_by_id.values())
+
+# ------ Loading ------
+def _check_seconds():
+    if has_app_context():
+        return current_app.config.get("CATALOG_CHECK_SECONDS", DEFAULT_CHECK_SECONDS)
+    return DEFAULT_CHECK_SECONDS
+
+def _stored_version():
+    return db.session.execute(select(AppMeta.value).where(AppMeta.key == VERSION_KEY)).scalar()
+
+def _load(version):
+    item_rows = db.session.execute(select(*(getattr(Item, f) for f in ItemRecord._fields))).all()
+    city_rows = db.session.execute(select(*(getattr(City, f) for f in CityRecord._fields))).all()
+    return Snapshot(version, [ItemRecord(*r) for r in item_rows], [CityRecord(*r) for r in city_rows])
@@ -1,12 +1,54 @@
 import os
+from pooling import database_uri, engine_options
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret')
 
-    uri = os.environ.get('DATABASE_URL', 'sqlite:///data.db')
-    # Heroku/Neon sometimes return "postgres://", adapt to SQLAlchemy.
-    if uri and uri.startswith('postgres://'):
-        uri = uri.replace('postgres://', 'postgresql://', 1)
+    # Heroku/Neon sometimes return "postgres://"; both spellings go to psycopg 3.
+    uri = database_uri(os.environ.get('DATABASE_URL', 'sqlite:///data.db'))
 
     SQLALCHEMY_DATABASE_URI = uri
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Resolve turns set-wise (game_logic._resolve_all_tasks_bulk) instead of task by task.
+    BULK_TURN_RESOLUTION = os.environ.get('BULK_TURN_RESOLUTION', '1') == '1'
+
+    # Send the per-request SQL statement count as an X-Query-Count header (benchmarks, local debugging).
+    EXPOSE_QUERY_COUNT = os.environ.get('EXPOSE_QUERY_COUNT', '0') == '1'
+
+    # Log and keep statements at least this slow (ms), with their endpoint; 0 turns it off (see instrumentation.py).
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    # Run this fraction of requests under cProfile and dump each profile into PROFILE_DIR.
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    # /metrics and /metrics/* only answer requests sending "Authorization: Bearer <METRICS_TOKEN>";
+    # with no token set they are off (404).
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # How often each worker checks app_meta for a new item/city catalog version.
+    CATALOG_CHECK_SECONDS = float(os.environ.get('CATALOG_CHECK_SECONDS', 5))
+
+    # Skip create_all()/seeding at startup when app_meta holds the current schema version.
+    FAST_STARTUP = os.environ.get('FAST_STARTUP', '1') == '1'
+
+    # Gunicorn worker model (see gunicorn.conf.py): 'sync', 'gthread' or 'gevent'.
+    WORKER_MODE = os.environ.get('WORKER_MODE', 'gevent')
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+    GEVENT_CONNECTIONS = int(os.environ.get('GEVENT_CONNECTIONS', 1000))
+
+    # Pool sizing, pre-ping, recycling, prepared statements and PgBouncer mode
+    # (DB_POOL_SIZE, DB_MAX_CONNECTIONS, DB_PGBOUNCER, ...): see pooling.py.
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(uri, WORKER_MODE, WEB_THREADS)
+
+    # Server-sent events cross processes by LISTEN/NOTIFY on this Postgres database (default: DATABASE_URL);
+    # set a direct URL when DATABASE_URL is a PgBouncer transaction pool (see events.py).
+    EVENTS_DATABASE_URL = os.environ.get('EVENTS_DATABASE_URL', '')
+    # The scheduler's advisory lock lives on a session of its own over this direct Postgres URL (default:
+    # DATABASE_URL). Required with DB_PGBOUNCER=1: a transaction pool cannot hold a session lock (see scheduler.py).
+    TURN_LOCK_DATABASE_URL = os.environ.get('TURN_LOCK_DATABASE_URL', '')
+    # Serve /api/events streams. Each open tab holds its connection for SSE_MAX_SECONDS, which only
+    # gevent can afford: under sync/gthread a few tabs would take every thread, so pages poll instead.
+    SSE_STREAMS = os.environ.get('SSE_STREAMS', '1' if WORKER_MODE == 'gevent' else '0') == '1'
+    SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    # sync workers are killed after gunicorn's 30s timeout, so their streams must end sooner
+    SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', 25 if WORKER_MODE == 'sync' else 300))
@@ -0,0 +1,200 @@
+# events.py
+"""
+Publish/subscribe for server-sent events.
+
+Topics are plain strings: 'tavern:<city key>', 'news', 'turn' and
+'user:<id>'. publish() fans an event out to every local subscriber of its
+topic; a subscriber is just a bounded deque and an Event, so thousands of
+idle ones cost a few kilobytes each. When a client falls behind, its
+oldest events are dropped (clients re-sync through the feeds API).
+
+On Postgres, events cross processes (web workers, the scheduler, the job
+worker) through LISTEN/NOTIFY on the database they already share: publish()
+sends a NOTIFY on EVENTS_CHANNEL, and each process with subscribers keeps
+one LISTEN connection whose reader thread delivers every notification to
+its local subscribers. Processes that never subscribe (scheduler, job
+worker) only ever open the publishing connection. While the listener is
+down, or for a payload over Postgres's 8000-byte NOTIFY limit, events are
+delivered locally only. EVENTS_DATABASE_URL defaults to the app's database;
+point it at a direct connection when DATABASE_URL goes through PgBouncer in
+transaction mode, which cannot hold a LISTEN. With SQLite, events stay in
+the process.
+"""
+
+from collections import deque
+import itertools
+import json
+import threading
+import time
+
+SUBSCRIBER_BACKLOG = 100
+HEARTBEAT_SECONDS = 15.0
+MAX_STREAM_SECONDS = 300.0
+RECONNECT_SECONDS = 2.0
+EVENTS_CHANNEL = "medieval_events"
+NOTIFY_MAX_BYTES = 7999
+
+_topics = {}   # topic -> set of Subscription
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_transport = None
+
+class Subscription:
+    """One listener's view of a set of topics."""
+
+    __slots__ = ("topics", "queue", "ready", "dropped", "__weakref__")
+
+    def __init__(self, topics):
+        self.topics = tuple(topics)
+        self.queue = deque(maxlen=SUBSCRIBER_BACKLOG)
+        self.ready = threading.Event()
+        self.dropped = 0
+
+    def push(self, event: dict):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(event)
+        self.ready.set()
+
+    def get(self, timeout: float = None):
+        """The next event, or None after `timeout` seconds without one."""
+        if not self.queue:
+            self.ready.wait(timeout)
+        self.ready.clear()
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            return None
+        finally:
+            if self.queue:
+                self.ready.set()
+
+def subscribe(topics):
+    if _transport is not None:
+        _transport.listen()
+    sub = Subscription(topics)
+    with _lock:
+        for topic in sub.topics:
+            _topics.setdefault(topic, set()).add(sub)
+    return sub
+
+def unsubscribe(sub: Subscription):
+    with _lock:
+        for topic in sub.topics:
+            subscribers = _topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(sub)
+                if not subscribers:
+                    del _topics[topic]
+
+def subscriber_count():
+    with _lock:
+        return len({s for subs in _topics.values() for s in subs})
+
+def publish(topic: str, event: str, data=None):
+    """Send an event to every subscriber of `topic`, in every process on Postgres."""
+    message = {"topic": topic, "event": event, "data": data}
+    if _transport is not None and _transport.send(message) and _transport.listening:
+        return  # LISTEN delivers it to this process too
+    _deliver(message)
+
+def _deliver(message: dict):
+    message = dict(message, id=next(_ids))
+    with _lock:
+        subscribers = list(_topics.get(message["topic"], ()))
+    for sub in subscribers:
+        sub.push(message)
+
+def sse_stream(sub: Subscription, heartbeat: float = None, max_seconds: float = None):
+    """
+    Server-sent event lines for one subscription. Ends after max_seconds
+    (EventSource reconnects by itself) and always unsubscribes.
+    """
+    heartbeat = heartbeat or HEARTBEAT_SECONDS
+    deadline = time.monotonic() + (max_seconds or MAX_STREAM_SECONDS)
+    try:
+        yield f"retry: {int(RECONNECT_SECONDS * 1000)}\n\n"
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            message = sub.get(min(heartbeat, left))
+            if message is None:
+                yield ": ping\n\n"
+                continue
+            payload = json.dumps({"topic": message["topic"], "data": message["data"]}, default=str)
+            yield f"id: {message['id']}\nevent: {message['event']}\ndata: {payload}\n\n"
+    finally:
+        unsubscribe(sub)
+
+# ------ Cross-process transport ------
+def init_app(app):
+    """Set up LISTEN/NOTIFY once per process when the events database is Postgres."""
+    global _transport, HEARTBEAT_SECONDS, MAX_STREAM_SECONDS
+    HEARTBEAT_SECONDS = app.config.get('SSE_HEARTBEAT_SECONDS', HEARTBEAT_SECONDS)
+    MAX_STREAM_SECONDS = app.config.get('SSE_MAX_SECONDS', MAX_STREAM_SECONDS)
+    url = app.config.get('EVENTS_DATABASE_URL') or app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    if url.startswith(('postgres://', 'postgresql')) and _transport is None:
+        _transport = _NotifyTransport(_libpq_url(url))
+
+def _libpq_url(url: str):
+    """psycopg.connect() takes postgresql:// URLs, without SQLAlchemy's driver name."""
+    scheme, _, rest = url.partition("://")
+    return "postgresql://" + rest
+
+class _NotifyTransport:
+    """NOTIFY on one autocommit connection; LISTEN, once needed, on another with a reader thread."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.listen_lock = threading.Lock()
+        self.started = False
+        self.listening = False
+
+    def send(self, message: dict):
+        import psycopg
+        payload = json.dumps(message, default=str)
+        if len(payload.encode()) > NOTIFY_MAX_BYTES:
+            return False
+        with self.send_lock:
+            try:
+                if self.conn is None or self.conn.closed:
+                    self.conn = psycopg.connect(self.url, autocommit=True, connect_timeout=5)
+                self.conn.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+                return True
+            except psycopg.Error:
+                self._close()
+                return False
+
+    def listen(self):
+        """Start the reader thread, once."""
+        with self.listen_lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._listen_forever, name="event-listener", daemon=True).start()
+
+    def _listen_forever(self):
+        import psycopg
+        while True:
+            try:
+                with psycopg.connect(self.url, autocommit=True, connect_timeout=5) as conn:
+                    conn.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    self.listening = True
+                    for notify in conn.notifies():
+                        _deliver(json.loads(notify.payload))
+            except (psycopg.Error, ValueError):
+                pass
+            self.listening = False
+            time.sleep(RECONNECT_SECONDS)
+
+    def _close(self):
+        import psycopg
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg.Error:
+                pass
+            self.conn = None
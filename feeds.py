@@ -0,0 +1,218 @@
+# feeds.py
+"""
+Message feeds: tavern chat, news and private messages.
+
+Every message belongs to one channel ('tavern:<city key>', 'news' or
+'user:<id>') and every read is a range scan of the (channel, id) index:
+  - latest(channel): the newest messages,
+  - page(channel, before_id): the page of older messages before an id,
+  - since(channel, since_id): only the messages newer than an id, for
+    clients polling with ?since_id=.
+
+New messages are also pushed to the channel's live subscribers (events.py).
+
+Each process keeps a ring buffer of the newest RING_SIZE messages per
+channel, so the usual "latest 50" and since_id polls are served from
+memory. The ring only ever holds what it read from the database: new
+messages, from any worker, are fetched (ids past the last one read) at most
+once every FEED_REFRESH_SECONDS per channel, and posting a message makes
+the poster's next read fetch at once. A ring never holds an id ahead of
+a lower one that was already committed when it was read, so a client
+polling since_id is not handed a newer id past unread ones. Ids are taken when a
+message is inserted, not when it commits, so rows from the last
+FEED_SETTLE_SECONDS are read again on every fetch: one committed after a
+higher id still reaches the ring.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+import re
+import threading
+import time
+from sqlalchemy import select
+from extensions import db
+from models import Message, User
+import events
+
+NEWS_CHANNEL = "news"
+DEFAULT_TAVERN = "ocean_view"
+FEED_PAGE_SIZE = 50
+MAX_FEED_PAGE_SIZE = 200
+RING_SIZE = 200
+FEED_REFRESH_SECONDS = 2.0
+FEED_SETTLE_SECONDS = 5.0
+
+_CHANNEL_RE = re.compile(r"^(news|tavern:[a-z0-9_]{1,60}|user:\d{1,12})$")
+
+class _Ring:
+    """The newest messages of one channel, oldest first."""
+
+    def __init__(self):
+        self.messages = deque(maxlen=RING_SIZE)
+        self.synced_id = 0     # the newest message read
+        self.settled_id = 0    # every message up to this id has been read, and none can still commit
+        self.complete = False  # True when the channel has no older messages
+        self.checked_at = 0.0
+
+    def covers(self, since_id: int):
+        """Whether every message after since_id is in the buffer."""
+        if self.complete or not self.messages:
+            return self.complete
+        return since_id >= self.messages[0]["id"] - 1
+
+    def merge(self, messages: list):
+        by_id = {m["id"]: m for m in self.messages}
+        by_id.update((m["id"], m) for m in messages)
+        if len(by_id) > RING_SIZE:
+            self.complete = False
+        self.messages.clear()
+        self.messages.extend(by_id[i] for i in sorted(by_id)[-RING_SIZE:])
+
+_rings = {}
+_lock = threading.Lock()
+
+def tavern_channel(city_key: str = DEFAULT_TAVERN):
+    return f"tavern:{city_key}"
+
+def user_channel(user_id: int):
+    return f"user:{user_id}"
+
+def valid_channel(channel: str):
+    return bool(channel) and _CHANNEL_RE.match(channel) is not None
+
+# ------ Writing ------
+def post_message(channel: str, body: str, sender=None, receiver_id: int = None, publish: bool = True,
+                 commit: bool = True):
+    """
+    Add a message to `channel`. `sender` is a User or None for system
+    messages. publish=False leaves the live push to the caller;
+    commit=False leaves the insert in the caller's transaction.
+    """
+    if not valid_channel(channel):
+        raise ValueError("invalid channel")
+    body = (body or "").strip()
+    if not body:
+        raise ValueError("empty message")
+    m = Message(
+        channel=channel, body=body, receiver_id=receiver_id,
+        sender_id=sender.id if sender else None,
+        is_tavern=channel.startswith("tavern:"), is_news=channel == NEWS_CHANNEL,
+    )
+    db.session.add(m)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+    message = _message_dict(m, sender.username if sender else None)
+    with _lock:
+        ring = _rings.get(channel)
+        if ring is not None:
+            # not merged here: other workers' lower ids may not be read yet
+            ring.checked_at = 0.0
+    if publish:
+        events.publish(channel, "message", to_json([message])[0])
+    return message
+
+# ------ Reading ------
+def latest(channel: str, limit: int = FEED_PAGE_SIZE):
+    """The newest `limit` messages of a channel, oldest first."""
+    limit = _clamp(limit)
+    ring = _fresh_ring(channel)
+    with _lock:
+        if len(ring.messages) >= limit or ring.complete:
+            return list(ring.messages)[-limit:]
+    return _query(channel, limit=limit)
+
+def since(channel: str, since_id: int, limit: int = MAX_FEED_PAGE_SIZE):
+    """Messages with id > since_id, oldest first (at most `limit` of them)."""
+    limit = _clamp(limit)
+    ring = _fresh_ring(channel)
+    with _lock:
+        if ring.covers(since_id):
+            return [m for m in ring.messages if m["id"] > since_id][:limit]
+    return _query(channel, after_id=since_id, limit=limit)
+
+def page(channel: str, before_id: int = None, limit: int = FEED_PAGE_SIZE):
+    """
+    The `limit` messages just before `before_id` (the newest when None),
+    oldest first. Returns (messages, next before_id or None).
+    """
+    limit = _clamp(limit)
+    rows = _query(channel, before_id=before_id, limit=limit + 1)
+    if len(rows) > limit:
+        rows = rows[1:]
+        return rows, rows[0]["id"]
+    return rows, None
+
+def _fresh_ring(channel: str):
+    """The channel's ring, topped up with other workers' messages if it is due."""
+    now = time.monotonic()
+    with _lock:
+        ring = _rings.get(channel)
+        if ring is None:
+            ring = _rings[channel] = _Ring()
+        elif now - ring.checked_at < FEED_REFRESH_SECONDS:
+            return ring
+        after_id = ring.settled_id if ring.synced_id else None
+    rows = _query(channel, after_id=after_id, limit=RING_SIZE) if after_id is not None else []
+    restart = after_id is None or len(rows) >= RING_SIZE
+    if restart:
+        # first use, or too far behind: start over from the newest rows
+        rows = _query(channel, limit=RING_SIZE)
+    settle_before = datetime.utcnow() - timedelta(seconds=FEED_SETTLE_SECONDS)
+    with _lock:
+        if restart:
+            ring.messages.clear()
+            ring.complete = len(rows) < RING_SIZE
+            ring.settled_id = rows[0]["id"] - 1 if rows else 0
+        ring.merge(rows)
+        if rows:
+            ring.synced_id = max(ring.synced_id, rows[-1]["id"])
+        # the next fetch starts after the last message older than the first young one:
+        # an id between them may still commit
+        young = min((m["id"] for m in rows if m["created_at"] is None or m["created_at"] > settle_before), default=None)
+        if young is None:
+            ring.settled_id = ring.synced_id
+        else:
+            ring.settled_id = max([ring.settled_id] + [m["id"] for m in rows if m["id"] < young])
+        ring.checked_at = now
+    return ring
+
+def _query(channel: str, after_id: int = None, before_id: int = None, limit: int = FEED_PAGE_SIZE):
+    """Messages of one channel, oldest first, via the (channel, id) index."""
+    query = (
+        select(Message.id, Message.channel, Message.sender_id, Message.receiver_id,
+               Message.body, Message.created_at, User.username.label("sender"))
+        .outerjoin(User, User.id == Message.sender_id)
+        .where(Message.channel == channel)
+    )
+    if after_id is not None:
+        # the rows right after after_id
+        query = query.where(Message.id > after_id).order_by(Message.id).limit(limit)
+        return [_message_dict(r, r.sender) for r in db.session.execute(query)]
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    query = query.order_by(Message.id.desc()).limit(limit)
+    rows = db.session.execute(query).all()
+    return [_message_dict(r, r.sender) for r in reversed(rows)]
+
+def _message_dict(m, sender_name: str = None):
+    return {
+        "id": m.id,
+        "channel": m.channel,
+        "sender_id": m.sender_id,
+        "sender": sender_name or ("System" if m.sender_id is None else "unknown"),
+        "receiver_id": m.receiver_id,
+        "body": m.body,
+        "created_at": m.created_at,
+    }
+
+def to_json(messages: list):
+    return [dict(m, created_at=m["created_at"].isoformat() if m["created_at"] else None) for m in messages]
+
+def _clamp(limit):
+    return max(1, min(int(limit), MAX_FEED_PAGE_SIZE))
+
+def clear_buffers():
+    with _lock:
+        _rings.clear()
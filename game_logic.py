@@ -1,21 +1,29 @@
 # game_logic.py
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from itertools import repeat
 import random
+import time
 from extensions import db
-from models import User, Task, Item, Inventory, Boat, City, Listing, News
-from sqlalchemy import and_
+from models import User, Task, Item, City, Listing, News
+from actions import (
+    KING_PAY_POUNDS, action_stats, get_action, merge_action_stats, reset_action_stats, roll_action,
+)
+import catalog
+import events
+import inventory
+import snapshots
+from voyages import advance_boats
+from sqlalchemy import and_, bindparam, case, func, or_, select, update
 
 # Constants (same as in models)
 SHILLINGS_PER_POUND = 20
 LEVEL2_PRICE_SHILLINGS = 55 * SHILLINGS_PER_POUND  # 1100
 PROPERTY_PRICE_SHILLINGS = 45 * SHILLINGS_PER_POUND  # 900
 GRAND_BOAT_CONSTRUCTION_UNITS = 10
-
-# Boat immune legs set: any pair among these is immune (no stuck)
-IMMUNE_BOAT_LEG_CITIES = {"ocean_view", "not_new_eden", "beautiful_forest"}
-
-# Weighted distribution for "Work for the King" pay: bias to 8-10
-KING_PAY_POUNDS = [8, 8, 8, 9, 9, 10, 10, 10, 11, 12, 13, 14, 15]
+# end-of-turn hunger below this costs 1 health
+STARVATION_THRESHOLD = 2
 
 # ------ Turn / time helpers ------
 def get_turn_number(now: datetime = None):
@@ -31,11 +39,16 @@ def user_has_task_this_turn(user: User):
     existing = Task.query.filter_by(user_id=user.id, resolved=False).filter(Task.resolve_turn > current_turn - 1).first()
     return existing is not None
 
-def start_task(user: User, action: str, params: dict = None, delay_turns: int = 1):
-    """Start a task for user. Enforces one task per turn rule."""
+def start_task(user: User, action: str, params: dict = None, delay_turns: int = None):
+    """Start a task for user. Enforces one task per turn rule; duration and cost come from the action registry."""
     if user_has_task_this_turn(user):
         raise ValueError("You already have a task for this turn.")
     params = params or {}
+    spec = get_action(action)
+    if delay_turns is None:
+        delay_turns = spec.duration
+    if spec.cost_shillings:
+        user.remove_money(spec.cost_shillings)
     current_turn = get_turn_number()
     task = Task(
         user_id=user.id,
@@ -50,16 +63,11 @@ def start_task(user: User, action: str, params: dict = None, delay_turns: int =
 
 # ------ Immediate actions ------
 def eat_item(user: User, item_key: str, qty: int = 1):
-    item = Item.query.filter_by(key=item_key).first()
+    item = catalog.item_by_key(item_key)
     if not item:
         raise ValueError("Unknown item")
-    inv = Inventory.query.filter_by(user_id=user.id, item_id=item.id).first()
-    if not inv or inv.quantity < qty:
-        raise ValueError("Not enough items")
     # Consume
-    inv.quantity -= qty
-    if inv.quantity <= 0:
-        db.session.delete(inv)
+    _take_items(user, item, qty)
     # Apply hunger gain immediately (cap at max_hunger)
     gain = (item.edible_hunger or 0) * qty
     user.hunger = min(user.max_hunger or 2, (user.hunger or 0) + gain)
@@ -68,15 +76,10 @@ def eat_item(user: User, item_key: str, qty: int = 1):
     return {"ok": True, "hunger": user.hunger}
 
 def drink_health_potion(user: User, item_key="health_potion", qty: int = 1):
-    item = Item.query.filter_by(key=item_key).first()
+    item = catalog.item_by_key(item_key)
     if not item:
         raise ValueError("No such potion item")
-    inv = Inventory.query.filter_by(user_id=user.id, item_id=item.id).first()
-    if not inv or inv.quantity < qty:
-        raise ValueError("Not enough potions")
-    inv.quantity -= qty
-    if inv.quantity <= 0:
-        db.session.delete(inv)
+    _take_items(user, item, qty, error="Not enough potions")
     # Health increase is immediate, capped
     user.health = min(user.max_health or 5, (user.health or 0) + qty)
     db.session.add(user)
@@ -85,31 +88,29 @@ def drink_health_potion(user: User, item_key="health_potion", qty: int = 1):
 
 # ------ Inventory helpers ------
 def add_item_to_user(user: User, item_key: str, qty: int = 1):
-    item = Item.query.filter_by(key=item_key).first()
+    item = catalog.item_by_key(item_key)
     if not item:
         return None
-    inv = Inventory.query.filter_by(user_id=user.id, item_id=item.id).first()
-    if inv:
-        inv.quantity += qty
-    else:
-        inv = Inventory(user_id=user.id, item_id=item.id, quantity=qty)
-        db.session.add(inv)
+    quantity = inventory.change(user.id, item.id, qty)
     db.session.commit()
-    return inv
+    return quantity
 
 def remove_item_from_user(user: User, item_key: str, qty: int = 1):
-    item = Item.query.filter_by(key=item_key).first()
+    item = catalog.item_by_key(item_key)
     if not item:
         raise ValueError("Unknown item")
-    inv = Inventory.query.filter_by(user_id=user.id, item_id=item.id).first()
-    if not inv or inv.quantity < qty:
-        raise ValueError("Not enough items")
-    inv.quantity -= qty
-    if inv.quantity <= 0:
-        db.session.delete(inv)
+    _take_items(user, item, qty)
     db.session.commit()
     return True
 
+def _take_items(user: User, item: Item, qty: int, error: str = "Not enough items"):
+    """Take qty of item from the user; on a shortfall roll back and raise ValueError."""
+    try:
+        inventory.change(user.id, item.id, -qty, error)
+    except ValueError:
+        db.session.rollback()
+        raise
+
 # ------ Leveling helpers (no XP) ------
 def attempt_level_up_to_2(user: User):
     """
@@ -147,14 +148,41 @@ def attempt_level_up_to_3(user: User):
     db.session.commit()
     return {"ok": True, "level": user.level}
 
+# ------ Turn timing ------
+class TurnTimer:
+    """Wall-clock timings for the phases of a turn, printed as a short report."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self):
+        total = sum(self.timings.values())
+        print(f"{self.label}: {total:.3f}s")
+        for name, seconds in self.timings.items():
+            print(f"  {name:<10} {seconds:8.3f}s")
+
 # ------ Task resolution ------
-def resolve_all_tasks():
+def resolve_all_tasks(bulk: bool = False):
     """
     Resolve all tasks whose resolve_turn <= current turn.
     Then handle boats movement & stuck rules.
     Then apply starvation health loss and reset hunger to 0 for everyone.
+
+    With bulk=True the tasks are resolved set-wise (see _resolve_tasks_bulk)
+    and the whole turn is written in a single transaction.
     """
     current_turn = get_turn_number()
+    if bulk:
+        return _resolve_all_tasks_bulk(current_turn)
     tasks = Task.query.filter(Task.resolve_turn <= current_turn, Task.resolved == False).all()
     news_created = []
     for task in tasks:
@@ -170,113 +198,241 @@ def resolve_all_tasks():
     # Move boats and process stuck rules
     _process_boats(current_turn, news_created)
     # Starvation & hunger reset (apply health loss if hunger < 2, then set hunger=0)
-    users = User.query.all()
-    for u in users:
-        if (u.hunger or 0) < 2:
-            u.health = max(0, (u.health or 0) - 1)
-        u.hunger = 0
-        db.session.add(u)
+    apply_starvation(reset_hunger=True)
     # Persist any generated news
     for n in news_created:
         news = News(title=n["title"], body=n["body"], meta=n.get("meta", {}))
         db.session.add(news)
+    queue_turn_jobs(current_turn, news_created)
     db.session.commit()
+    publish_turn_events(current_turn)
+
+def queue_turn_jobs(turn: int, news_created: list = (), done: bool = True):
+    """
+    Queue news fan-out and (once the turn is done) the stats rollup in the
+    caller's transaction, so the jobs commit together with the turn's results.
+    """
+    import jobs
+    if news_created:
+        jobs.enqueue("news_fanout", {"turn": turn, "news": [
+            {"title": n["title"], "body": n["body"]} for n in news_created
+        ]}, commit=False)
+    if done:
+        jobs.enqueue("stats_rollup", {"turn": turn}, commit=False)
+
+def publish_turn_events(turn: int):
+    """Tell live clients the turn changed; call once the turn has committed."""
+    events.publish("turn", "turn", {"turn": turn})
+
+def _resolve_all_tasks_bulk(current_turn: int):
+    """Bulk variant of resolve_all_tasks: same rules, a handful of statements."""
+    timer = TurnTimer(f"Turn {current_turn} (bulk)")
+    news_created = []
+    _resolve_tasks_bulk(current_turn, timer)
+    with timer.phase("boats"):
+        _process_boats(current_turn, news_created, commit=False)
+    with timer.phase("hunger"):
+        apply_starvation(reset_hunger=True)
+    with timer.phase("news"):
+        for n in news_created:
+            db.session.add(News(title=n["title"], body=n["body"], meta=n.get("meta", {})))
+        queue_turn_jobs(current_turn, news_created)
+    with timer.phase("commit"):
+        db.session.commit()
+    publish_turn_events(current_turn)
+    timer.report()
+
+def _resolve_tasks_bulk(current_turn: int, timer: TurnTimer, after_id: int = 0, limit: int = None,
+                        pool=None, workers: int = 1):
+    """
+    Resolve every due task without per-task round trips:
+      - due tasks and their users are each fetched with one query (items
+        come from the in-process catalog),
+      - tasks are grouped by action and rolled in memory,
+      - item gains go to inventory.apply_deltas() as one upsert; money,
+        health and task rows are written back with one executemany
+        statement each. Nothing is committed here.
+      - tasks whose user no longer exists are marked resolved with a
+        "no such user" failure, like the legacy resolvers do.
+    With after_id/limit only the next `limit` due tasks with id > after_id
+    are resolved (id order). Returns (tasks resolved, last task id seen).
+
+    Every task rolls with task_rng(turn, task id), so the outcome does not
+    depend on the number of workers. Given a process pool, the tasks are
+    partitioned by user_id across `workers` partitions.
+    """
+    due = and_(Task.resolve_turn <= current_turn, Task.resolved == False, Task.id > after_id)
+    with timer.phase("load"):
+        query = select(Task.id, Task.user_id, Task.action, Task.params).where(due).order_by(Task.id)
+        if limit is not None:
+            query = query.limit(limit)
+        tasks = db.session.execute(query).all()
+        if not tasks:
+            return 0, after_id
+        due_user_ids = select(Task.user_id).where(due) if limit is None else sorted({t.user_id for t in tasks})
+        user_ids = set(db.session.execute(select(User.id).where(User.id.in_(due_user_ids))).scalars())
+        item_ids = {item.key: item.id for item in catalog.items()}
+    with timer.phase("resolve"):
+        rows = [(t.id, t.user_id, t.action, t.params or {}) for t in tasks if t.user_id in user_ids]
+        if pool is not None:
+            partitions = [[] for _ in range(workers)]
+            for row in rows:
+                partitions[row[1] % workers].append(row)
+            rolled = list(pool.map(_roll_partition, [p for p in partitions if p], repeat(current_turn)))
+            for part in rolled:
+                merge_action_stats(part["stats"])
+        else:
+            rolled = [_roll_tasks(rows, current_turn)]
+        merged = _merge_rolls(rolled)
+        money_deltas, hp_lost, intelligence = merged["money"], merged["hp_lost"], merged["intelligence"]
+        item_deltas = defaultdict(int)   # (user_id, item_id) -> qty
+        for (user_id, key), qty in merged["items"].items():
+            if key in item_ids:
+                item_deltas[(user_id, item_ids[key])] += qty
+        task_rows = [{"b_id": task_id, "b_result": result} for task_id, result in merged["results"]]
+        # tasks of deleted players: resolved as failed, or every later turn would select them again
+        task_rows += [{"b_id": t.id, "b_result": {"failed": "no such user"}} for t in tasks if t.user_id not in user_ids]
+    with timer.phase("write"):
+        inventory.apply_deltas(item_deltas)
+        user_table = User.__table__
+        snapshots.touch(set(money_deltas) | set(hp_lost) | set(intelligence))
+        if money_deltas:
+            db.session.execute(
+                update(user_table).where(user_table.c.id == bindparam("b_id"))
+                .values(money_shillings=func.coalesce(user_table.c.money_shillings, 0) + bindparam("b_amount")),
+                [{"b_id": u, "b_amount": amount} for u, amount in money_deltas.items()],
+            )
+        if hp_lost:
+            health = func.coalesce(user_table.c.health, 0)
+            db.session.execute(
+                update(user_table).where(user_table.c.id == bindparam("b_id"))
+                .values(health=case((health > bindparam("b_lost"), health - bindparam("b_lost")), else_=0)),
+                [{"b_id": u, "b_lost": lost} for u, lost in hp_lost.items()],
+            )
+        if intelligence:
+            db.session.execute(
+                update(user_table).where(user_table.c.id == bindparam("b_id"))
+                .values(intelligence=func.coalesce(user_table.c.intelligence, 0) + bindparam("b_gain")),
+                [{"b_id": u, "b_gain": gain} for u, gain in intelligence.items()],
+            )
+        if task_rows:
+            task_table = Task.__table__
+            db.session.execute(
+                update(task_table).where(task_table.c.id == bindparam("b_id"))
+                .values(resolved=True, result=bindparam("b_result", type_=task_table.c.result.type)),
+                task_rows,
+            )
+        # The statements above bypass the identity map; drop stale User/Inventory state.
+        db.session.expire_all()
+    return len(task_rows), tasks[-1].id
+
+def task_rng(turn: int, task_id: int):
+    """Private RNG for one task of one turn: replaying the turn replays the rolls."""
+    return random.Random(f"{turn}:{task_id}")
+
+def _roll_tasks(rows: list, turn: int):
+    """
+    Roll a batch of (task_id, user_id, action, params) rows, grouped by action,
+    each task with task_rng(turn, task_id). Touches no database state, so it
+    also runs inside pool workers. Returns results plus per-user item (keyed
+    by item key), money, health and intelligence deltas.
+    """
+    by_action = defaultdict(list)
+    for row in rows:
+        by_action[row[2]].append(row)
+    rolled = {"results": [], "items": defaultdict(int), "money": defaultdict(int),
+              "hp_lost": defaultdict(int), "intelligence": defaultdict(int)}
+    for action, group in by_action.items():
+        outcomes = [roll_action(action, row[3], task_rng(turn, row[0])) for row in group]
+        for (task_id, user_id, _, _), result in zip(group, outcomes):
+            for key, qty in result.get("gained", {}).items():
+                rolled["items"][(user_id, key)] += qty
+            if result.get("earned_shillings"):
+                rolled["money"][user_id] += result["earned_shillings"]
+            if result.get("hp_lost"):
+                rolled["hp_lost"][user_id] += result["hp_lost"]
+            if result.get("intelligence_gained"):
+                rolled["intelligence"][user_id] += result["intelligence_gained"]
+            rolled["results"].append((task_id, result))
+    return {k: (v if k == "results" else dict(v)) for k, v in rolled.items()}
+
+def _roll_partition(rows: list, turn: int):
+    """_roll_tasks in a pool worker, with the action counters it recorded there for the parent to merge."""
+    reset_action_stats()
+    rolled = _roll_tasks(rows, turn)
+    rolled["stats"] = action_stats()
+    return rolled
+
+def _merge_rolls(rolled: list):
+    """Combine _roll_tasks outputs; results come back in task id order."""
+    merged = {"results": [], "items": defaultdict(int), "money": defaultdict(int),
+              "hp_lost": defaultdict(int), "intelligence": defaultdict(int)}
+    for part in rolled:
+        merged["results"].extend(part["results"])
+        for name in ("items", "money", "hp_lost", "intelligence"):
+            for k, v in part[name].items():
+                merged[name][k] += v
+    merged["results"].sort(key=lambda r: r[0])
+    return merged
 
 def _resolve_task(user: User, task: Task):
     """Internal task resolver. Returns a dict result."""
-    action = task.action
-    params = task.params or {}
-    if action == "gather_mushrooms":
-        qty = random.randint(2, 7)
-        add_item_to_user(user, "mushroom", qty)
-        return {"gained": {"mushroom": qty}}
-    if action == "gather_chestnuts":
-        qty = random.randint(2, 7)
-        add_item_to_user(user, "chestnut", qty)
-        return {"gained": {"chestnut": qty}}
-    if action == "gather_wild_herbs":
-        qty = random.randint(2, 4)
-        add_item_to_user(user, "wild_herb", qty)
-        return {"gained": {"wild_herb": qty}}
-    if action == "gather_fruits":
-        qty = random.randint(0, 3)
-        add_item_to_user(user, "fruit", qty)
-        return {"gained": {"fruit": qty}}
-    if action == "plant_wheat":
-        qty = random.randint(2, 7)
-        add_item_to_user(user, "bag_of_wheat", qty)
-        return {"gained": {"bag_of_wheat": qty}}
-    if action == "plant_vegetable":
-        qty = random.randint(1, 3)
-        add_item_to_user(user, "vegetable", qty)
-        return {"gained": {"vegetable": qty}}
-    if action == "work_for_king":
-        pounds = random.choice(KING_PAY_POUNDS)
-        shillings = pounds * SHILLINGS_PER_POUND
-        user.add_money(shillings)
+    result = _task_outcome(task.action, task.params or {})
+    for key, qty in result.get("gained", {}).items():
+        add_item_to_user(user, key, qty)
+    if result.get("earned_shillings"):
+        user.add_money(result["earned_shillings"])
         db.session.add(user)
-        return {"earned_shillings": shillings}
-    if action == "embark":
-        # Mark user param 'aboard' (implementation detail: you can store flags in Task.result or a user field)
-        return {"embarked": True}
-    if action == "disembark":
-        return {"disembarked": True}
-    if action == "try_swim":
-        if random.random() < 0.10:
-            return {"swim": "success"}
-        else:
-            # immediate HP loss and relocation handled by caller/routes after reading result
-            user.health = max(0, (user.health or 0) - 1)
-            db.session.add(user)
-            return {"swim": "failed", "hp_lost": 1}
-    if action == "study_geography":
-        discovered = random.random() < 0.5
-        return {"discovered": discovered}
-    # default no-op
-    return {"ok": True}
+    if result.get("hp_lost"):
+        # immediate HP loss and relocation handled by caller/routes after reading result
+        user.health = max(0, (user.health or 0) - result["hp_lost"])
+        db.session.add(user)
+    if result.get("intelligence_gained"):
+        user.intelligence = (user.intelligence or 0) + result["intelligence_gained"]
+        db.session.add(user)
+    return result
+
+def _task_outcome(action: str, params: dict, rng=random):
+    """Roll the outcome of a task. Touches no rows: callers apply the result."""
+    return roll_action(action, params, rng)
+
+# ------ Starvation ------
+def apply_starvation(threshold: int = None, reset_hunger: bool = True):
+    """
+    End-of-turn hunger pass, done set-wise in the database:
+      - every user with hunger < threshold (default STARVATION_THRESHOLD)
+        loses 1 health (never below 0),
+      - with reset_hunger, every user's hunger is then set back to 0.
+    Runs at most two UPDATE statements and does not commit; the commit
+    drops every player's snapshot, rebuilt on its next read.
+    Returns {"starved": rows, "reset": rows, "died": [user ids that hit 0 health]}.
+    """
+    threshold = STARVATION_THRESHOLD if threshold is None else threshold
+    users = User.__table__
+    hunger = func.coalesce(users.c.hunger, 0)
+    health = func.coalesce(users.c.health, 0)
+    starving = hunger < threshold
+    # Read before writing, in the same transaction: the ones at 1 health are about to die.
+    died = list(db.session.execute(
+        select(users.c.id).where(starving, health == 1).order_by(users.c.id)
+    ).scalars())
+    starved = db.session.execute(
+        update(users).where(starving).values(health=case((health > 1, health - 1), else_=0))
+    ).rowcount
+    reset = 0
+    if reset_hunger:
+        reset = db.session.execute(
+            update(users).where(or_(users.c.hunger.is_(None), users.c.hunger != 0)).values(hunger=0)
+        ).rowcount
+    # Loaded User objects still hold the old values.
+    db.session.expire_all()
+    if starved or reset:
+        snapshots.touch_all()
+    return {"starved": starved, "reset": reset, "died": died}
 
 # ------ Boat movement & stuck rules ------
-def _process_boats(current_turn: int, news_accumulator: list):
-    boats = Boat.query.all()
-    for boat in boats:
-        if boat.last_moved_turn == current_turn:
-            continue
-        route = boat.route or []
-        if not route:
-            continue
-        next_index = (boat.current_index + 1) % len(route)
-        from_city = route[boat.current_index]
-        to_city = route[next_index]
-        # Determine if stuck check applies
-        if (from_city in IMMUNE_BOAT_LEG_CITIES and to_city in IMMUNE_BOAT_LEG_CITIES):
-            stuck_check = False
-        else:
-            stuck_check = True
-        if stuck_check:
-            if not boat.stuck:
-                if random.random() < 0.5:
-                    boat.stuck = True
-                    boat.stuck_turns = 1
-                    boat.last_moved_turn = current_turn
-                    db.session.add(boat)
-                    news_accumulator.append({
-                        "title": f"{boat.key} stuck at sea",
-                        "body": f"The {boat.key} got stuck between {from_city} and {to_city}."
-                    })
-                    continue
-            else:
-                boat.stuck_turns += 1
-                boat.last_moved_turn = current_turn
-                db.session.add(boat)
-                continue
-        # move boat forward
-        boat.current_index = next_index
-        boat.last_moved_turn = current_turn
-        boat.stuck = False
-        boat.stuck_turns = 0
-        db.session.add(boat)
-        news_accumulator.append({
-            "title": f"{boat.key} arrived at {route[boat.current_index]}",
-            "body": f"The {boat.key} is now at {route[boat.current_index]}."
-        })
-    db.session.commit()
+def _process_boats(current_turn: int, news_accumulator: list, commit: bool = True):
+    """Step every boat for the turn (see voyages.py for the leg tables and stuck rules)."""
+    advance_boats(current_turn, news_accumulator)
+    if commit:
+        db.session.commit()
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, picked by the WORKER_MODE environment variable:
+
+  - sync:    one request at a time per worker (gunicorn's default),
+  - gthread: WEB_THREADS requests per worker on OS threads,
+  - gevent:  up to GEVENT_CONNECTIONS greenlets per worker, for many
+             long-lived connections (the default).
+
+Every logged-in page holds an /api/events stream open, so streams are only
+served under gevent (config.SSE_STREAMS); with sync or gthread the pages
+poll instead, or a handful of open tabs would hold every thread.
+
+Each worker keeps its own DB pool sized from the same settings (see
+config.Config.SQLALCHEMY_ENGINE_OPTIONS), and Flask-SQLAlchemy scopes
+sessions to the request context, which is thread- and greenlet-local, so
+no session is ever shared by two requests.
+
+    $ gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+import os
+from config import Config
+
+WORKER_MODES = ('sync', 'gthread', 'gevent')
+if Config.WORKER_MODE not in WORKER_MODES:
+    raise RuntimeError(f"WORKER_MODE must be one of {', '.join(WORKER_MODES)}, not {Config.WORKER_MODE!r}")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = Config.WORKER_MODE
+if worker_class == 'gthread':
+    threads = Config.WEB_THREADS
+if worker_class == 'gevent':
+    worker_connections = Config.GEVENT_CONNECTIONS
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 10
+keepalive = 5
+# Workers import the app themselves, after fork (and, for gevent, after
+# monkey-patching), so no pool or broker connection is inherited.
+preload_app = False
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
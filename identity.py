@@ -0,0 +1,32 @@
+# identity.py
+"""
+Request-scoped identity.
+
+current_user() resolves the logged-in User once per request and keeps it on
+flask.g, with the relationships the pages render (inventory -> item,
+properties) eager-loaded, so a page costs the same number of queries
+however many items the player holds.
+"""
+
+from flask import g, session
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from extensions import db
+from models import Inventory, User
+
+def current_user():
+    if "current_user" not in g:
+        g.current_user = _load_user(session.get('user_id'))
+    return g.current_user
+
+def _load_user(uid):
+    if not uid:
+        return None
+    return db.session.execute(
+        select(User)
+        .where(User.id == uid)
+        .options(
+            selectinload(User.inventory).joinedload(Inventory.item),
+            selectinload(User.properties),
+        )
+    ).scalar_one_or_none()
@@ -0,0 +1,306 @@
+# instrumentation.py
+"""
+Request, SQL and turn instrumentation.
+
+SQLAlchemy engine events time every statement. Flask request hooks time
+every request, keyed by endpoint (the view name, so the number of series
+stays fixed):
+  - per request: the SQL statement count (also sent as an X-Query-Count
+    header when EXPOSE_QUERY_COUNT is set) and the SQL time,
+  - per endpoint: a latency histogram and SQL statement and time totals.
+    Statements run outside a request (turns, jobs) are counted under
+    BACKGROUND,
+  - statements slower than SLOW_QUERY_MS are logged as warnings with the
+    endpoint that ran them, and the latest SLOW_QUERY_KEEP are kept for
+    /metrics/slow-queries,
+  - record_turn() adds a turn's phase timings (see turn_engine.run_turn) to
+    a histogram, and stores them in app_meta so that web workers can report
+    turns run by the scheduler process.
+
+render_metrics() writes all of it, plus the pool and job queue metrics, in
+the Prometheus text format for /metrics. Every worker process reports its
+own counters. The metrics endpoints only answer requests carrying
+METRICS_TOKEN, and are off without one (see config.py).
+
+With PROFILE_SAMPLE_RATE > 0 that fraction of requests runs under cProfile,
+one at a time per process, and each profile is dumped to
+PROFILE_DIR/<endpoint>.<unix ms>.<duration ms>ms.prof for pstats or snakeviz.
+"""
+
+from collections import deque
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from extensions import db
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BACKGROUND = '(background)'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TURN_PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+SLOW_QUERY_KEEP = 100
+SLOW_STATEMENT_CHARS = 500
+LAST_TURN_KEY = 'turn_timings'
+
+log = logging.getLogger(__name__)
+# statements at least this slow are captured; set from SLOW_QUERY_MS by init_app
+_slow_ms = 0.0
+
+def init_app(app):
+    global _slow_ms
+    _slow_ms = float(app.config.get('SLOW_QUERY_MS') or 0)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_query)
+        event.listen(db.engine, 'after_cursor_execute', _after_query)
+        event.listen(db.engine, 'handle_error', _failed_query)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_stop_profiler)
+
+def query_count():
+    """Statements executed so far in the current request."""
+    return g.get('query_count', 0)
+
+# ------ Collectors ------
+class _Histogram:
+    """Per-label-set bucket counts, sum and count, in the Prometheus layout."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}   # label values -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        with self.lock:
+            entry = self.series.get(labels)
+            if entry is None:
+                entry = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            else:
+                entry[0][-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {labels: ([*counts], total, n) for labels, (counts, total, n) in self.series.items()}
+
+class _Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, labels: tuple, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+_latency = _Histogram(LATENCY_BUCKETS)          # (endpoint, method, status)
+_sql_statements = _Counter()                    # (endpoint,)
+_sql_seconds = _Counter()                       # (endpoint,)
+_slow_total = _Counter()                        # (endpoint,)
+_turn_phases = _Histogram(TURN_PHASE_BUCKETS)   # (phase,)
+_slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+_profile_lock = threading.Lock()
+
+def reset():
+    """Forget everything recorded so far (for benchmarks)."""
+    for collector in (_latency, _turn_phases):
+        with collector.lock:
+            collector.series.clear()
+    for counter in (_sql_statements, _sql_seconds, _slow_total):
+        with counter.lock:
+            counter.values.clear()
+    _slow_queries.clear()
+
+# ------ SQL ------
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    seconds = time.perf_counter() - started
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_seconds = g.get('query_seconds', 0.0) + seconds
+        endpoint = request.endpoint or '(unmatched)'
+    else:
+        endpoint = BACKGROUND
+    _sql_statements.add((endpoint,))
+    _sql_seconds.add((endpoint,), seconds)
+    if _slow_ms and seconds * 1000 >= _slow_ms:
+        _record_slow(endpoint, statement, seconds, executemany)
+
+def _failed_query(context):
+    # after_cursor_execute does not run for a statement that raised
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+def _record_slow(endpoint: str, statement: str, seconds: float, executemany: bool):
+    statement = ' '.join(statement.split())[:SLOW_STATEMENT_CHARS]
+    path = request.path if has_request_context() else None
+    _slow_total.add((endpoint,))
+    _slow_queries.append({'at': datetime.utcnow().isoformat(), 'endpoint': endpoint, 'path': path,
+                          'ms': round(seconds * 1000, 2), 'executemany': executemany, 'statement': statement})
+    log.warning('slow query (%.1f ms) in %s: %s', seconds * 1000, endpoint, statement)
+
+def slow_queries():
+    """The latest slow statements, newest first."""
+    return list(reversed(_slow_queries))
+
+# ------ Requests ------
+def _start_request():
+    g.request_started = time.perf_counter()
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+    if rate and random.random() < rate and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _finish_request(response):
+    seconds = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.endpoint or '(unmatched)'
+    _latency.observe((endpoint, request.method, str(response.status_code)), seconds)
+    count = query_count()
+    if current_app.config.get('EXPOSE_QUERY_COUNT'):
+        response.headers[QUERY_COUNT_HEADER] = str(count)
+    current_app.logger.debug('%s %s: %d queries, %.1f ms SQL, %.1f ms total', request.method, request.path,
+                             count, 1000 * g.get('query_seconds', 0.0), 1000 * seconds)
+    return response
+
+def _stop_profiler(exc):
+    # a teardown hook, so a request that raised still releases the profiler
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    _profile_lock.release()
+    _dump_profile(profiler, time.perf_counter() - g.get('request_started', time.perf_counter()))
+
+def _dump_profile(profiler, seconds: float):
+    directory = current_app.config.get('PROFILE_DIR') or 'profiles'
+    os.makedirs(directory, exist_ok=True)
+    name = f"{request.endpoint or 'unmatched'}.{int(time.time() * 1000)}.{seconds * 1000:.0f}ms.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+
+# ------ Turns ------
+def record_turn(turn: int, timings: dict):
+    """Observe a finished turn's phase timings and store them as the last turn's (commits)."""
+    from models import AppMeta
+    for phase, seconds in timings.items():
+        _turn_phases.observe((phase,), seconds)
+    _turn_phases.observe(('total',), sum(timings.values()))
+    value = json.dumps({'turn': turn, 'phases': {phase: round(s, 6) for phase, s in timings.items()}})
+    meta = db.session.get(AppMeta, LAST_TURN_KEY)
+    if meta is None:
+        db.session.add(AppMeta(key=LAST_TURN_KEY, value=value))
+    else:
+        meta.value = value
+    db.session.commit()
+
+def last_turn():
+    """{'turn', 'phases'} of the last turn run by any process, or None."""
+    from models import AppMeta
+    meta = db.session.get(AppMeta, LAST_TURN_KEY)
+    return json.loads(meta.value) if meta and meta.value else None
+
+# ------ Prometheus text format ------
+def render_metrics(pool: dict = None, jobs: dict = None, queue: dict = None, turn: dict = None):
+    """
+    This process's metrics in the Prometheus text format; pass in
+    pooling.pool_stats(), jobs.job_metrics(), jobs.queue_depth() and
+    last_turn() to include those.
+    """
+    out = []
+    _histogram(out, 'medieval_http_request_duration_seconds', 'Request latency by endpoint.',
+               ('endpoint', 'method', 'status'), _latency)
+    _counter(out, 'medieval_sql_statements_total', 'SQL statements executed, by endpoint.',
+             ('endpoint',), _sql_statements.snapshot())
+    _counter(out, 'medieval_sql_seconds_total', 'Time spent in SQL statements, by endpoint.',
+             ('endpoint',), _sql_seconds.snapshot())
+    _counter(out, 'medieval_sql_slow_statements_total', 'Statements slower than SLOW_QUERY_MS, by endpoint.',
+             ('endpoint',), _slow_total.snapshot())
+    _histogram(out, 'medieval_turn_phase_seconds', 'Turn phase durations, for turns run by this process.',
+               ('phase',), _turn_phases)
+    if turn:
+        _gauge(out, 'medieval_last_turn', 'Number of the last turn run by any process.', (), {(): turn['turn']})
+        _gauge(out, 'medieval_last_turn_phase_seconds', 'Phase durations of the last turn.', ('phase',),
+               {(phase,): s for phase, s in turn['phases'].items()})
+    if pool:
+        _pool_metrics(out, pool)
+    if jobs:
+        _counter(out, 'medieval_jobs_total', 'Jobs run by this process, by kind and outcome.', ('kind', 'outcome'),
+                 {(kind, outcome): e[outcome] for kind, e in jobs['kinds'].items()
+                  for outcome in ('succeeded', 'failed', 'retried')})
+        _counter(out, 'medieval_jobs_seconds_total', 'Handler time of jobs run by this process.', ('kind',),
+                 {(kind,): e['seconds'] for kind, e in jobs['kinds'].items()})
+    if queue:
+        _gauge(out, 'medieval_jobs_queued', 'Jobs in the queue, by status.', ('status',),
+               {(status,): n for status, n in queue['counts'].items()})
+        _gauge(out, 'medieval_jobs_oldest_due_seconds', 'Age of the oldest due job.', (), {(): queue['oldest_due_seconds']})
+    return '\n'.join(out) + '\n'
+
+def _pool_metrics(out: list, pool: dict):
+    bounds = [b for b in pool['wait_buckets'] if b != '+Inf']
+    cumulative, buckets = 0, {}
+    for bound in bounds + ['+Inf']:
+        cumulative += pool['wait_buckets'][bound]
+        buckets[bound] = cumulative
+    out.append('# HELP medieval_db_pool_wait_seconds Time spent waiting for a pooled connection.')
+    out.append('# TYPE medieval_db_pool_wait_seconds histogram')
+    for bound, n in buckets.items():
+        out.append(f'medieval_db_pool_wait_seconds_bucket{{le="{bound}"}} {n}')
+    out.append(f"medieval_db_pool_wait_seconds_sum {pool['wait_seconds_total']}")
+    out.append(f"medieval_db_pool_wait_seconds_count {pool['checkouts']}")
+    _counter(out, 'medieval_db_pool_events_total', 'Pool timeouts, connects, disconnects and invalidations.',
+             ('event',), {(name,): pool[name] for name in ('timeouts', 'connect_errors', 'connects',
+                                                            'disconnects', 'invalidated')})
+    if 'size' in pool:
+        _gauge(out, 'medieval_db_pool_connections', 'Pool size and connections by state.', ('state',),
+               {(state,): pool[state] for state in ('size', 'checked_out', 'idle', 'overflow')})
+
+def _labels(names: tuple, values: tuple, extra: str = ''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _histogram(out: list, name: str, help_text: str, label_names: tuple, histogram: _Histogram):
+    out.append(f'# HELP {name} {help_text}')
+    out.append(f'# TYPE {name} histogram')
+    for labels, (counts, total, n) in sorted(histogram.snapshot().items()):
+        cumulative = 0
+        for bound, count in zip([str(b) for b in histogram.buckets] + ['+Inf'], counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            out.append(f'{name}_bucket{_labels(label_names, labels, le)} {cumulative}')
+        out.append(f'{name}_sum{_labels(label_names, labels)} {total:.6f}')
+        out.append(f'{name}_count{_labels(label_names, labels)} {n}')
+
+def _counter(out: list, name: str, help_text: str, label_names: tuple, values: dict):
+    out.append(f'# HELP {name} {help_text}')
+    out.append(f'# TYPE {name} counter')
+    for labels, value in sorted(values.items()):
+        out.append(f'{name}{_labels(label_names, labels)} {value}')
+
+def _gauge(out: list, name: str, help_text: str, label_names: tuple, values: dict):
+    out.append(f'# HELP {name} {help_text}')
+    out.append(f'# TYPE {name} gauge')
+    for labels, value in sorted(values.items()):
+        out.append(f'{name}{_labels(label_names, labels)} {value}')
@@ -0,0 +1,102 @@
+# inventory.py
+"""
+Inventory mutations.
+
+Every change to `inventories` goes through apply_deltas(): a batch of
+(user_id, item_id) -> delta changes becomes one INSERT ... ON CONFLICT
+(user_id, item_id) DO UPDATE, relying on the unique constraint on that
+pair (see models.Inventory). There is no read before the write, so
+concurrent writers neither lose updates nor create duplicate rows.
+
+The update only applies when the new quantity stays >= 0; RETURNING tells
+which rows changed. A rejected update returns nothing, and a negative
+delta on a row that did not exist comes back as a negative insert. Either
+way ValueError is raised and the caller rolls back, so nothing of the
+batch (or of the caller's pending work) is kept. Rows that reach 0 are
+deleted.
+"""
+
+from collections import defaultdict
+from sqlalchemy import func, insert, select, tuple_, update
+from extensions import db
+from models import Inventory
+import snapshots
+
+def apply_deltas(deltas, error: str = "Not enough items"):
+    """
+    Apply {(user_id, item_id): delta} (or (user_id, item_id, delta) triples)
+    in one statement. Returns {(user_id, item_id): new quantity}. Raises
+    ValueError(error) if any quantity would go below 0; the statement has
+    run by then, so the caller must roll back. The caller commits.
+    """
+    if isinstance(deltas, dict):
+        deltas = [(u, i, q) for (u, i), q in deltas.items()]
+    merged = defaultdict(int)
+    for user_id, item_id, qty in deltas:
+        merged[(user_id, item_id)] += qty
+    # key order, so two batches touching the same rows cannot deadlock
+    rows = [{"user_id": u, "item_id": i, "quantity": q} for (u, i), q in sorted(merged.items()) if q]
+    if not rows:
+        return {}
+    snapshots.touch({r["user_id"] for r in rows})
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return _apply_portable(rows, error)
+    table = Inventory.__table__
+    c = table.c
+    stmt = dialect_insert(table)
+    total = func.coalesce(c.quantity, 0) + stmt.excluded.quantity
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.user_id, c.item_id],
+        set_={"quantity": total},
+        where=total >= 0,
+    ).returning(c.user_id, c.item_id, c.quantity)
+    result = {(u, i): q for u, i, q in db.session.execute(stmt, rows)}
+    if len(result) < len(rows) or any(q < 0 for q in result.values()):
+        raise ValueError(error)
+    _drop_empty(result)
+    return result
+
+def change(user_id: int, item_id: int, delta: int, error: str = "Not enough items"):
+    """Apply one delta; returns the new quantity."""
+    if not delta:
+        return quantity(user_id, item_id)
+    return apply_deltas({(user_id, item_id): delta}, error)[(user_id, item_id)]
+
+def quantity(user_id: int, item_id: int):
+    return db.session.execute(
+        select(Inventory.quantity).where(Inventory.user_id == user_id, Inventory.item_id == item_id)
+    ).scalar() or 0
+
+def _drop_empty(result: dict):
+    empty = [key for key, qty in result.items() if qty == 0]
+    if empty:
+        c = Inventory.__table__.c
+        db.session.execute(
+            Inventory.__table__.delete().where(tuple_(c.user_id, c.item_id).in_(empty), c.quantity == 0)
+        )
+    # the statements above bypass the identity map
+    db.session.expire_all()
+
+def _apply_portable(rows: list, error: str):
+    """Conditional UPDATE, then INSERT for missing rows, for databases without ON CONFLICT."""
+    table = Inventory.__table__
+    c = table.c
+    result = {}
+    for row in rows:
+        key = (row["user_id"], row["item_id"])
+        changed = db.session.execute(
+            update(table).where(c.user_id == key[0], c.item_id == key[1], func.coalesce(c.quantity, 0) + row["quantity"] >= 0)
+            .values(quantity=func.coalesce(c.quantity, 0) + row["quantity"])
+        ).rowcount
+        if not changed:
+            if row["quantity"] < 0:
+                raise ValueError(error)
+            db.session.execute(insert(table).values(**row))
+        result[key] = db.session.execute(select(c.quantity).where(c.user_id == key[0], c.item_id == key[1])).scalar()
+    _drop_empty(result)
+    return result
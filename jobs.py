@@ -0,0 +1,270 @@
+# jobs.py
+"""
+Background job queue, stored in the game's own database.
+
+enqueue() inserts a Job row; `python jobs.py work` claims due jobs in
+batches and runs their handlers. Nothing else is needed: no broker, no
+network service.
+
+  - claiming is one UPDATE ... RETURNING over the oldest due jobs; on
+    Postgres the candidate rows are selected FOR UPDATE SKIP LOCKED, so
+    any number of workers share the queue without blocking each other.
+    SQLite runs the same UPDATE under its single-writer lock.
+  - a claimed job is invisible for VISIBILITY_SECONDS; if its worker dies,
+    it becomes due again once that passes,
+  - a failing job is retried with exponential backoff until max_attempts,
+    then left as 'failed' with its last error,
+  - job_metrics() reports this process's throughput and handler times,
+    queue_depth() the jobs per status.
+
+Handlers take the job's payload dict; register them with @job_handler.
+A handler does not commit: its writes commit in the same transaction that
+marks the job done, and only if this worker still holds the job, so a job
+redelivered after a crash or a visibility timeout never applies them
+twice. Work outside the database (live events) goes through after_commit();
+it runs once that transaction has committed, and is skipped if it fails.
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+import os
+import socket
+import threading
+import time
+import traceback
+from sqlalchemy import and_, func, or_, select, update
+from extensions import db
+from models import Job
+
+VISIBILITY_SECONDS = 60
+BATCH_SIZE = 10
+POLL_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 600
+
+HANDLERS = {}
+_AFTER_COMMIT = "jobs_after_commit"
+
+def job_handler(kind: str):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+# ------ Enqueueing ------
+def enqueue(kind: str, payload: dict = None, delay: float = 0, max_attempts: int = 5,
+            unique: bool = False, commit: bool = True):
+    """
+    Queue a job. With unique=True nothing is added while a job of the same
+    kind is still queued. commit=False leaves the insert in the caller's
+    transaction, so the job only exists if the caller's work commits.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind {kind!r}")
+    if unique and db.session.execute(
+        select(Job.id).where(Job.kind == kind, Job.status == "queued").limit(1)
+    ).first():
+        return None
+    job = Job(kind=kind, payload=payload or {}, max_attempts=max_attempts,
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    return job
+
+# ------ Working ------
+def claim(worker_id: str, limit: int = BATCH_SIZE, visibility: float = VISIBILITY_SECONDS):
+    """Take up to `limit` due jobs for `worker_id`. Returns (id, kind, payload, attempts, max_attempts) rows."""
+    now = datetime.utcnow()
+    jobs = Job.__table__
+    # running jobs whose worker vanished on their last attempt
+    db.session.execute(
+        update(jobs).where(jobs.c.status == "running", jobs.c.locked_until < now,
+                           jobs.c.attempts >= jobs.c.max_attempts)
+        .values(status="failed", finished_at=now, last_error=func.coalesce(jobs.c.last_error, "visibility timeout"))
+    )
+    due = or_(
+        and_(jobs.c.status == "queued", jobs.c.run_at <= now),
+        and_(jobs.c.status == "running", jobs.c.locked_until < now),
+    )
+    candidates = select(jobs.c.id).where(due).order_by(jobs.c.id).limit(limit)
+    if db.engine.dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+    rows = db.session.execute(
+        update(jobs).where(jobs.c.id.in_(candidates.scalar_subquery()))
+        .values(status="running", attempts=jobs.c.attempts + 1, locked_by=worker_id,
+                locked_until=now + timedelta(seconds=visibility))
+        .returning(jobs.c.id, jobs.c.kind, jobs.c.payload, jobs.c.attempts, jobs.c.max_attempts)
+    ).all()
+    db.session.commit()
+    return sorted(rows)
+
+def after_commit(fn):
+    """Call fn() once the running job's writes have committed (not at all if they roll back)."""
+    db.session.info.setdefault(_AFTER_COMMIT, []).append(fn)
+
+def run_claimed(job, worker_id: str):
+    """Run one claimed job and record the outcome. Returns True on success."""
+    started = time.perf_counter()
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"no handler for job kind {job.kind!r}")
+        handler(job.payload or {})
+        if not _finish(job, worker_id):
+            # the job timed out and went to another worker: its run counts, not ours
+            db.session.rollback()
+            db.session.info.pop(_AFTER_COMMIT, None)
+            return False
+        callbacks = db.session.info.pop(_AFTER_COMMIT, [])
+        db.session.commit()
+        ok, error = True, None
+    except Exception:
+        db.session.rollback()
+        db.session.info.pop(_AFTER_COMMIT, None)
+        ok, error, callbacks = False, traceback.format_exc(limit=5), []
+        _finish(job, worker_id, error)
+        db.session.commit()
+    _metrics.record(job.kind, ok, time.perf_counter() - started, retry=not ok and job.attempts < job.max_attempts)
+    for fn in callbacks:
+        fn()
+    return ok
+
+def _finish(job, worker_id: str, error: str = None):
+    """Settle the job in the current transaction; False if this worker no longer holds it."""
+    now = datetime.utcnow()
+    jobs = Job.__table__
+    # only the worker still holding the job may settle it
+    mine = update(jobs).where(jobs.c.id == job.id, jobs.c.locked_by == worker_id, jobs.c.status == "running")
+    if error is None:
+        values = {"status": "done", "finished_at": now, "locked_until": None}
+    elif job.attempts >= job.max_attempts:
+        values = {"status": "failed", "finished_at": now, "locked_until": None, "last_error": error}
+    else:
+        backoff = min(2 ** job.attempts, MAX_BACKOFF_SECONDS)
+        values = {"status": "queued", "run_at": now + timedelta(seconds=backoff),
+                  "locked_until": None, "locked_by": None, "last_error": error}
+    return db.session.execute(mine.values(**values)).rowcount == 1
+
+def work(worker_id: str = None, batch: int = BATCH_SIZE, poll: float = POLL_SECONDS,
+         visibility: float = VISIBILITY_SECONDS, once: bool = False, report_every: float = 60):
+    """Claim and run jobs until stopped (or, with once=True, until the queue is empty)."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Job worker {worker_id} started ({', '.join(sorted(HANDLERS))})")
+    reported = time.monotonic()
+    while True:
+        jobs = claim(worker_id, batch, visibility)
+        for job in jobs:
+            run_claimed(job, worker_id)
+        if time.monotonic() - reported >= report_every:
+            print(format_metrics())
+            reported = time.monotonic()
+        if not jobs:
+            if once:
+                return job_metrics()
+            time.sleep(poll)
+
+# ------ Metrics ------
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.kinds = defaultdict(lambda: {"succeeded": 0, "failed": 0, "retried": 0, "seconds": 0.0})
+
+    def record(self, kind: str, ok: bool, seconds: float, retry: bool):
+        with self.lock:
+            entry = self.kinds[kind]
+            entry["succeeded" if ok else "failed"] += 1
+            entry["retried"] += retry
+            entry["seconds"] += seconds
+
+_metrics = _Metrics()
+
+def job_metrics():
+    """Jobs run by this process since start: per kind, plus overall jobs/s."""
+    with _metrics.lock:
+        elapsed = time.monotonic() - _metrics.started
+        kinds = {kind: dict(entry) for kind, entry in _metrics.kinds.items()}
+    done = sum(e["succeeded"] + e["failed"] for e in kinds.values())
+    return {"kinds": kinds, "processed": done, "elapsed_seconds": round(elapsed, 3),
+            "jobs_per_second": round(done / elapsed, 2) if elapsed else 0.0}
+
+def format_metrics():
+    m = job_metrics()
+    lines = [f"{m['processed']} jobs in {m['elapsed_seconds']:.0f}s ({m['jobs_per_second']}/s)"]
+    for kind, e in sorted(m["kinds"].items()):
+        runs = e["succeeded"] + e["failed"]
+        lines.append(f"  {kind:16} {e['succeeded']} ok, {e['failed']} failed ({e['retried']} to retry), "
+                     f"{1000 * e['seconds'] / max(runs, 1):.1f} ms avg")
+    return "\n".join(lines)
+
+def queue_depth():
+    """Jobs per status, and the age of the oldest due job."""
+    counts = dict(db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+    oldest = db.session.execute(
+        select(func.min(Job.run_at)).where(Job.status == "queued", Job.run_at <= datetime.utcnow())
+    ).scalar()
+    return {"counts": counts,
+            "oldest_due_seconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0.0}
+
+# ------ Handlers ------
+@job_handler("seed_catalog")
+def _seed_catalog(payload):
+    from bootstrap import bootstrap_world
+    bootstrap_world()
+
+@job_handler("news_fanout")
+def _news_fanout(payload):
+    """Copy turn news into the 'news' feed and push it to live clients."""
+    import events
+    import feeds
+    for n in payload.get("news", []):
+        feeds.post_message(feeds.NEWS_CHANNEL, f"{n['title']}: {n['body']}", publish=False, commit=False)
+        # one live event per item: the 'news' one, which clients show
+        after_commit(lambda n=n: events.publish(
+            "news", "news", {"title": n["title"], "body": n["body"], "turn": payload.get("turn")}))
+
+@job_handler("stats_rollup")
+def _stats_rollup(payload):
+    """Store the world's totals for a turn in app_meta under 'stats:<turn>'."""
+    import json
+    from models import AppMeta, Trade, User
+    turn = payload["turn"]
+    players, alive, money = db.session.execute(
+        select(func.count(User.id), func.count(User.id).filter(User.health > 0),
+               func.coalesce(func.sum(User.money_shillings), 0))
+    ).one()
+    trades, volume, turnover = db.session.execute(
+        select(func.count(Trade.id), func.coalesce(func.sum(Trade.quantity), 0),
+               func.coalesce(func.sum(Trade.quantity * Trade.price_shillings), 0))
+        .where(Trade.turn == turn)
+    ).one()
+    value = json.dumps({"players": players, "alive": alive, "money_shillings": money,
+                        "trades": trades, "units_traded": volume, "turnover_shillings": turnover})
+    key = f"stats:{turn}"
+    meta = db.session.get(AppMeta, key)
+    if meta is None:
+        db.session.add(AppMeta(key=key, value=value))
+    else:
+        meta.value = value
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background jobs.")
+    parser.add_argument('command', choices=['work', 'stats'])
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS)
+    parser.add_argument('--visibility', type=float, default=VISIBILITY_SECONDS)
+    parser.add_argument('--once', action='store_true', help="exit when the queue is empty")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        if args.command == 'stats':
+            print(queue_depth())
+        else:
+            work(batch=args.batch, poll=args.poll, visibility=args.visibility, once=args.once)
+            print(format_metrics())
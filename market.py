@@ -0,0 +1,166 @@
+# market.py
+"""
+Market queries and purchases.
+
+Listings are read with a single joined query (listing + seller name + item
+name) and paged with a keyset cursor on (created_at, id), newest first, so
+a page costs the same whatever the size of the market. The composite
+indexes on `listings` (see models.Listing) back every filter combination.
+
+Purchases never read-then-write: buy_listing() takes the quantity off the
+listing with a conditional UPDATE ... WHERE quantity >= :qty, so concurrent
+buyers of one listing can never oversell it, and the whole purchase is one
+short transaction retried on serialization failures and deadlocks.
+"""
+
+from datetime import datetime
+import random
+import time
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import DBAPIError
+from extensions import db
+from models import Item, Listing, User, SHILLINGS_PER_POUND
+from prices import record_trade
+import inventory
+import snapshots
+
+MARKET_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+PURCHASE_ATTEMPTS = 5
+# Postgres serialization_failure / deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+def list_listings(city_id: int = None, item_id: int = None, cursor: str = None, limit: int = MARKET_PAGE_SIZE):
+    """
+    One page of listings, newest first. `cursor` is the next_cursor returned
+    with the previous page. Returns (listings as dicts, next_cursor or None).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = (
+        select(
+            Listing.id, Listing.seller_id, Listing.item_id, Listing.city_id,
+            Listing.quantity, Listing.price_shillings, Listing.created_at,
+            User.username.label('seller'), Item.name.label('item'),
+        )
+        .outerjoin(User, User.id == Listing.seller_id)
+        .outerjoin(Item, Item.id == Listing.item_id)
+    )
+    if city_id is not None:
+        query = query.where(Listing.city_id == city_id)
+    if item_id is not None:
+        query = query.where(Listing.item_id == item_id)
+    if cursor:
+        created_at, listing_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Listing.created_at < created_at,
+            and_(Listing.created_at == created_at, Listing.id < listing_id),
+        ))
+    query = query.order_by(Listing.created_at.desc(), Listing.id.desc()).limit(limit + 1)
+    rows = db.session.execute(query).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [_listing_dict(r) for r in rows[:limit]], next_cursor
+
+def encode_cursor(row):
+    return f"{row.created_at.isoformat()},{row.id}"
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, listing_id = cursor.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(listing_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+def _listing_dict(row):
+    return {
+        'id': row.id,
+        'seller_id': row.seller_id,
+        'seller': row.seller or 'unknown',
+        'item_id': row.item_id,
+        'item': row.item or 'unknown',
+        'city_id': row.city_id,
+        'qty': row.quantity,
+        'price': row.price_shillings,
+        'price_pounds': (row.price_shillings or 0) // SHILLINGS_PER_POUND,
+        'price_shillings': (row.price_shillings or 0) % SHILLINGS_PER_POUND,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+    }
+
+# ------ Purchases ------
+def buy_listing(buyer_id: int, listing_id: int, qty: int):
+    """
+    Buy `qty` units of a listing (price_shillings is per unit). Raises
+    ValueError when the listing cannot supply qty or the buyer cannot pay;
+    nothing is changed in that case.
+    """
+    if qty < 1:
+        raise ValueError("invalid listing or qty")
+    for attempt in range(1, PURCHASE_ATTEMPTS + 1):
+        try:
+            result = _buy_once(buyer_id, listing_id, qty)
+            db.session.commit()
+            return result
+        except ValueError:
+            db.session.rollback()
+            raise
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt == PURCHASE_ATTEMPTS or not _is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+def _buy_once(buyer_id: int, listing_id: int, qty: int):
+    listings = Listing.__table__
+    users = User.__table__
+    # 1) take the units off the listing, only if there are enough left
+    taken = update(listings).where(listings.c.id == listing_id, listings.c.quantity >= qty).values(
+        quantity=listings.c.quantity - qty
+    )
+    if db.engine.dialect.update_returning:
+        row = db.session.execute(
+            taken.returning(listings.c.seller_id, listings.c.item_id, listings.c.city_id, listings.c.price_shillings)
+        ).first()
+    else:
+        row = None
+        if db.session.execute(taken).rowcount:
+            row = db.session.execute(
+                select(listings.c.seller_id, listings.c.item_id, listings.c.city_id, listings.c.price_shillings)
+                .where(listings.c.id == listing_id)
+            ).first()
+    if row is None:
+        raise ValueError("invalid listing or qty")
+    seller_id, item_id, city_id, unit_price = row
+    total = (unit_price or 0) * qty
+    snapshots.touch({buyer_id, seller_id})
+
+    # 2) move the money; users are updated in id order so that two
+    #    traders buying from each other cannot deadlock
+    for user_id in sorted({buyer_id, seller_id}):
+        if user_id == buyer_id:
+            paid = db.session.execute(
+                update(users).where(users.c.id == buyer_id, users.c.money_shillings >= total)
+                .values(money_shillings=users.c.money_shillings - total)
+            ).rowcount
+            if not paid:
+                raise ValueError("not enough money")
+        if user_id == seller_id:
+            db.session.execute(
+                update(users).where(users.c.id == seller_id)
+                .values(money_shillings=users.c.money_shillings + total)
+            )
+
+    # 3) deliver the goods
+    inventory.change(buyer_id, item_id, qty)
+
+    # 4) sold-out listings disappear
+    db.session.execute(listings.delete().where(listings.c.id == listing_id, listings.c.quantity <= 0))
+    record_trade(item_id, city_id, unit_price or 0, qty, buyer_id=buyer_id, seller_id=seller_id)
+    db.session.expire_all()
+    return {"listing_id": listing_id, "item_id": item_id, "qty": qty, "total_shillings": total, "seller_id": seller_id}
+
+def _is_retryable(error: DBAPIError):
+    sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    # SQLite: another writer holds the database lock
+    return "database is locked" in str(error.orig)
@@ -0,0 +1,68 @@
+"""Indexes for the hot query patterns
+
+  - tasks: (user_id, resolved, resolve_turn) for a player's pending task,
+    and (id, resolve_turn) over unresolved tasks only, walked in id order
+    for the turn's due tasks. Both replace ix_tasks_user_id.
+  - inventories: uq_inventories_user_item already starts with user_id, so
+    ix_inventories_user_id goes.
+  - properties: owner_id, loaded with every request's current user.
+  - trades: turn, for the per-turn stats rollup.
+
+bootstrap_world() creates the same indexes on a new database, so each one
+is only added if missing. On Postgres they are built CONCURRENTLY, so
+writes to the tables are not blocked meanwhile.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_tasks_user_resolved_turn', 'tasks', ['user_id', 'resolved', 'resolve_turn'], {}),
+    ('ix_tasks_unresolved_id', 'tasks', ['id', 'resolve_turn'],
+     {'postgresql_where': sa.text('resolved = false'), 'sqlite_where': sa.text('resolved = 0')}),
+    ('ix_properties_owner_id', 'properties', ['owner_id'], {}),
+    ('ix_trades_turn', 'trades', ['turn'], {}),
+]
+SUPERSEDED = [
+    ('ix_tasks_user_id', 'tasks', ['user_id']),
+    ('ix_inventories_user_id', 'inventories', ['user_id']),
+]
+
+
+def _existing():
+    inspector = sa.inspect(op.get_bind())
+    tables = {table for _, table, _, _ in INDEXES} | {table for _, table, _ in SUPERSEDED}
+    return {table: {ix['name'] for ix in inspector.get_indexes(table)} for table in tables}
+
+
+def upgrade():
+    existing = _existing()
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES:
+            if name not in existing[table]:
+                op.create_index(name, table, columns, postgresql_concurrently=True, **kwargs)
+        for name, table, _ in SUPERSEDED:
+            if name in existing[table]:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def downgrade():
+    existing = _existing()
+    with op.get_context().autocommit_block():
+        for name, table, columns in SUPERSEDED:
+            if name not in existing[table]:
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+        for name, table, _, _ in INDEXES:
+            if name in existing[table]:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
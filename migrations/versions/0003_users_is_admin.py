@@ -0,0 +1,36 @@
+"""users.is_admin
+
+Admin routes checked User.is_admin, which was never a column. Existing
+players start as non-admins; grant it with `flask --app wsgi make-admin`.
+bootstrap_world() adds the same column to a database it finds without it,
+so it is only added if missing.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns('users')}
+
+
+def upgrade():
+    if 'is_admin' not in _columns():
+        op.add_column('users', sa.Column('is_admin', sa.Boolean(), nullable=True, server_default=sa.false()))
+
+
+def downgrade():
+    if 'is_admin' in _columns():
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.drop_column('is_admin')
@@ -1,7 +1,7 @@
 # models.py
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index, UniqueConstraint, text
+from sqlalchemy.orm import relationship, synonym
 from extensions import db
 
 # Constants
@@ -30,9 +30,15 @@ class User(db.Model):
     virtue = Column(Integer, default=0)      # appears in UI at level >= 2
     level = Column(Integer, default=1)       # 1, 2, 3 supported
 
+    # guards /admin/*; the first registered player gets it (see also `flask make-admin`)
+    is_admin = Column(Boolean, default=False)
+
     # Simple mailbox (JSON list of messages; each message can be a dict)
     mailbox = Column(JSON, default=list)
 
+    # the forms and templates call it a nickname
+    nickname = synonym("username")
+
     # Relationships
     inventory = relationship("Inventory", back_populates="user", cascade="all, delete-orphan")
     tasks = relationship("Task", back_populates="user", cascade="all, delete-orphan")
@@ -47,6 +53,10 @@ class User(db.Model):
             raise ValueError("Insufficient funds")
         self.money_shillings -= shillings
 
+    def display_money(self):
+        pounds, shillings = divmod(self.money_shillings or 0, SHILLINGS_PER_POUND)
+        return f"£{pounds} {shillings}s"
+
     def can_level2(self):
         """Return True if user meets level2 static criteria (intelligence & money payment separate)."""
         return (self.intelligence or 0) >= 2
@@ -67,17 +77,23 @@ class Item(db.Model):
 class Inventory(db.Model):
     __tablename__ = "inventories"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    # looked up through uq_inventories_user_item, which starts with user_id
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
     quantity = Column(Integer, default=0)
 
     user = relationship("User", back_populates="inventory")
     item = relationship("Item")
 
+    __table_args__ = (
+        # one row per (user, item): inventory.apply_deltas() upserts on it
+        UniqueConstraint("user_id", "item_id", name="uq_inventories_user_item"),
+    )
+
 class Task(db.Model):
     __tablename__ = "tasks"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     action = Column(String(120), nullable=False)  # e.g. 'gather_mushrooms'
     params = Column(JSON, default={})
     start_turn = Column(Integer, nullable=False)
@@ -88,6 +104,15 @@ class Task(db.Model):
 
     user = relationship("User", back_populates="tasks")
 
+    __table_args__ = (
+        # a player's pending task (game_logic.user_has_task_this_turn)
+        Index("ix_tasks_user_resolved_turn", "user_id", "resolved", "resolve_turn"),
+        # a turn's due tasks in id order (game_logic._resolve_tasks_bulk); resolved
+        # tasks are most of the table and never read again, so they are left out
+        Index("ix_tasks_unresolved_id", "id", "resolve_turn",
+              postgresql_where=text("resolved = false"), sqlite_where=text("resolved = 0")),
+    )
+
 class City(db.Model):
     __tablename__ = "cities"
     id = Column(Integer, primary_key=True)
@@ -110,6 +135,13 @@ class Listing(db.Model):
     city_id = Column(Integer, ForeignKey("cities.id"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Keyset pagination (market.list_listings): newest first, optionally per city / item
+    __table_args__ = (
+        Index("ix_listings_created_id", "created_at", "id"),
+        Index("ix_listings_city_created_id", "city_id", "created_at", "id"),
+        Index("ix_listings_item_created_id", "item_id", "created_at", "id"),
+    )
+
 class Boat(db.Model):
     __tablename__ = "boats"
     id = Column(Integer, primary_key=True)
@@ -125,7 +157,7 @@ class Boat(db.Model):
 class Property(db.Model):
     __tablename__ = "properties"
     id = Column(Integer, primary_key=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     city_id = Column(Integer, ForeignKey("cities.id"))
     name = Column(String(120), default="Property")
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -139,3 +171,138 @@ class News(db.Model):
     title = Column(String(240))
     body = Column(Text)
     meta = Column(JSON, default={})
+
+class Message(db.Model):
+    """A chat line, news item or private message. Feeds (see feeds.py) read it by channel."""
+    __tablename__ = "messages"
+    id = Column(Integer, primary_key=True)
+    channel = Column(String(80), nullable=False)  # 'tavern:<city key>', 'news' or 'user:<id>'
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    body = Column(Text, nullable=False)
+    is_tavern = Column(Boolean, default=False)
+    is_news = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    sender = relationship("User", foreign_keys=[sender_id])
+
+    __table_args__ = (
+        Index("ix_messages_channel_id", "channel", "id"),
+    )
+
+class Job(db.Model):
+    """A unit of deferred work for jobs.py; claimed with SKIP LOCKED and retried until max_attempts."""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(60), nullable=False)
+    payload = Column(JSON, default=dict)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # not visible before this
+    locked_until = Column(DateTime, nullable=True)  # a running job past this is claimed again
+    locked_by = Column(String(80), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at", "id"),
+    )
+
+class TurnCheckpoint(db.Model):
+    """Progress of one turn through turn_engine; a killed run resumes from here."""
+    __tablename__ = "turn_checkpoints"
+    turn = Column(Integer, primary_key=True)
+    phase = Column(String(40), nullable=False, default="tasks")  # next phase to run, or 'done'
+    last_task_id = Column(Integer, default=0)                     # highest task id already resolved
+    tasks_resolved = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class PlayerSnapshot(db.Model):
+    """Compact JSON state of one player, served by /api/player and /game (see snapshots.py)."""
+    __tablename__ = "player_snapshots"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    etag = Column(String(64), nullable=False)
+    data = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class AppMeta(db.Model):
+    """Small key/value store for deployment-wide markers (catalog version, schema version...)."""
+    __tablename__ = "app_meta"
+    key = Column(String(80), primary_key=True)
+    value = Column(String(255), nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Order(db.Model):
+    """A resting or finished limit order in a city's order book (see order_book.py)."""
+    __tablename__ = "orders"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    city_id = Column(Integer, ForeignKey("cities.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    side = Column(String(4), nullable=False)          # 'buy' or 'sell'
+    price_shillings = Column(Integer, nullable=False)  # limit price per unit
+    quantity = Column(Integer, nullable=False)
+    remaining = Column(Integer, nullable=False)
+    status = Column(String(12), default="open")       # open, filled, cancelled
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_orders_status_book", "status", "city_id", "item_id"),
+    )
+
+class Fill(db.Model):
+    """One match between a buy and a sell order, at the resting order's price."""
+    __tablename__ = "fills"
+    id = Column(Integer, primary_key=True)
+    buy_order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    sell_order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    seller_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    city_id = Column(Integer, ForeignKey("cities.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    price_shillings = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Trade(db.Model):
+    """Every completed trade, from fixed-price listings and from the order books."""
+    __tablename__ = "trades"
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    city_id = Column(Integer, nullable=False, default=0)  # 0 = listing without a city
+    turn = Column(Integer, nullable=False)
+    price_shillings = Column(Integer, nullable=False)     # per unit
+    quantity = Column(Integer, nullable=False)
+    buyer_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    seller_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    source = Column(String(20), default="listing")        # 'listing' or 'order_book'
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_trades_item_city_id", "item_id", "city_id", "id"),
+        # the per-turn stats rollup (jobs._stats_rollup)
+        Index("ix_trades_turn", "turn"),
+    )
+
+class PriceBar(db.Model):
+    """Open/high/low/close and volume of one item in one city over one turn, kept up to date by prices.py."""
+    __tablename__ = "price_bars"
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    city_id = Column(Integer, nullable=False, default=0)
+    turn = Column(Integer, nullable=False)
+    open = Column(Integer, nullable=False)
+    high = Column(Integer, nullable=False)
+    low = Column(Integer, nullable=False)
+    close = Column(Integer, nullable=False)
+    volume = Column(Integer, nullable=False, default=0)    # units traded
+    turnover = Column(Integer, nullable=False, default=0)  # shillings traded; vwap = turnover / volume
+    trades = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("item_id", "city_id", "turn", name="uq_price_bars_item_city_turn"),
+    )
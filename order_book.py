@@ -0,0 +1,236 @@
+# order_book.py
+"""
+Per-city, per-item order books with price-time priority.
+
+The book of a (city_id, item_id) pair is its open Order rows. Nothing is
+kept in process memory, so every web worker, thread and background
+process sees the same book. Incoming orders match against the opposite
+side as they arrive, best price first, then oldest order id; a fill always
+happens at the resting order's price.
+
+place_order() is one short transaction, retried on serialization failures
+and deadlocks like market.buy_listing():
+  - escrow the buyer's money (price * qty) or the seller's items and insert
+    the Order row,
+  - read the best crossing resting orders, leaving out the trader's own
+    (no self-trades), and take each fill off its order
+    with a conditional UPDATE ... WHERE status = 'open' AND remaining >= :qty.
+    An order filled or cancelled by a concurrent transaction fails the
+    condition and the book is read again, so no order is ever filled twice,
+  - settle the fills: Fill rows, seller money, buyer items,
+    price-improvement refunds and the trade log in prices.py.
+cancel_order() takes what is left off the order with the same kind of
+conditional UPDATE before refunding it.
+"""
+
+from collections import defaultdict
+import random
+import time
+from sqlalchemy import bindparam, case, func, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from extensions import db
+from models import Fill, Order, User
+from market import _is_retryable
+from prices import record_trades
+import catalog
+import inventory
+import snapshots
+
+BUY, SELL = "buy", "sell"
+DEPTH_LEVELS = 10
+# resting orders read per round of matching
+MATCH_BATCH = 50
+ORDER_ATTEMPTS = 5
+
+def place_order(user_id: int, city_id: int, item_id: int, side: str, price: int, qty: int):
+    """Escrow, persist and match a limit order. Raises ValueError if it cannot be placed."""
+    if side not in (BUY, SELL) or price < 1 or qty < 1:
+        raise ValueError("invalid order")
+    if catalog.city_by_id(city_id) is None:
+        raise ValueError("no such city")
+    if catalog.item_by_id(item_id) is None:
+        raise ValueError("no such item")
+    return _retrying(lambda: _place_once(user_id, city_id, item_id, side, price, qty))
+
+def cancel_order(user_id: int, order_id: int):
+    """Cancel a resting order and return its escrow. Raises ValueError if it is not open."""
+    return _retrying(lambda: _cancel_once(user_id, order_id))
+
+def book_summary(city_id: int, item_id: int, levels: int = DEPTH_LEVELS):
+    """Best prices and the top price levels as [price, total quantity] pairs, best first."""
+    c = Order.__table__.c
+
+    def side(name, best):
+        return [[price, qty] for price, qty in db.session.execute(
+            select(c.price_shillings, func.sum(c.remaining))
+            .where(c.status == "open", c.city_id == city_id, c.item_id == item_id, c.side == name, c.remaining > 0)
+            .group_by(c.price_shillings).order_by(best).limit(levels)
+        )]
+
+    bids = side(BUY, c.price_shillings.desc())
+    asks = side(SELL, c.price_shillings.asc())
+    return {"best_bid": bids[0][0] if bids else None, "best_ask": asks[0][0] if asks else None,
+            "bids": bids, "asks": asks}
+
+def _retrying(attempt_once):
+    """Run attempt_once() and commit, retrying like market.buy_listing(); a ValueError rolls back."""
+    for attempt in range(1, ORDER_ATTEMPTS + 1):
+        try:
+            result = attempt_once()
+            db.session.commit()
+            return result
+        except ValueError:
+            db.session.rollback()
+            raise
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt == ORDER_ATTEMPTS or not _is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+
+def _place_once(user_id: int, city_id: int, item_id: int, side: str, price: int, qty: int):
+    if side == BUY:
+        _escrow_money(user_id, price * qty)
+    else:
+        _escrow_items(user_id, item_id, qty)
+    order = Order(user_id=user_id, city_id=city_id, item_id=item_id, side=side,
+                  price_shillings=price, quantity=qty, remaining=qty, status="open")
+    db.session.add(order)
+    db.session.flush()
+    order_id = order.id
+    fills = _match(order_id, user_id, city_id, item_id, side, price, qty)
+    remaining = qty - sum(f["qty"] for f in fills)
+    if remaining < qty:
+        orders = Order.__table__
+        db.session.execute(
+            update(orders).where(orders.c.id == order_id)
+            .values(remaining=remaining, status="open" if remaining else "filled")
+        )
+    _settle(fills)
+    return {"order_id": order_id, "remaining": remaining,
+            "fills": [{"price": f["price"], "qty": f["qty"]} for f in fills]}
+
+def _cancel_once(user_id: int, order_id: int):
+    orders = Order.__table__
+    c = orders.c
+    while True:
+        row = db.session.execute(
+            select(c.side, c.item_id, c.price_shillings, c.remaining)
+            .where(c.id == order_id, c.user_id == user_id, c.status == "open")
+        ).first()
+        if row is None:
+            raise ValueError("no such open order")
+        # only if no fill got in since the read; otherwise read it again
+        if db.session.execute(
+            update(orders).where(c.id == order_id, c.status == "open", c.remaining == row.remaining)
+            .values(remaining=0, status="cancelled")
+        ).rowcount:
+            break
+    if row.side == BUY:
+        _credit_money({user_id: row.price_shillings * row.remaining})
+    else:
+        _credit_items({(user_id, row.item_id): row.remaining})
+    return {"order_id": order_id, "refunded_qty": row.remaining}
+
+# ------ Matching ------
+def _match(order_id: int, user_id: int, city_id: int, item_id: int, side: str, price: int, qty: int):
+    """
+    Take up to `qty` off the crossing resting orders, best first, skipping
+    the trader's own orders. Returns the fills.
+    """
+    c = Order.__table__.c
+    if side == BUY:
+        opposite, crosses, best = SELL, c.price_shillings <= price, c.price_shillings.asc()
+    else:
+        opposite, crosses, best = BUY, c.price_shillings >= price, c.price_shillings.desc()
+    book = (
+        select(c.id, c.user_id, c.price_shillings, c.remaining)
+        .where(c.status == "open", c.city_id == city_id, c.item_id == item_id, c.side == opposite,
+               c.remaining > 0, crosses, c.user_id != user_id)
+        .order_by(best, c.id).limit(MATCH_BATCH)
+    )
+    fills = []
+    remaining = qty
+    while remaining:
+        tops = db.session.execute(book).all()
+        if not tops:
+            break
+        for top in tops:
+            take = min(remaining, top.remaining)
+            if not _take(top.id, take):
+                # filled or cancelled meanwhile: read the book again
+                break
+            buy_id, buyer_id, buy_limit = (order_id, user_id, price) if side == BUY else (top.id, top.user_id, top.price_shillings)
+            sell_id, seller_id = (top.id, top.user_id) if side == BUY else (order_id, user_id)
+            fills.append({
+                "buy_order_id": buy_id, "sell_order_id": sell_id,
+                "buyer_id": buyer_id, "seller_id": seller_id,
+                "city_id": city_id, "item_id": item_id,
+                "price": top.price_shillings, "buy_limit": buy_limit, "qty": take,
+            })
+            remaining -= take
+            if not remaining:
+                break
+    return fills
+
+def _take(order_id: int, qty: int):
+    """Take qty off a resting order, only if it is still open with at least qty left."""
+    orders = Order.__table__
+    c = orders.c
+    left = c.remaining - qty
+    return db.session.execute(
+        update(orders).where(c.id == order_id, c.status == "open", c.remaining >= qty)
+        .values(remaining=left, status=case((left <= 0, "filled"), else_=c.status))
+    ).rowcount
+
+# ------ Settlement ------
+def _settle(fills: list):
+    if not fills:
+        return
+    db.session.execute(insert(Fill.__table__), [
+        {"buy_order_id": f["buy_order_id"], "sell_order_id": f["sell_order_id"],
+         "buyer_id": f["buyer_id"], "seller_id": f["seller_id"],
+         "city_id": f["city_id"], "item_id": f["item_id"],
+         "price_shillings": f["price"], "quantity": f["qty"]}
+        for f in fills
+    ])
+    record_trades([dict(f, source="order_book") for f in fills])
+    money = defaultdict(int)
+    items = defaultdict(int)
+    for f in fills:
+        money[f["seller_id"]] += f["price"] * f["qty"]
+        # the buyer escrowed their limit price; give back the difference
+        if f["buy_limit"] > f["price"]:
+            money[f["buyer_id"]] += (f["buy_limit"] - f["price"]) * f["qty"]
+        items[(f["buyer_id"], f["item_id"])] += f["qty"]
+    _credit_money(money)
+    _credit_items(items)
+
+def _escrow_money(user_id: int, amount: int):
+    users = User.__table__
+    paid = db.session.execute(
+        update(users).where(users.c.id == user_id, users.c.money_shillings >= amount)
+        .values(money_shillings=users.c.money_shillings - amount)
+    ).rowcount
+    if not paid:
+        raise ValueError("not enough money")
+    snapshots.touch([user_id])
+
+def _escrow_items(user_id: int, item_id: int, qty: int):
+    inventory.change(user_id, item_id, -qty, error="not enough items")
+
+def _credit_money(amounts: dict):
+    amounts = {u: a for u, a in amounts.items() if a}
+    if not amounts:
+        return
+    users = User.__table__
+    # id order, so that two settlements crediting the same users cannot deadlock
+    db.session.execute(
+        update(users).where(users.c.id == bindparam("b_id"))
+        .values(money_shillings=users.c.money_shillings + bindparam("b_amount")),
+        [{"b_id": u, "b_amount": a} for u, a in sorted(amounts.items())],
+    )
+    snapshots.touch(amounts)
+
+def _credit_items(deltas: dict):
+    inventory.apply_deltas(deltas)
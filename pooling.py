@@ -0,0 +1,155 @@
+# pooling.py
+"""
+Database engine configuration and pool metrics.
+
+engine_options() turns the environment into SQLALCHEMY_ENGINE_OPTIONS:
+
+  - each worker's pool holds one connection per request it can serve at
+    once (1 for sync, WEB_THREADS for gthread), capped at DB_POOL_SIZE and
+    at DB_MAX_CONNECTIONS / WEB_CONCURRENCY when the server's connection
+    limit is given, plus DB_MAX_OVERFLOW temporary ones,
+  - connections are pinged on checkout and recycled after DB_POOL_RECYCLE
+    seconds (Neon and Render drop idle connections), newest first, so the
+    surplus after a burst goes idle and is recycled,
+  - psycopg 3 prepares a statement server-side once it has run
+    DB_PREPARE_THRESHOLD times on a connection,
+  - DB_PGBOUNCER=1 (PgBouncer in transaction mode, or Neon's pooled
+    endpoint) turns prepared statements off, since consecutive
+    transactions may land on different server connections.
+
+MeteredQueuePool records how long each checkout waited for a connection;
+pool_stats() reports those waits together with the live connection counts.
+"""
+
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# checkout waits, in seconds, are counted into these buckets (and +Inf)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def engine_options(uri: str, worker_mode: str = 'gthread', web_threads: int = 8):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`; SQLite keeps SQLAlchemy's defaults."""
+    if not uri.startswith('postgresql'):
+        return {}
+    env = os.environ.get
+    concurrency = {'sync': 1, 'gthread': web_threads}.get(worker_mode, int(env('DB_POOL_SIZE', 10)))
+    pool_size = min(concurrency, int(env('DB_POOL_SIZE', 10)))
+    max_connections = int(env('DB_MAX_CONNECTIONS', 0))
+    if max_connections:
+        workers = max(1, int(env('WEB_CONCURRENCY', 2)))
+        pool_size = min(pool_size, max(1, max_connections // workers))
+    pgbouncer = env('DB_PGBOUNCER', '0') == '1'
+    connect_args = {
+        'connect_timeout': int(env('DB_CONNECT_TIMEOUT', 10)),
+        'application_name': env('DB_APPLICATION_NAME', 'medieval-explorer'),
+        # None disables prepared statements altogether
+        'prepare_threshold': None if pgbouncer else int(env('DB_PREPARE_THRESHOLD', 5)),
+    }
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': int(env('DB_MAX_OVERFLOW', 0)),
+        'pool_timeout': float(env('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(env('DB_POOL_RECYCLE', 300)),
+        'pool_pre_ping': True,
+        'pool_use_lifo': True,
+        'connect_args': connect_args,
+    }
+
+def database_uri(uri: str):
+    """Point postgres URLs at the psycopg 3 driver that requirements.txt installs."""
+    for prefix in ('postgres://', 'postgresql://'):
+        if uri.startswith(prefix):
+            return 'postgresql+psycopg://' + uri[len(prefix):]
+    return uri
+
+# ------ Metrics ------
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self.timeouts = 0
+        self.connect_errors = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.invalidated = 0
+
+    def wait(self, seconds: float):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[i] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+    def count(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+_stats = _Stats()
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times every checkout, including waits for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            _stats.count('timeouts')
+            raise
+        except Exception:
+            _stats.count('connect_errors')
+            raise
+        finally:
+            _stats.wait(time.perf_counter() - started)
+
+def init_app(app, db):
+    """Count connects, disconnects and invalidations of the app's engine."""
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'connect', lambda *args: _stats.count('connects'))
+    event.listen(engine, 'close', lambda *args: _stats.count('disconnects'))
+    event.listen(engine, 'invalidate', lambda *args: _stats.count('invalidated'))
+
+def pool_stats(engine):
+    """Checkout waits since start plus the pool's current connection counts."""
+    pool = engine.pool
+    with _stats.lock:
+        stats = {
+            'checkouts': _stats.checkouts,
+            'wait_seconds_total': round(_stats.wait_seconds, 6),
+            'wait_seconds_max': round(_stats.max_wait, 6),
+            'wait_buckets': dict(zip([str(b) for b in WAIT_BUCKETS] + ['+Inf'], _stats.buckets)),
+            'timeouts': _stats.timeouts,
+            'connect_errors': _stats.connect_errors,
+            'connects': _stats.connects,
+            'disconnects': _stats.disconnects,
+            'invalidated': _stats.invalidated,
+        }
+    stats['pool'] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+    return stats
+
+def reset_stats():
+    _stats.reset()
@@ -0,0 +1,185 @@
+# prices.py
+"""
+Trade log and price history.
+
+Every trade (a listing purchase or an order-book fill) is appended to
+`trades` and folded into the PriceBar of its (item, city, turn) in the same
+transaction: a single INSERT ... ON CONFLICT DO UPDATE keeps open, high,
+low, close, volume and turnover current, so nothing is ever recomputed from
+the log. VWAP is turnover / volume.
+
+Reads go through a small per-process LRU cache. A worker drops its own
+entries as it records trades; entries written by other workers are picked
+up after PRICE_CACHE_SECONDS.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+from sqlalchemy import func, insert, select, update
+from extensions import db
+from models import PriceBar, Trade
+from game_logic import get_turn_number
+
+PRICE_CACHE_SIZE = 1024
+PRICE_CACHE_SECONDS = 5.0
+HISTORY_TURNS = 30
+MAX_HISTORY_TURNS = 365
+
+# (item_id, city_id, turns) -> (expires_at, value)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# ------ Writing ------
+def record_trade(item_id: int, city_id: int, price: int, qty: int,
+                 buyer_id: int = None, seller_id: int = None, source: str = "listing"):
+    """Log one trade at unit `price` and fold it into its price bar. The caller commits."""
+    record_trades([{
+        "item_id": item_id, "city_id": city_id, "price": price, "qty": qty,
+        "buyer_id": buyer_id, "seller_id": seller_id, "source": source,
+    }])
+
+def record_trades(trades: list):
+    """
+    Log a batch of trades (dicts with item_id, city_id, price, qty and
+    optionally buyer_id, seller_id, source), in the order they happened.
+    """
+    if not trades:
+        return
+    turn = get_turn_number()
+    db.session.execute(insert(Trade.__table__), [
+        {"item_id": t["item_id"], "city_id": t["city_id"] or 0, "turn": turn,
+         "price_shillings": t["price"], "quantity": t["qty"],
+         "buyer_id": t.get("buyer_id"), "seller_id": t.get("seller_id"),
+         "source": t.get("source", "listing")}
+        for t in trades
+    ])
+    bars = _fold(trades, turn)
+    _upsert_bars(bars)
+    _forget({(bar["item_id"], bar["city_id"]) for bar in bars})
+
+def _fold(trades: list, turn: int):
+    """Collapse a batch into one partial bar per (item, city)."""
+    bars = {}
+    for t in trades:
+        key = (t["item_id"], t["city_id"] or 0)
+        price, qty = t["price"], t["qty"]
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = {"item_id": key[0], "city_id": key[1], "turn": turn,
+                         "open": price, "high": price, "low": price, "close": price,
+                         "volume": qty, "turnover": price * qty, "trades": 1}
+            continue
+        bar["high"] = max(bar["high"], price)
+        bar["low"] = min(bar["low"], price)
+        bar["close"] = price
+        bar["volume"] += qty
+        bar["turnover"] += price * qty
+        bar["trades"] += 1
+    return list(bars.values())
+
+def _upsert_bars(bars: list):
+    bar_table = PriceBar.__table__
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        greatest, least = func.greatest, func.least
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        # SQLite's two-argument max()/min() are scalar
+        greatest, least = func.max, func.min
+    else:
+        return _upsert_bars_portable(bars)
+    stmt = dialect_insert(bar_table)
+    c, new = bar_table.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c.item_id, c.city_id, c.turn],
+        set_={
+            "high": greatest(c.high, new.high),
+            "low": least(c.low, new.low),
+            "close": new.close,
+            "volume": c.volume + new.volume,
+            "turnover": c.turnover + new.turnover,
+            "trades": c.trades + new.trades,
+        },
+    )
+    db.session.execute(stmt, bars)
+
+def _upsert_bars_portable(bars: list):
+    """Read-then-write fallback for databases without ON CONFLICT."""
+    c = PriceBar.__table__.c
+    for bar in bars:
+        key = (c.item_id == bar["item_id"], c.city_id == bar["city_id"], c.turn == bar["turn"])
+        row = db.session.execute(select(c.high, c.low).where(*key).with_for_update()).first()
+        if row is None:
+            db.session.execute(insert(PriceBar.__table__).values(**bar))
+            continue
+        db.session.execute(update(PriceBar.__table__).where(*key).values(
+            high=max(row.high, bar["high"]), low=min(row.low, bar["low"]), close=bar["close"],
+            volume=c.volume + bar["volume"], turnover=c.turnover + bar["turnover"],
+            trades=c.trades + bar["trades"],
+        ))
+
+# ------ Reading ------
+def price_history(item_id: int, city_id: int = 0, turns: int = HISTORY_TURNS):
+    """Bars of the last `turns` turns that had trades, oldest first."""
+    turns = max(1, min(int(turns), MAX_HISTORY_TURNS))
+    return _cached((item_id, city_id or 0, turns), lambda: _load_history(item_id, city_id or 0, turns))
+
+def latest_price(item_id: int, city_id: int = 0):
+    """The most recent bar with trades (any turn), or None if the item never traded there."""
+    return _cached((item_id, city_id or 0, None), lambda: _load_latest(item_id, city_id or 0))
+
+def _load_history(item_id: int, city_id: int, turns: int):
+    c = PriceBar.__table__.c
+    rows = db.session.execute(
+        select(PriceBar.__table__)
+        .where(c.item_id == item_id, c.city_id == city_id, c.turn > get_turn_number() - turns)
+        .order_by(c.turn)
+    ).all()
+    return tuple(_bar_dict(r) for r in rows)
+
+def _load_latest(item_id: int, city_id: int):
+    c = PriceBar.__table__.c
+    row = db.session.execute(
+        select(PriceBar.__table__)
+        .where(c.item_id == item_id, c.city_id == city_id)
+        .order_by(c.turn.desc()).limit(1)
+    ).first()
+    return _bar_dict(row) if row else None
+
+def _bar_dict(row):
+    return {
+        "turn": row.turn,
+        "open": row.open,
+        "high": row.high,
+        "low": row.low,
+        "close": row.close,
+        "volume": row.volume,
+        "vwap": round(row.turnover / row.volume, 2) if row.volume else None,
+        "trades": row.trades,
+    }
+
+def _cached(key, load):
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            return entry[1]
+    value = load()
+    with _cache_lock:
+        _cache[key] = (now + PRICE_CACHE_SECONDS, value)
+        _cache.move_to_end(key)
+        while len(_cache) > PRICE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+def _forget(pairs: set):
+    with _cache_lock:
+        for key in [k for k in _cache if k[:2] in pairs]:
+            del _cache[key]
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
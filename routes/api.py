@@ -1,12 +1,11 @@
 from flask import Blueprint, request, jsonify, session
 from models import User, Player, Item, Inventory
 from game_logic import consume_item, add_item_to_player
+from identity import current_user
 api_bp = Blueprint('api', __name__)
 
 def current_player():
-    uid = session.get('user_id')
-    if not uid: return None
-    u = User.query.get(uid)
+    u = current_user()
     return u.player if u else None
 
 @api_bp.route('/player')
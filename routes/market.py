@@ -1,9 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session
 from models import Listing, Item, Player
 from extensions import db
+from market import list_listings
 market_bp = Blueprint('market', __name__)
 
 @market_bp.route('/market')
 def index():
-    listings = Listing.query.order_by(Listing.created_at.desc()).limit(100).all()
-    return render_template('market.html', listings=listings)
+    listings, next_cursor = list_listings(
+        city_id=request.args.get('city_id', type=int),
+        item_id=request.args.get('item_id', type=int),
+        cursor=request.args.get('cursor'),
+    )
+    return render_template('market.html', listings=listings, next_cursor=next_cursor)
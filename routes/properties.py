@@ -1,12 +1,8 @@
 from flask import Blueprint, render_template, session, redirect, url_for
 from models import Property, User
+from identity import current_user
 prop_bp = Blueprint('properties', __name__, url_prefix='/properties')
 
-def current_user():
-    uid = session.get('user_id'); 
-    if not uid: return None
-    return User.query.get(uid)
-
 @prop_bp.route('/')
 def list_props():
     user = current_user()
@@ -0,0 +1,212 @@
+# scheduler.py
+"""
+Turn scheduler daemon.
+
+A turn is a UTC day (game_logic.get_turn_number), so the scheduler wakes
+at UTC midnight and runs the new turn through turn_engine.run_turn, out of
+band from the web workers. It also wakes every TURN_POLL_SECONDS to pick
+up turns queued by an admin (request_turn) and to resume a turn whose run
+was interrupted.
+
+Only one scheduler works at a time, cluster-wide: each pass holds a
+Postgres advisory lock (on SQLite, an exclusive lock on a file next to the
+database), and a process that cannot get it just waits for the next pass.
+A turn spans many transactions, so the lock is session-level, taken and
+released on one dedicated connection outside the pool. Through PgBouncer
+in transaction mode (DB_PGBOUNCER=1) that connection must bypass the
+bouncer: set TURN_LOCK_DATABASE_URL to a direct URL, or no pass runs.
+Progress is the turn's TurnCheckpoint row, which turn_status() reports.
+
+    $ python scheduler.py            # run forever
+    $ python scheduler.py --once     # one pass, then exit
+
+TURN_SCHEDULE=manual disables the midnight run: turns then only run when
+queued.
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import os
+import time
+from flask import current_app
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import NullPool
+from extensions import db
+from models import AppMeta, TurnCheckpoint
+from game_logic import get_turn_number
+
+TURN_REQUEST_KEY = "turn_requested"
+# pg_advisory_lock key: any constant shared by every scheduler of a database
+ADVISORY_LOCK_KEY = 0x6D6564_7475726E  # "med" "turn"
+DEFAULT_POLL_SECONDS = 30
+
+# ------ Queueing (web side) ------
+def request_turn(turn: int = None, requested_by: int = None):
+    """
+    Queue `turn` (default: today's) for the scheduler and return at once.
+    Raises ValueError if the turn has already been processed.
+    """
+    turn = get_turn_number() if turn is None else turn
+    if turn_status(turn)["phase"] == "done":
+        raise ValueError(f"Turn {turn} has already been processed.")
+    meta = db.session.get(AppMeta, TURN_REQUEST_KEY)
+    value = f"{turn}:{requested_by or ''}"
+    if meta is None:
+        db.session.add(AppMeta(key=TURN_REQUEST_KEY, value=value))
+    else:
+        meta.value = value
+    db.session.commit()
+    return turn
+
+def turn_status(turn: int = None):
+    """Where `turn` (default: today's) stands, and whether a run is queued."""
+    turn = get_turn_number() if turn is None else turn
+    checkpoint = db.session.get(TurnCheckpoint, turn)
+    queued = db.session.get(AppMeta, TURN_REQUEST_KEY)
+    return {
+        "turn": turn,
+        "phase": checkpoint.phase if checkpoint else "pending",
+        "tasks_resolved": checkpoint.tasks_resolved if checkpoint else 0,
+        "last_task_id": checkpoint.last_task_id if checkpoint else 0,
+        "started_at": _iso(checkpoint.started_at) if checkpoint else None,
+        "updated_at": _iso(checkpoint.updated_at) if checkpoint else None,
+        "finished_at": _iso(checkpoint.finished_at) if checkpoint else None,
+        "queued": int(queued.value.split(":", 1)[0]) if queued and queued.value else None,
+    }
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+# ------ Scheduling ------
+def run_pass(schedule: str = "midnight", chunk_size: int = None, workers: int = 0):
+    """
+    One scheduler pass: under the cluster-wide lock, run today's turn if it
+    is due (or queued) and not finished yet. Returns the turn run, or None.
+    """
+    with turn_lock() as acquired:
+        if not acquired:
+            print("Another scheduler holds the turn lock; skipping this pass.")
+            return None
+        turn = _due_turn(schedule)
+        if turn is None:
+            return None
+        from turn_engine import DEFAULT_CHUNK_SIZE, run_turn
+        print(f"Running turn {turn}")
+        run_turn(turn, chunk_size or DEFAULT_CHUNK_SIZE, workers)
+        return turn
+
+def _due_turn(schedule: str):
+    today = get_turn_number()
+    requested = _pop_request()
+    if requested is not None and requested != today:
+        print(f"Ignoring queued turn {requested}: today is turn {today}.")
+    checkpoint = db.session.get(TurnCheckpoint, today)
+    if checkpoint is not None and checkpoint.phase == "done":
+        return None
+    # a started checkpoint is an interrupted run: always resume it
+    if schedule == "midnight" or requested == today or checkpoint is not None:
+        return today
+    return None
+
+def _pop_request():
+    meta = db.session.get(AppMeta, TURN_REQUEST_KEY)
+    if meta is None or not meta.value:
+        return None
+    turn = int(meta.value.split(":", 1)[0])
+    meta.value = ""
+    db.session.commit()
+    return turn
+
+def seconds_until_midnight(now: datetime = None):
+    now = now or datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+def run_forever(schedule: str = "midnight", poll_seconds: float = DEFAULT_POLL_SECONDS,
+                chunk_size: int = None, workers: int = 0):
+    print(f"Turn scheduler started ({schedule}); turn {get_turn_number()}, "
+          f"next midnight in {seconds_until_midnight() / 3600:.1f}h")
+    while True:
+        try:
+            run_pass(schedule, chunk_size, workers)
+        except Exception as e:
+            # the checkpoint keeps the progress; the next pass resumes
+            db.session.rollback()
+            print(f"Turn run failed: {e!r}")
+        finally:
+            db.session.remove()
+        # wake just after midnight, or at the next poll, whichever comes first
+        time.sleep(min(poll_seconds, seconds_until_midnight() + 1))
+
+# ------ Cluster-wide lock ------
+@contextmanager
+def turn_lock():
+    """Yields True while this process is the only one allowed to run turns."""
+    if db.engine.dialect.name == "postgresql":
+        with _advisory_lock() as acquired:
+            yield acquired
+    else:
+        with _file_lock() as acquired:
+            yield acquired
+
+@contextmanager
+def _advisory_lock():
+    # session-level lock, held by a server connection of its own for the whole run
+    engine = create_engine(_lock_url(), poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            acquired = conn.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_KEY))).scalar()
+            conn.commit()
+            try:
+                yield bool(acquired)
+            finally:
+                if acquired:
+                    conn.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_KEY)))
+                    conn.commit()
+    finally:
+        engine.dispose()
+
+def _lock_url():
+    from pooling import database_uri
+    url = current_app.config.get("TURN_LOCK_DATABASE_URL")
+    if url:
+        return database_uri(url)
+    if os.environ.get("DB_PGBOUNCER", "0") == "1":
+        # lock and unlock could reach different server connections
+        raise RuntimeError("DB_PGBOUNCER=1: set TURN_LOCK_DATABASE_URL to a direct database URL")
+    return db.engine.url
+
+@contextmanager
+def _file_lock():
+    import fcntl
+    database = db.engine.url.database
+    path = (database if database and database != ":memory:" else "medieval") + ".turn.lock"
+    with open(path, "a") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run turns at UTC midnight, or when queued.")
+    parser.add_argument('--once', action='store_true', help="run a single pass and exit")
+    parser.add_argument('--schedule', choices=['midnight', 'manual'],
+                        default=os.environ.get('TURN_SCHEDULE', 'midnight'))
+    parser.add_argument('--poll', type=float, default=float(os.environ.get('TURN_POLL_SECONDS', DEFAULT_POLL_SECONDS)))
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('TURN_WORKERS', 0)))
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        if args.once:
+            run_pass(args.schedule, args.chunk_size, args.workers)
+        else:
+            run_forever(args.schedule, args.poll, args.chunk_size, args.workers)
@@ -1,6 +1,7 @@
 # seed_items.py
 from extensions import db
 from models import Item
+import catalog
 
 items_data = [
     {"key": "chestnut", "name": "Chestnut", "edible_hunger": 1,
@@ -47,6 +48,7 @@ def seed_items():
         else:
             print(f"Skipped existing: {data['name']}")
     db.session.commit()
+    catalog.invalidate()
     print("✅ Item seeding complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+# snapshots.py
+"""
+Per-player state snapshots.
+
+A snapshot is one compact JSON blob per player (stats, money, location and
+inventory as item id -> qty) stored in `player_snapshots` with an ETag,
+the hash of the blob. /api/player serves it as is and /game renders from
+it, so neither loads the User and Inventory ORM graph.
+
+Snapshots are rebuilt as part of every transaction that changes a player:
+  - mutation helpers that write with Core statements (inventory.apply_deltas,
+    market purchases, order-book escrow, the bulk turn writer) call
+    touch(user_ids),
+  - User and Inventory objects changed through the ORM are picked up at
+    flush,
+  - just before the commit, the touched players' snapshots are rebuilt with
+    two queries and one upsert per REBUILD_CHUNK players, so the new state
+    and its snapshot commit (or roll back) together,
+  - set-wise updates of every player (the starvation pass) call
+    touch_all() instead: the commit deletes every snapshot with one
+    statement and each is rebuilt by its player's next read, so a turn
+    costs no per-player work.
+
+Reads go through a per-process LRU cache. A worker drops its own entries
+when it commits a rebuild; changes made by other processes are picked up
+after SNAPSHOT_CACHE_SECONDS. A cache hit costs no query, so a poll whose
+If-None-Match still matches is answered 304 without touching the database.
+"""
+
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Inventory, PlayerSnapshot, SHILLINGS_PER_POUND, User
+
+SNAPSHOT_CACHE_SIZE = 10000
+SNAPSHOT_CACHE_SECONDS = 2.0
+REBUILD_CHUNK = 1000
+# every player is at the harbour until travel is modelled per player
+DEFAULT_CITY = "ocean_view"
+
+Snapshot = namedtuple("Snapshot", "etag data body")
+
+_STAT_COLUMNS = ("level", "health", "max_health", "hunger", "max_hunger",
+                 "intelligence", "virtue", "money_shillings")
+
+_ALL = "all"
+_TOUCHED = "snapshots_touched"
+_REBUILT = "snapshots_rebuilt"
+
+# user_id -> (expires_at, Snapshot)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# ------ Reading ------
+def get(user_id: int):
+    """The player's Snapshot, or None if there is no such user."""
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry and entry[0] > now:
+            _cache.move_to_end(user_id)
+            return entry[1]
+    snapshot = _load(user_id)
+    if snapshot is not None:
+        with _cache_lock:
+            _cache[user_id] = (now + SNAPSHOT_CACHE_SECONDS, snapshot)
+            _cache.move_to_end(user_id)
+            while len(_cache) > SNAPSHOT_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return snapshot
+
+def _load(user_id: int):
+    row = db.session.execute(
+        select(PlayerSnapshot.etag, PlayerSnapshot.data).where(PlayerSnapshot.user_id == user_id)
+    ).first()
+    if row is None:
+        # first read since the snapshot was dropped: build it now and keep it,
+        # unless a writer stored a newer one meanwhile
+        built = _rebuild([user_id], overwrite=False)
+        db.session.commit()
+        if user_id not in built:
+            return None
+        row = built[user_id]
+    return Snapshot(row[0], json.loads(row[1]), row[1])
+
+class PlayerView:
+    """Read-only player for templates: snapshot fields as attributes."""
+
+    def __init__(self, data: dict):
+        self.__dict__.update(data)
+        self.items = {int(item_id): qty for item_id, qty in data["inventory"].items()}
+
+    def __getattr__(self, name):
+        # fields the snapshot does not carry read as unset
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+    def display_money(self):
+        pounds, shillings = divmod(self.money_shillings or 0, SHILLINGS_PER_POUND)
+        return f"£{pounds} {shillings}s"
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+# ------ Invalidation ------
+def touch(user_ids, session=None):
+    """Rebuild these players' snapshots when the current transaction commits."""
+    info = (session or db.session).info
+    touched = info.setdefault(_TOUCHED, set())
+    if touched is not _ALL:
+        touched.update(user_ids)
+
+def touch_all(session=None):
+    """Drop every snapshot at commit, to be rebuilt on read (for set-wise updates of all users)."""
+    (session or db.session).info[_TOUCHED] = _ALL
+
+@event.listens_for(Session, "after_flush")
+def _touch_changed(session, flush_context):
+    # new/dirty/deleted still list what this flush wrote, now with ids
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            user_ids.add(obj.id)
+        elif isinstance(obj, Inventory) and obj.user_id is not None:
+            user_ids.add(obj.user_id)
+    if user_ids:
+        touch(user_ids, session)
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_touched(session):
+    # ORM changes still pending are part of this commit too
+    session.flush()
+    touched = session.info.pop(_TOUCHED, None)
+    if not touched:
+        return
+    if touched is _ALL:
+        # _load() rebuilds a missing snapshot on its first read
+        session.execute(delete(PlayerSnapshot))
+        session.info[_REBUILT] = _ALL
+        return
+    rebuilt = set(_rebuild(sorted(touched), session))
+    session.info.setdefault(_REBUILT, set()).update(rebuilt)
+
+@event.listens_for(Session, "after_commit")
+def _forget_rebuilt(session):
+    rebuilt = session.info.pop(_REBUILT, None)
+    if rebuilt is _ALL:
+        clear_cache()
+    elif rebuilt:
+        with _cache_lock:
+            for user_id in rebuilt:
+                _cache.pop(user_id, None)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_touched(session):
+    session.info.pop(_TOUCHED, None)
+    session.info.pop(_REBUILT, None)
+
+# ------ Building ------
+def _rebuild(user_ids: list, session=None, overwrite: bool = True):
+    """
+    Build and store the snapshots of `user_ids`. Returns {user_id: (etag, body)}.
+    overwrite=False keeps snapshots that already exist.
+    """
+    session = session or db.session
+    built = {}
+    for start in range(0, len(user_ids), REBUILD_CHUNK):
+        built.update(_rebuild_chunk(session, user_ids[start:start + REBUILD_CHUNK], overwrite))
+    return built
+
+def _rebuild_chunk(session, user_ids: list, overwrite: bool = True):
+    users = session.execute(
+        select(User.id, User.username, User.is_admin, *(getattr(User, c) for c in _STAT_COLUMNS))
+        .where(User.id.in_(user_ids))
+    ).all()
+    inventories = {u.id: {} for u in users}
+    for user_id, item_id, qty in session.execute(
+        select(Inventory.user_id, Inventory.item_id, Inventory.quantity)
+        .where(Inventory.user_id.in_(user_ids), Inventory.quantity > 0)
+        .order_by(Inventory.user_id, Inventory.item_id)
+    ):
+        inventories[user_id][str(item_id)] = qty
+    built = {}
+    for u in users:
+        data = {"id": u.id, "nickname": u.username, "city": DEFAULT_CITY, "is_admin": bool(u.is_admin)}
+        data.update({c: getattr(u, c) or 0 for c in _STAT_COLUMNS})
+        data["inventory"] = inventories[u.id]
+        body = json.dumps(data, separators=(",", ":"))
+        built[u.id] = (hashlib.sha1(body.encode()).hexdigest()[:20], body)
+    gone = set(user_ids) - set(built)
+    if gone:
+        # players deleted since their last snapshot
+        session.execute(delete(PlayerSnapshot).where(PlayerSnapshot.user_id.in_(gone)))
+    if built:
+        _store(session, [{"user_id": u, "etag": etag, "data": body, "updated_at": datetime.utcnow()}
+                         for u, (etag, body) in built.items()], overwrite)
+    return built
+
+def _store(session, rows: list, overwrite: bool = True):
+    table = PlayerSnapshot.__table__
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        if overwrite:
+            session.execute(delete(table).where(table.c.user_id.in_([r["user_id"] for r in rows])))
+        else:
+            kept = set(session.execute(
+                select(table.c.user_id).where(table.c.user_id.in_([r["user_id"] for r in rows]))
+            ).scalars())
+            rows = [r for r in rows if r["user_id"] not in kept]
+        if rows:
+            session.execute(insert(table), rows)
+        return
+    stmt = dialect_insert(table)
+    if not overwrite:
+        session.execute(stmt.on_conflict_do_nothing(index_elements=[table.c.user_id]), rows)
+        return
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={"etag": stmt.excluded.etag, "data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+    )
+    session.execute(stmt, rows)
@@ -1 +1,47 @@
 console.log('game.js loaded');
+
+// Live updates over server-sent events (/api/events). Each event is re-dispatched
+// on document as 'medieval:<event>' so pages can react (the tavern page polls
+// its feed on 'medieval:message'). When the server does not stream (sync or
+// gthread workers), 'medieval:message' fires every POLL_MS instead.
+(function () {
+  const POLL_MS = 10000;
+  function poll() {
+    setInterval(function () { document.dispatchEvent(new CustomEvent('medieval:message', { detail: {} })); }, POLL_MS);
+  }
+  if (!window.EventSource || document.body.dataset.liveEvents !== '1') { poll(); return; }
+  const params = new URLSearchParams(window.location.search);
+  const source = new EventSource('/api/events?location=' + encodeURIComponent(params.get('location') || 'ocean_view'));
+
+  function relay(name) {
+    source.addEventListener(name, function (e) {
+      const payload = JSON.parse(e.data);
+      document.dispatchEvent(new CustomEvent('medieval:' + name, { detail: payload }));
+    });
+  }
+  ['message', 'news', 'turn'].forEach(relay);
+  source.addEventListener('error', function () {
+    // refused for good (e.g. a 204): fall back to polling
+    if (source.readyState === EventSource.CLOSED) poll();
+  });
+
+  function toast(text) {
+    const box = document.createElement('div');
+    box.className = 'panel pixel-border';
+    box.style.cssText = 'position:fixed;bottom:12px;right:12px;max-width:320px;z-index:10;';
+    box.textContent = text;
+    document.body.appendChild(box);
+    setTimeout(function () { box.remove(); }, 8000);
+  }
+
+  document.addEventListener('medieval:news', function (e) {
+    toast('📜 ' + e.detail.data.title);
+  });
+  document.addEventListener('medieval:turn', function (e) {
+    // the location page shows the turn and the boat: refresh it, elsewhere just announce
+    // (spread over a few seconds so every player does not reload at once)
+    if (window.location.pathname === '/game') setTimeout(function () { window.location.reload(); }, Math.random() * 5000);
+    else toast('☀ Turn ' + e.detail.data.turn + ' has begun.');
+  });
+  window.addEventListener('beforeunload', function () { source.close(); });
+})();
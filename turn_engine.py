@@ -0,0 +1,160 @@
+"""
+Chunked, resumable turn engine.
+
+A turn runs as a fixed sequence of phases: tasks, boats, hunger, news.
+Due tasks are resolved in id-ordered chunks, each chunk in its own
+transaction. Every commit also moves the turn's TurnCheckpoint row forward,
+so a run that crashed or was killed can simply be started again: it resumes
+at the phase (and, for tasks, after the last task id) where it stopped, and
+a turn that already finished is left alone.
+
+Every task rolls with its own RNG per (turn, task id): the same turn replays
+to the same task results however many workers run it. With workers > 0 each
+chunk is rolled across a process pool, partitioned by user_id.
+
+    $ python turn_engine.py [--turn N] [--chunk-size 500] [--workers 4]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import News, TurnCheckpoint
+import instrumentation
+from game_logic import (
+    TurnTimer, _process_boats, _resolve_tasks_bulk, apply_starvation, get_turn_number, publish_turn_events,
+    queue_turn_jobs,
+)
+
+PHASES = ("tasks", "boats", "hunger", "news")
+DEFAULT_CHUNK_SIZE = 500
+
+def run_turn(turn: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 0):
+    """
+    Run (or resume) every remaining phase of `turn`. Returns its TurnCheckpoint.
+    workers=0 rolls tasks in-process; workers>=1 uses a process pool. Both
+    roll with the same per-task RNGs.
+    """
+    turn = get_turn_number() if turn is None else turn
+    checkpoint = get_checkpoint(turn)
+    if checkpoint.phase == "done":
+        print(f"Turn {turn} already processed.")
+        return checkpoint
+    if checkpoint.phase != "tasks" or checkpoint.last_task_id:
+        print(f"Resuming turn {turn} at phase '{checkpoint.phase}' after task {checkpoint.last_task_id}")
+    timer = TurnTimer(f"Turn {turn}")
+    runner = _Runner(chunk_size, workers, timer)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) if workers else nullcontext() as pool:
+            runner.pool = pool
+            for phase in PHASES[PHASES.index(checkpoint.phase):]:
+                _PHASE_RUNNERS[phase](checkpoint, runner)
+    except Exception:
+        db.session.rollback()
+        print(f"Turn {turn} stopped in phase '{checkpoint.phase}'; run again to resume.")
+        raise
+    timer.report()
+    instrumentation.record_turn(turn, timer.timings)
+    return checkpoint
+
+def get_checkpoint(turn: int):
+    """Fetch the checkpoint row for `turn`, creating it on first use."""
+    checkpoint = db.session.get(TurnCheckpoint, turn)
+    if checkpoint:
+        return checkpoint
+    db.session.add(TurnCheckpoint(turn=turn, phase=PHASES[0], last_task_id=0, tasks_resolved=0))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another runner created it first
+        db.session.rollback()
+    return db.session.get(TurnCheckpoint, turn)
+
+def _advance(checkpoint: TurnCheckpoint, phase: str = None):
+    """Commit the current transaction together with the checkpoint's new position."""
+    now = datetime.utcnow()
+    if phase:
+        checkpoint.phase = phase
+        if phase == "done":
+            checkpoint.finished_at = now
+    checkpoint.updated_at = now
+    db.session.commit()
+
+class _Runner:
+    """Settings shared by the phases of one run."""
+
+    def __init__(self, chunk_size: int, workers: int, timer: TurnTimer):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.timer = timer
+        self.pool = None
+
+# ------ Phases ------
+# Each phase commits its work, and the jobs it queues, in the same
+# transaction that moves the checkpoint past it, so no phase is ever
+# applied twice for one turn and none of its jobs can be lost.
+def _run_tasks(checkpoint: TurnCheckpoint, runner: _Runner):
+    timer = runner.timer
+    while True:
+        resolved, last_id = _resolve_tasks_bulk(
+            checkpoint.turn, timer, after_id=checkpoint.last_task_id, limit=runner.chunk_size,
+            pool=runner.pool, workers=runner.workers,
+        )
+        if last_id == checkpoint.last_task_id:
+            break
+        checkpoint.last_task_id = last_id
+        checkpoint.tasks_resolved = (checkpoint.tasks_resolved or 0) + resolved
+        with timer.phase("commit"):
+            _advance(checkpoint)
+    _advance(checkpoint, "boats")
+
+def _run_boats(checkpoint: TurnCheckpoint, runner: _Runner):
+    with runner.timer.phase("boats"):
+        news_created = []
+        # Boat.last_moved_turn already makes this safe to repeat.
+        _process_boats(checkpoint.turn, news_created, commit=False)
+        for n in news_created:
+            db.session.add(News(title=n["title"], body=n["body"], meta=n.get("meta", {})))
+        queue_turn_jobs(checkpoint.turn, news_created, done=False)
+        _advance(checkpoint, "hunger")
+
+def _run_hunger(checkpoint: TurnCheckpoint, runner: _Runner):
+    with runner.timer.phase("hunger"):
+        result = apply_starvation(reset_hunger=True)
+        _advance(checkpoint, "news")
+    print(f"Starvation: {result['starved']} starved, {len(result['died'])} died")
+
+def _run_news(checkpoint: TurnCheckpoint, runner: _Runner):
+    with runner.timer.phase("news"):
+        news = {
+            "title": f"Turn {checkpoint.turn} processed",
+            "body": f"{checkpoint.tasks_resolved or 0} tasks resolved.",
+            "meta": {"turn": checkpoint.turn},
+        }
+        db.session.add(News(**news))
+        queue_turn_jobs(checkpoint.turn, [news])
+        _advance(checkpoint, "done")
+    publish_turn_events(checkpoint.turn)
+
+_PHASE_RUNNERS = {
+    "tasks": _run_tasks,
+    "boats": _run_boats,
+    "hunger": _run_hunger,
+    "news": _run_news,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run or resume a turn.")
+    parser.add_argument('--turn', type=int, default=None, help="turn number (default: today's)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('TURN_WORKERS', 0)),
+                        help="processes rolling tasks (0: in-process)")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        run_turn(args.turn, args.chunk_size, args.workers)
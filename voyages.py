@@ -0,0 +1,222 @@
+# voyages.py
+"""
+Boat voyages.
+
+Every route (a boat's ordered list of city keys) is compiled once into a
+leg table: for leg i, from city id, to city id, whether the leg is immune
+and its stuck probability. Compiled tables are cached per route and
+catalog version, so the turn step and the ETA projections never touch the
+JSON route or compare city names again.
+
+Rules, the same for the turn engine and the legacy resolver:
+  - a boat moves one leg per turn,
+  - a leg between two IMMUNE_BOAT_LEG_CITIES never gets a boat stuck; any
+    other leg does with probability BOAT_STUCK_CHANCE when the boat tries
+    to leave,
+  - a stuck boat stays put, then moves on once it has been stuck for
+    BOAT_MAX_STUCK_TURNS turns. A stuck leg therefore costs
+    BOAT_MAX_STUCK_TURNS extra turns.
+
+advance_boats() steps every boat for a turn at once: one query loads them
+all, the stuck rolls use boat_rng(turn, boat id) so replaying a turn
+replays them, and one executemany writes the new positions back.
+project() turns a boat's state and leg table into earliest, expected and
+latest arrival turns at the coming stops; plan() picks the best boat
+between two cities from those projections.
+"""
+
+from collections import namedtuple
+import random
+import threading
+from sqlalchemy import bindparam, select, update
+from extensions import db
+from models import Boat
+import catalog
+
+# Boat immune legs set: any pair among these is immune (no stuck)
+IMMUNE_BOAT_LEG_CITIES = {"ocean_view", "not_new_eden", "beautiful_forest"}
+BOAT_STUCK_CHANCE = 0.5
+BOAT_MAX_STUCK_TURNS = 2
+DEFAULT_ETA_TURNS = 10
+MAX_ETA_TURNS = 60
+
+LegTable = namedtuple("LegTable", "keys city_ids immune stuck_chance")
+BoatState = namedtuple("BoatState", "id key route current_index stuck stuck_turns last_moved_turn")
+
+# (route tuple, catalog version) -> LegTable
+_legs = {}
+_legs_lock = threading.Lock()
+
+# ------ Leg tables ------
+def compile_route(route) -> LegTable:
+    """The leg table of `route`, with city ids from the catalog (cached)."""
+    route = tuple(route or ())
+    key = (route, catalog.get_snapshot().version)
+    table = _legs.get(key)
+    if table is None:
+        table = build_leg_table(route, _city_id)
+        with _legs_lock:
+            _legs[key] = table
+    return table
+
+def build_leg_table(route, city_id=lambda key: None) -> LegTable:
+    """Leg i runs from stop i to stop i + 1 (wrapping). Needs no database."""
+    route = tuple(route or ())
+    n = len(route)
+    immune = tuple(
+        route[i] in IMMUNE_BOAT_LEG_CITIES and route[(i + 1) % n] in IMMUNE_BOAT_LEG_CITIES
+        for i in range(n)
+    )
+    stuck_chance = tuple(0.0 if leg_immune else BOAT_STUCK_CHANCE for leg_immune in immune)
+    return LegTable(route, tuple(city_id(k) for k in route), immune, stuck_chance)
+
+def _city_id(key: str):
+    city = catalog.city_by_key(key)
+    return city.id if city else None
+
+def _city_name(key: str):
+    city = catalog.city_by_key(key)
+    return city.name if city else key
+
+def boat_rng(turn: int, boat_id: int):
+    """Private RNG for one boat in one turn: replaying the turn replays the roll."""
+    return random.Random(f"boat:{turn}:{boat_id}")
+
+# ------ Turn step ------
+def load_boats():
+    c = Boat.__table__.c
+    return [BoatState(*row) for row in db.session.execute(
+        select(c.id, c.key, c.route, c.current_index, c.stuck, c.stuck_turns, c.last_moved_turn).order_by(c.id)
+    )]
+
+def advance_boats(turn: int, news_accumulator: list = None):
+    """
+    Step every boat that has not moved in `turn` yet. Appends news dicts to
+    news_accumulator and returns the number of boats stepped. Does not commit.
+    """
+    boats = [b for b in load_boats() if b.route and b.last_moved_turn != turn]
+    if not boats:
+        return 0
+    tables = [compile_route(b.route) for b in boats]
+    index = [b.current_index % len(t.keys) for b, t in zip(boats, tables)]
+    stuck = [bool(b.stuck) for b in boats]
+    stuck_turns = [b.stuck_turns or 0 for b in boats]
+    chance = [t.stuck_chance[i] for t, i in zip(tables, index)]
+    roll = [boat_rng(turn, b.id).random() for b in boats]
+    moves, caught, stuck_turns = step(stuck, stuck_turns, chance, roll)
+
+    rows = []
+    news = news_accumulator if news_accumulator is not None else []
+    for k, (boat, table) in enumerate(zip(boats, tables)):
+        here, there = table.keys[index[k]], table.keys[(index[k] + 1) % len(table.keys)]
+        if moves[k]:
+            rows.append({"b_id": boat.id, "b_index": (index[k] + 1) % len(table.keys),
+                         "b_stuck": False, "b_stuck_turns": 0})
+            news.append({
+                "title": f"{boat.key} arrived at {_city_name(there)}",
+                "body": f"The {boat.key} is now at {_city_name(there)}.",
+            })
+        else:
+            rows.append({"b_id": boat.id, "b_index": index[k], "b_stuck": True,
+                         "b_stuck_turns": stuck_turns[k]})
+            if caught[k]:
+                news.append({
+                    "title": f"{boat.key} stuck at sea",
+                    "body": f"The {boat.key} got stuck between {_city_name(here)} and {_city_name(there)}.",
+                })
+    boats_table = Boat.__table__
+    db.session.execute(
+        update(boats_table).where(boats_table.c.id == bindparam("b_id")).values(
+            current_index=bindparam("b_index"), stuck=bindparam("b_stuck"),
+            stuck_turns=bindparam("b_stuck_turns"), last_moved_turn=turn,
+        ),
+        rows,
+    )
+    # the statement above bypasses the identity map
+    db.session.expire_all()
+    return len(boats)
+
+def step(stuck: list, stuck_turns: list, chance: list, roll: list):
+    """
+    The stuck rules over arrays of boats, one element per boat: whether it
+    is stuck, for how many turns, the stuck chance of its current leg and
+    its roll in [0, 1). Returns (moves, caught, new stuck_turns) arrays.
+    """
+    n = len(stuck)
+    freed = [stuck[k] and stuck_turns[k] >= BOAT_MAX_STUCK_TURNS for k in range(n)]
+    held = [stuck[k] and not freed[k] for k in range(n)]
+    caught = [not stuck[k] and roll[k] < chance[k] for k in range(n)]
+    moves = [not (held[k] or caught[k]) for k in range(n)]
+    turns = [stuck_turns[k] + 1 if held[k] else 1 if caught[k] else 0 for k in range(n)]
+    return moves, caught, turns
+
+# ------ Projections ------
+def project(boat: BoatState, turn: int, turns: int = DEFAULT_ETA_TURNS):
+    """
+    Coming stops of `boat` whose earliest arrival is within `turns` turns
+    of `turn`: [{"city", "city_id", "earliest", "expected", "latest"}],
+    arrival turns included, in route order.
+    """
+    table = compile_route(boat.route)
+    n = len(table.keys)
+    if not n:
+        return []
+    # the next step happens in this turn's run, unless that already ran
+    start = turn + 1 if boat.last_moved_turn == turn else turn
+    if boat.stuck:
+        start += max(0, BOAT_MAX_STUCK_TURNS - (boat.stuck_turns or 0))
+    earliest = expected = latest = start
+    i = boat.current_index % n
+    stops = []
+    while earliest <= turn + turns:
+        # a stuck boat's delay is already in `start`: once freed it moves
+        p = 0.0 if boat.stuck and not stops else table.stuck_chance[i]
+        expected += p * BOAT_MAX_STUCK_TURNS
+        if p:
+            latest += BOAT_MAX_STUCK_TURNS
+        i = (i + 1) % n
+        stops.append({"city": table.keys[i], "city_id": table.city_ids[i],
+                      "earliest": earliest, "expected": round(expected, 2), "latest": latest})
+        earliest, expected, latest = earliest + 1, expected + 1, latest + 1
+    return stops
+
+def eta(turn: int, turns: int = DEFAULT_ETA_TURNS, city: str = None):
+    """Projections for every boat, optionally only the stops at `city`."""
+    turns = max(1, min(int(turns), MAX_ETA_TURNS))
+    result = []
+    for boat in load_boats():
+        table = compile_route(boat.route)
+        stops = project(boat, turn, turns)
+        if city is not None:
+            stops = [s for s in stops if s["city"] == city]
+        result.append({
+            "boat": boat.key,
+            "at": table.keys[boat.current_index % len(table.keys)] if table.keys else None,
+            "stuck": bool(boat.stuck),
+            "stops": stops,
+        })
+    return result
+
+def plan(origin: str, destination: str, turn: int, turns: int = MAX_ETA_TURNS):
+    """
+    The best boat from `origin` to `destination`: board at its next call at
+    origin, ride to destination. Returns the leg with the lowest expected
+    arrival, or None when no boat links the two within `turns` turns.
+    """
+    best = None
+    for boat in load_boats():
+        stops = project(boat, turn, turns)
+        if boat.route and not boat.stuck and boat.route[boat.current_index % len(boat.route)] == origin:
+            # boarding where the boat lies now
+            stops = [{"city": origin, "earliest": turn, "expected": turn, "latest": turn}] + stops
+        for k, board in enumerate(stops):
+            if board["city"] != origin:
+                continue
+            arrive = next((s for s in stops[k + 1:] if s["city"] == destination), None)
+            if arrive is None:
+                continue
+            option = {"boat": boat.key, "board": board, "arrive": arrive}
+            if best is None or arrive["expected"] < best["arrive"]["expected"]:
+                best = option
+            break
+    return best